@@ -11,6 +11,9 @@
 
 """
 from .auth import Auth, WrongHashAlgorithm  # noqa
+from .middleware import AuthMiddleware  # noqa
+from .sessions import SessionStore  # noqa
+from .tenants import TenantRouter  # noqa
 from .setups.setup_for_bottle import setup_for_bottle  # noqa
 from .setups.setup_for_flask import setup_for_flask  # noqa
 from .setups.setup_for_shake import setup_for_shake  # noqa
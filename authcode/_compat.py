@@ -11,6 +11,7 @@ _identity = lambda x: x
 
 if PY2:
     text_type = unicode
+    string_types = (str, unicode)
 
     def to_bytes(x, charset='utf8', errors='ignore'):
         if x is None:
@@ -22,6 +23,7 @@ if PY2:
         raise TypeError('Expected bytes')
 else:
     text_type = str
+    string_types = (str, )
 
     def to_bytes(x, charset='utf8', errors='ignore'):
         if x is None:
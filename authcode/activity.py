@@ -0,0 +1,109 @@
+# coding=utf-8
+"""
+    Coalesced "last seen" tracking of the authenticated users.
+
+    `Auth.get_user` reports every user it loads to the tracker, but each
+    user is written at most once every ``interval`` seconds, and the
+    timestamps are written in batches, with one UPDATE statement each,
+    by a background thread.
+
+    The user model must have a ``DateTime`` column for it, eg::
+
+        class UserMixin(object):
+            last_seen = Column(DateTime, nullable=True)
+
+        auth = Auth(SECRET_KEY, db=db, UserMixin=UserMixin,
+                    activity_tracker=ActivityTracker())
+
+"""
+from datetime import datetime, timedelta
+import logging
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .utils import BackgroundWriter, LRUCache
+
+
+class ActivityTracker(BackgroundWriter):
+    """
+    :interval: min seconds between updates of the same user.
+    :flush_interval: max seconds a timestamp waits to be written.
+    :batch_size: max number of users updated in one statement.
+    :column: name of the column of the user model.
+    :maxsize: max number of recently-updated users remembered.
+    """
+
+    thread_name = 'authcode-activity-tracker'
+
+    def __init__(self, interval=5 * 60, flush_interval=30, batch_size=1000,
+                 column='last_seen', maxsize=100000):
+        super(ActivityTracker, self).__init__(flush_interval)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.column = column
+        self.pending = {}
+        self.engines = {}
+        self.recent = LRUCache(maxsize=maxsize, ttl=interval)
+        self.written = 0
+
+    def touch(self, auth, user, now=None):
+        """Record that the user has been seen now."""
+        table = user.__table__
+        key = (table.name, user.id)
+        if key in self.recent:
+            return
+        now = now or datetime.utcnow()
+        self.recent.set(key, True)
+
+        last_seen = getattr(user, self.column, None)
+        if last_seen and now - last_seen < timedelta(seconds=self.interval):
+            return
+        # Update the loaded object without making the session dirty
+        set_committed_value(user, self.column, now)
+
+        with self._lock:
+            if table not in self.engines:
+                self.engines[table] = auth.db.engine
+            self.pending.setdefault(table, {})[user.id] = now
+        self._ensure_writer()
+
+    def flush(self):
+        """Write all the pending timestamps now.
+        Returns the number of users updated."""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        count = 0
+        for table, timestamps in pending.items():
+            count += self._write(table, timestamps)
+        self.written += count
+        return count
+
+    def _write(self, table, timestamps):
+        column = self.column
+        stmt = (
+            table.update()
+            .where(table.c.id == bindparam('_id'))
+            .values({column: bindparam('_last_seen')})
+        )
+        rows = [{'_id': uid, '_last_seen': dt} for uid, dt in timestamps.items()]
+        try:
+            with self.engines[table].begin() as conn:
+                for i in range(0, len(rows), self.batch_size):
+                    conn.execute(stmt, rows[i:i + self.batch_size])
+        except Exception:
+            logger = logging.getLogger(__name__)
+            logger.exception(u'Could not update `{0}` of {1} users'.format(
+                column, len(rows)))
+            self._requeue(table, timestamps)
+            return 0
+        return len(rows)
+
+    def _requeue(self, table, timestamps):
+        # Try again in the next flush, without overwriting the
+        # users touched again in the meantime.
+        with self._lock:
+            pending = self.pending.setdefault(table, {})
+            for uid, dt in timestamps.items():
+                if uid not in pending or pending[uid] < dt:
+                    pending[uid] = dt
@@ -0,0 +1,145 @@
+# coding=utf-8
+"""
+    Structured audit log of authentication events.
+
+    Events are added to a bounded in-memory buffer and written in batches
+    by a background thread, so emitting one never blocks a request on I/O.
+    If the buffer is full, the oldest events are dropped (and counted).
+
+    Usage::
+
+        audit_log = AuditLog(JSONLinesSink('/var/log/app/audit.jsonl'))
+        auth = Auth(SECRET_KEY, db=db, audit_log=audit_log)
+
+"""
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import random
+from time import time
+
+from .utils import BackgroundWriter
+
+
+class AuditLog(BackgroundWriter):
+    """
+    :sink: where the events are written. Any object with a
+        ``write(events)`` method that takes a list of dicts.
+    :maxsize: max number of events in the buffer.
+    :batch_size: max number of events written at a time. The writer
+        is woken up as soon as this many events are waiting.
+    :flush_interval: max seconds an event waits in the buffer.
+    :sample_rates: a dict of ``{event_name: rate}``, with rates between
+        0 and 1, to keep only a fraction of the high-volume events.
+    """
+
+    thread_name = 'authcode-audit-log'
+
+    def __init__(self, sink, maxsize=10000, batch_size=500,
+                 flush_interval=1.0, sample_rates=None):
+        super(AuditLog, self).__init__(flush_interval)
+        self.sink = sink
+        self.batch_size = batch_size
+        self.sample_rates = sample_rates or {}
+        self.buffer = deque(maxlen=maxsize)
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+
+    def emit(self, event, user_id=None, **data):
+        """Add an event to the buffer. Never blocks on I/O."""
+        rate = self.sample_rates.get(event)
+        if rate is not None and random.random() >= rate:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append({
+            'event': event,
+            'user_id': user_id,
+            'at': time(),
+            'data': data,
+        })
+        self.emitted += 1
+        self._ensure_writer()
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all the buffered events now."""
+        with self._lock:
+            while self.buffer:
+                batch = []
+                while self.buffer and len(batch) < self.batch_size:
+                    batch.append(self.buffer.popleft())
+                try:
+                    self.sink.write(batch)
+                    self.written += len(batch)
+                except Exception:
+                    self.errors += 1
+                    logger = logging.getLogger(__name__)
+                    logger.exception(u'Could not write {0} audit events'.format(len(batch)))
+
+
+class MemorySink(object):
+    """Keeps the events in a list. Useful for testing."""
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, events):
+        self.events.extend(events)
+
+
+class JSONLinesSink(object):
+    """Appends the events to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events):
+        lines = [json.dumps(event, default=str, sort_keys=True) for event in events]
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+class SQLSink(object):
+    """Inserts the events in a database table, a batch in a single
+    statement, with its own connection (not the session of the requests).
+
+    :engine: a SQLAlchemy engine, or a database object with an ``engine``.
+    :tablename: name of the table. If it doesn't exist, it's created
+        with the first write (or call `create_table` to do it before).
+    """
+
+    def __init__(self, engine, tablename='authcode_audit_log'):
+        from sqlalchemy import (
+            Column, DateTime, Integer, MetaData, String, Table, UnicodeText)
+
+        self.engine = getattr(engine, 'engine', engine)
+        self.table = Table(
+            tablename, MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('event', String(64), nullable=False, index=True),
+            Column('user_id', Integer, nullable=True, index=True),
+            Column('at', DateTime, nullable=False, index=True),
+            Column('data', UnicodeText, nullable=True),
+        )
+        self._table_created = False
+
+    def create_table(self):
+        self.table.create(self.engine, checkfirst=True)
+        self._table_created = True
+
+    def write(self, events):
+        if not self._table_created:
+            self.create_table()
+        rows = [{
+            'event': event['event'],
+            'user_id': event['user_id'],
+            'at': datetime.utcfromtimestamp(event['at']),
+            'data': json.dumps(event['data'], default=str) if event['data'] else None,
+        } for event in events]
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
@@ -1,16 +1,21 @@
 # coding=utf-8
-from passlib import hash as ph
-from passlib.context import CryptContext
+from collections import Counter, OrderedDict
+import logging
+from timeit import default_timer
 
-from . import utils, wsgi
+from . import bearer, hashers, utils, wsgi
 from .auth_authentication_mixin import AuthenticationMixin
 from .auth_authorization_mixin import AuthorizationMixin
 from .auth_views_mixin import ViewsMixin
+from .backends import BackendRegistry
 from .constants import (
-    DEFAULT_HASHER, VALID_HASHERS, DEPRECATED_HASHERS, MIN_SECRET_LENGTH,
-    WRONG_HASH_MESSAGE
+    DEFAULT_HASHER, VALID_HASHERS, MIN_SECRET_LENGTH, ROLES_LAZY,
+    WRONG_HASH_MESSAGE, TEMPLATES
+)
+from .models import (
+    extend_user_model, extend_role_model, extend_remember_token_model,
+    extend_api_key_model, extend_password_history_model,
 )
-from .models import extend_user_model, extend_role_model
 
 
 class WrongHashAlgorithm(Exception):
@@ -63,23 +68,101 @@ class Auth(AuthenticationMixin, AuthorizationMixin, ViewsMixin):
         # Trying to save any password longer than this will raise a ValueError.
         'password_maxlen': 1024,
 
+        # Path to a list of breached passwords (see `authcode.breach`) or
+        # a `~authcode.breach.BreachedPasswords`. Trying to save a password
+        # in that list will raise a ValueError.
+        'breached_passwords': None,
+
+        # Processes used to check a new password against the history of the
+        # user, if the auth was created with ``password_history=N``.
+        # By default, `authcode.history.DEFAULT_WORKERS`. With 0, the checks
+        # run in this process.
+        'password_history_workers': None,
+        # Max seconds to wait for those processes before running the checks
+        # in this one. By default, `authcode.history.DEFAULT_TIMEOUT`.
+        'password_history_timeout': None,
+
+        # Checks to run before verifying the password. See `authcode.gates`.
+        'login_gates': ['missing_password'],
+
         'token_life': 3 * 60,  # minutes
+
+        # Bearer tokens for APIs. `token_keys` is a dict of `{key_id: secret}`
+        # and `token_key_id` the ID of the one used for signing new tokens
+        # (required if there is more than one key).
+        # By default, `secret_key` is used.
+        'access_token_life': 15 * 60,  # seconds
+        'refresh_token_life': 30 * 24 * 60 * 60,  # seconds
+        'token_keys': None,
+        'token_key_id': None,
+
+        # HTTP Basic authentication verifies the same credentials on
+        # every request, so successful verifications are cached
+        # for this number of seconds. Set it to 0 to disable the cache.
+        'basic_auth_cache_ttl': 60,
+        'basic_auth_cache_size': 1000,
+
+        # Min seconds between updates of the `last_used_at` of an API key.
+        'api_key_touch_interval': 5 * 60,
+
+        # Persistent logins ("remember me"), used only if the auth was
+        # created with ``remember_tokens=True``.
+        'remember_cookie': '_remember',
+        'remember_life': 30,  # days
+
+        # A `~authcode.revocation.RevocationList` to be able to revoke
+        # individual sessions, identified by a random ID set on login.
+        'revocation_list': None,
+        'session_id_key': '_sid',
+
+        # An `~authcode.audit.AuditLog` to record the authentication events.
+        'audit_log': None,
+
+        # An `~authcode.activity.ActivityTracker` to record when
+        # the users were last seen.
+        'activity_tracker': None,
+
+        # A `~authcode.stuffing.StuffingDetector` to reject, or add an extra
+        # check to, sign in attempts that look like credential stuffing.
+        # The check is `stuffing_challenge`: a callable that takes the request
+        # and returns ``True`` if it passes (eg: a CAPTCHA validator).
+        # Without it, there is no extra check.
+        'stuffing_detector': None,
+        'stuffing_challenge': None,
         'update_hash': True,
         'wsgi': wsgi.werkzeug,
 
         'pepper': u'',  # considering deprecating it
+
+        # Versioned peppers: a dict of `{pepper_id: pepper}` and the ID of the
+        # one used for new hashes. The ID is stored with the hash, so only the
+        # right pepper is tried, and the users are moved to the current one
+        # when they log in. Hashes without an ID use `pepper`.
+        'peppers': None,
+        'pepper_id': None,
+
+        # Apply the pepper with HMAC-SHA256 instead of prepending it.
+        'pepper_hmac': False,
+
+        # Reduce the (peppered) password to a fixed size with HMAC-SHA512
+        # before hashing it, so the cost doesn't depend of its length and
+        # bcrypt doesn't ignore anything after the first 72 bytes.
+        # Hashes made without it still work.
+        'prehash': False,
     }
 
     def __init__(self, secret_key, db=None, hash=DEFAULT_HASHER, rounds=None,
                  UserMixin=None, RoleMixin=None, roles=False,
-                 prefix=None, views_prefix=None,
+                 remember_tokens=False, api_keys=False, prefix=None, views_prefix=None,
                  users_model_name=None, roles_model_name=None,
-                 **settings):
+                 memory_cost=None, time_cost=None, parallelism=None,
+                 password_history=0, roles_lazy='dynamic', **settings):
 
         self.secret_key = str(secret_key)
         assert len(self.secret_key) >= MIN_SECRET_LENGTH, \
             "`secret_key` must be at least {} chars long".format(MIN_SECRET_LENGTH)
-        self.set_hasher(hash, rounds)
+        self.set_hasher(hash, rounds, memory_cost=memory_cost,
+                        time_cost=time_cost, parallelism=parallelism)
 
         if prefix:
             prefix = prefix.lower().replace(' ', '')
@@ -119,6 +202,10 @@ class Auth(AuthenticationMixin, AuthorizationMixin, ViewsMixin):
             )
 
         self.db = db
+        self.password_history = password_history
+        if roles_lazy not in ROLES_LAZY:
+            raise ValueError('`roles_lazy` must be one of {0}'.format(ROLES_LAZY))
+        self.roles_lazy = roles_lazy
         if db:
             self.users_model_name = users_model_name or 'User'
             roles = roles or RoleMixin
@@ -126,42 +213,159 @@ class Auth(AuthenticationMixin, AuthorizationMixin, ViewsMixin):
             if roles:
                 self.roles_model_name = roles_model_name or 'Role'
                 self.Role = extend_role_model(self, self.User, RoleMixin)
+            if remember_tokens:
+                self.RememberToken = extend_remember_token_model(self, self.User)
+            if api_keys:
+                self.ApiKey = extend_api_key_model(self, self.User)
+            if password_history:
+                self.PasswordHistory = extend_password_history_model(self, self.User)
 
-        self.backends = [
-            self.auth_password,
-            self.auth_token,
-        ]
+        self.backends = BackendRegistry()
+        self.backends.register(
+            self.auth_password, keys=('login', 'password'), name='password')
+        self.backends.register(
+            self.auth_token, keys=('token',), name='token')
+        self.backends.register(
+            self.auth_access_token, keys=('access_token',), name='access_token',
+            interactive=False)
+        self.backends.register(
+            self.auth_basic, keys=('authorization',), name='basic',
+            interactive=False)
+        if getattr(self, 'ApiKey', None) is not None:
+            self.backends.register(
+                self.auth_api_key, keys=('api_key',), name='api_key',
+                interactive=False)
+        self.request = None
+        self.gate_rejections = Counter()
         self.session = {}
         self.views_prefix = views_prefix or u''
 
         for name in self.default_settings:
             setattr(self, name, settings.get(name, self.default_settings[name]))
 
-    def set_hasher(self, hash, rounds=None):
+    def warmup(self):
+        """Do all the work usually delayed until the first requests:
+        configure the SQLAlchemy mappers of the models, build the password
+        hasher, compile the default templates and derive the signing keys.
+
+        Call it in the master process before forking the workers (eg: in
+        a gunicorn app with ``preload_app``), so they start warm.
+        It doesn't connect to the database, so no connection is shared
+        between the forked processes.
+
+        Returns an ordered dict with the time, in seconds, spent
+        in each step.
+        """
+        logger = logging.getLogger(__name__)
+        steps = OrderedDict()
+
+        def run(name, func):
+            start = default_timer()
+            func()
+            steps[name] = default_timer() - start
+            logger.debug(u'Warmup `{0}`: {1:.1f} ms'.format(name, steps[name] * 1000))
+
+        if self.db:
+            run('models', self._warmup_models)
+        run('hasher', lambda: self.hasher)
+        run('templates', self._warmup_templates)
+        run('keys', self._warmup_keys)
+        return steps
+
+    def _warmup_models(self):
+        from sqlalchemy.orm import configure_mappers
+        configure_mappers()
+
+    def _warmup_templates(self):
+        from .auth_views_mixin import get_default_env
+        env = get_default_env()
+        for template in TEMPLATES.values():
+            if template:
+                env.get_template(template)
+
+    def _warmup_keys(self):
+        self.key_ring
+        self.basic_auth_cache
+        utils.keyed_hash(self.secret_key, u'')
+
+    @property
+    def key_ring(self):
+        key_ring = self.__dict__.get('_key_ring')
+        if key_ring is None:
+            keys = self.token_keys or {'0': self.secret_key}
+            current = self.token_key_id
+            if current is None:
+                if len(keys) > 1:
+                    raise ValueError(
+                        '`token_key_id` is required with more than one `token_keys`')
+                current = list(keys)[0]
+            key_ring = self._key_ring = bearer.KeyRing(keys, current)
+        return key_ring
+
+    @property
+    def basic_auth_cache(self):
+        cache = self.__dict__.get('_basic_auth_cache')
+        if cache is None and self.basic_auth_cache_ttl:
+            cache = self._basic_auth_cache = utils.LRUCache(
+                maxsize=self.basic_auth_cache_size,
+                ttl=self.basic_auth_cache_ttl,
+            )
+        return cache
+
+    def set_hasher(self, hash, rounds=None, memory_cost=None, time_cost=None,
+                   parallelism=None):
         """Updates the has algorithm and, optionally, the number of rounds
         to use.
 
+        The memory-hard hashers have extra cost parameters: ``memory_cost``
+        (in KiB) and ``parallelism`` for argon2 and scrypt, and ``time_cost``
+        (the rounds) for argon2. See `authcode.hashers.calibrate` to choose
+        them for your machines.
+
+        The hasher itself is built (and tested) the first time is used, so
+        creating an `Auth` instance doesn't have to import passlib, and is
+        shared with all the other instances with the same configuration.
+
         Raises:
             `~WrongHashAlgorithm` if new algorithm isn't one of the three
             recomended options.
+            `ValueError` if the cost parameters are invalid for it.
 
         """
         hash = hash.replace('-', '_')
         if hash not in VALID_HASHERS:
             raise WrongHashAlgorithm(WRONG_HASH_MESSAGE)
-        hasher = getattr(ph, hash)
-        utils.test_hasher(hasher)
-
-        default_rounds = getattr(hasher, 'default_rounds', 1)
-        min_rounds = getattr(hasher, 'min_rounds', 1)
-        max_rounds = getattr(hasher, 'max_rounds', float("inf"))
-        rounds = min(max(rounds or default_rounds, min_rounds), max_rounds)
-        op = {
-            'schemes': VALID_HASHERS + DEPRECATED_HASHERS,
-            'deprecated': DEPRECATED_HASHERS,
-            'default': hash,
-            hash + '__default_rounds': rounds
-        }
-        self.hasher = CryptContext(**op)
+        rounds, params = hashers.get_params(
+            hash, rounds, memory_cost=memory_cost, time_cost=time_cost,
+            parallelism=parallelism)
         self.hash = hash.replace('_', '-')  # For testing
-        self.rounds = rounds
+        self._rounds = rounds
+        self._rounds_clamped = False
+        self.hash_params = params
+        self._hasher = None
+        self._hash_signature = None
+
+    @property
+    def rounds(self):
+        """The number of rounds used, adjusted to the limits of the
+        algorithm. Reading it imports the passlib handler (but doesn't
+        build the hasher), so creating an `Auth` doesn't have to."""
+        if not self._rounds_clamped:
+            self._rounds = hashers.get_rounds(self.hash.replace('-', '_'), self._rounds)
+            self._rounds_clamped = True
+        return self._rounds
+
+    @property
+    def hasher(self):
+        if self._hasher is None:
+            self._hasher = self._build_hasher()
+        return self._hasher
+
+    @hasher.setter
+    def hasher(self, value):
+        self._hasher = value
+
+    def _build_hasher(self):
+        hasher, _ = hashers.get_context(
+            self.hash, self.rounds, **self.hash_params)
+        return hasher
@@ -1,18 +1,65 @@
 # coding=utf-8
+from datetime import datetime, timedelta
 import logging
 from time import time
 
-from . import utils
-from ._compat import to_unicode
+from . import bearer, gates, history, utils
+from ._compat import string_types, to_unicode
+from .stuffing import ALLOW
+
+
+# Session key used to pass a new "remember me" cookie value
+# to ``update_remember_cookie`` at the end of the request.
+REMEMBER_SET_KEY = '_remember_set'
 
 
 class AuthenticationMixin(object):
 
-    def prepare_password(self, secret):
-        return u'{pepper}{secret}'.format(
-            pepper=to_unicode(self.pepper),
-            secret=to_unicode(secret)
-        )
+    def audit(self, event, user=None, **data):
+        """Add an event to the `audit_log`, if there is one."""
+        if self.audit_log is None:
+            return
+        user_id = getattr(user, 'id', user)
+        self.audit_log.emit(event, user_id=user_id, **data)
+
+    def prepare_password(self, secret, params=None):
+        """Apply the pepper to the secret. ``params`` are the ones stored
+        with the hash (see `get_hash_params`)."""
+        params = params or {}
+        if 'p' in params:
+            pepper = self.get_pepper(params['p'])
+        else:
+            pepper = self.pepper
+        if params.get('a') == 'hmac':
+            secret = to_unicode(utils.keyed_hash(to_unicode(pepper), to_unicode(secret)))
+        else:
+            secret = u'{pepper}{secret}'.format(
+                pepper=to_unicode(pepper),
+                secret=to_unicode(secret)
+            )
+        if params.get('h') == 'sha512':
+            secret = utils.prehash(secret)
+        return secret
+
+    def get_pepper(self, pepper_id):
+        """Return the pepper with this ID or ``None``."""
+        for key, pepper in (self.peppers or {}).items():
+            if str(key) == str(pepper_id):
+                return pepper
+        return None
+
+    def get_hash_params(self):
+        """Return the params to store with new hashes."""
+        params = {}
+        if self.peppers:
+            assert self.get_pepper(self.pepper_id) is not None, \
+                '`pepper_id` must be one of the keys of `peppers`'
+            params['p'] = self.pepper_id
+        if self.pepper_hmac:
+            params['a'] = 'hmac'
+        if self.prehash:
+            params['h'] = 'sha512'
+        return params
 
     def hash_password(self, secret):
         if secret is None:
@@ -27,10 +74,49 @@ class AuthenticationMixin(object):
             raise ValueError(
                 'Password is too long. Must have at most {} chars long'.format(
                     self.password_maxlen))
+        if self.password_is_breached(secret):
+            raise ValueError(
+                'Password has appeared in a data breach. Choose a different one')
 
-        secret = self.prepare_password(secret)
-        hashed = self.hasher.encrypt(secret)
-        return hashed
+        return self._hash_secret(secret)
+
+    def _hash_secret(self, secret):
+        params = self.get_hash_params()
+        hashed = self.hasher.encrypt(self.prepare_password(secret, params))
+        return utils.make_hash_envelope(params, hashed)
+
+    def password_is_breached(self, secret):
+        breached = self.breached_passwords
+        if not breached:
+            return False
+        if isinstance(breached, string_types):
+            from .breach import BreachedPasswords
+            breached = self.breached_passwords = BreachedPasswords(breached)
+        return secret in breached
+
+    def password_in_history(self, user, secret):
+        """Return ``True`` if the secret is one of the last
+        `password_history` passwords of the user, including the current one.
+        The hashes are checked in parallel (see `authcode.history`).
+        """
+        if getattr(self, 'PasswordHistory', None) is None:
+            return False
+        if secret is None or user.id is None or len(secret) > self.password_maxlen:
+            return False
+        hashes = self.PasswordHistory.get_hashes(user.id)
+        if user.password and user.password not in hashes:
+            # Set before the history was enabled
+            hashes.insert(0, user.password)
+        candidates = []
+        for hashed in hashes:
+            params, hashed = utils.split_hash_envelope(hashed)
+            if 'p' in params and self.get_pepper(params['p']) is None:
+                continue
+            candidates.append((self.prepare_password(secret, params), hashed))
+        config = (self.hash, self.rounds, tuple(sorted(self.hash_params.items())))
+        return history.any_matches(
+            config, candidates, workers=self.password_history_workers,
+            timeout=self.password_history_timeout)
 
     def password_is_valid(self, secret, hashed):
         if secret is None or hashed is None:
@@ -41,20 +127,39 @@ class AuthenticationMixin(object):
         if len(secret) > self.password_maxlen:
             return False
 
-        secret = self.prepare_password(secret)
+        params, hashed = utils.split_hash_envelope(hashed)
+        if 'p' in params and self.get_pepper(params['p']) is None:
+            return False
+        secret = self.prepare_password(secret, params)
         try:
             return self.hasher.verify(secret, hashed)
         except ValueError:
             return False
 
-    def authenticate(self, credentials):
+    def authenticate(self, credentials, interactive=False):
+        """Return the user authenticated by the first backend that
+        accepts these credentials or ``None``.
+
+        The sign in view uses ``interactive=True``, so machine credentials
+        (like API keys) can't be exchanged for a browser session.
+        """
+        if hasattr(self.backends, 'authenticate'):
+            return self.backends.authenticate(credentials, interactive=interactive)
+        # A plain list of backends
         for backend in self.backends:
             user = backend(credentials)
             if user:
                 return user
         return None
 
-    def auth_password(self, credentials):
+    def auth_password(self, credentials, cache=None):
+        """Authenticate with a login and a password.
+
+        If a ``cache`` (like a `~authcode.utils.LRUCache`) is used, the
+        successful verifications are stored there, indexed by a keyed hash of
+        the credentials and the current password hash, so they can be
+        reused without running the password hashing again.
+        """
         logger = logging.getLogger(__name__)
         login = credentials.get('login')
         secret = credentials.get('password')
@@ -64,26 +169,90 @@ class AuthenticationMixin(object):
         user = self.User.by_login(login)
         if not user:
             logger.debug(u'User `{0}` not found'.format(login))
+            self.audit('auth.failed', backend='password', reason='not_found')
+            self._record_stuffing_failure(login)
             return None
 
-        if not user.password:
-            logger.debug(u'User `{0}` has no password'.format(login))
+        rejected_by = gates.run_gates(self, user, credentials)
+        if rejected_by:
+            logger.debug(u'User `{0}` rejected by the `{1}` gate'.format(login, rejected_by))
+            self.audit('auth.failed', user, backend='password', reason=rejected_by)
             return None
 
+        cache_key = None
+        if cache is not None:
+            cache_key = utils.get_credentials_key(
+                self.secret_key, login, secret, user.password)
+            if cache.get(cache_key) == user.id:
+                gates.run_success_hooks(self, user, credentials)
+                return user
+
         if not self.password_is_valid(secret, user.password):
             logger.debug(u'Invalid password for user `{0}`'.format(login))
+            self.audit('auth.failed', user, backend='password', reason='password')
+            self._record_stuffing_failure(login)
+            gates.run_failure_hooks(self, user, credentials)
             return None
 
+        gates.run_success_hooks(self, user, credentials)
+        if cache_key is not None:
+            cache.set(cache_key, user.id)
         self._update_password_hash(secret, user)
         return user
 
+    def check_stuffing(self, request, login):
+        """Return the verdict of the `stuffing_detector` for a sign in
+        attempt: `~authcode.stuffing.ALLOW`, ``FRICTION`` or ``REJECT``."""
+        if self.stuffing_detector is None:
+            return ALLOW
+        source = self.wsgi.get_remote_addr(request) if request else None
+        verdict = self.stuffing_detector.check(source, login)
+        if verdict != ALLOW:
+            self.audit('stuffing.' + verdict, source=source)
+        return verdict
+
+    def _record_stuffing_failure(self, login):
+        if self.stuffing_detector is None:
+            return
+        source = self.wsgi.get_remote_addr(self.request) if self.request else None
+        self.stuffing_detector.record_failure(source, login)
+
+    def auth_basic(self, credentials):
+        """Authenticate with the value of an HTTP Basic ``Authorization``
+        header, eg: ``auth.authenticate({'authorization': header})``.
+
+        Successful verifications are cached for `basic_auth_cache_ttl`
+        seconds, or until the user's password hash changes, so repeated
+        requests don't run the password hashing every time.
+        """
+        parsed = utils.parse_basic_authorization(credentials.get('authorization'))
+        if not parsed:
+            return None
+        login, secret = parsed
+        return self.auth_password(
+            {'login': login, 'password': secret},
+            cache=self.basic_auth_cache
+        )
+
     def _update_password_hash(self, secret, user):
+        """Re-hash the password if it was made with another configuration
+        (pepper, scheme or rounds). Comparing with a sample hash, made once,
+        means that logins don't pay for a second hashing."""
         if not self.update_hash:
             return
-        new_hash = self.hash_password(secret)
-        if new_hash.split('$')[:3] == user.password.split('$')[:3]:
+        current = self._get_current_hash_signature()
+        if utils.get_hash_signature(user.password) == current:
             return
-        user.set_raw_password(new_hash)
+        user.set_raw_password(self._hash_secret(secret))
+
+    def _get_current_hash_signature(self):
+        hasher = self.hasher
+        cached = self._hash_signature
+        if cached is None or cached[0] is not hasher:
+            sample = hasher.encrypt(u'authcode')
+            cached = self._hash_signature = (hasher, utils.get_hash_prefix(sample))
+        params = sorted((key, str(value)) for key, value in self.get_hash_params().items())
+        return params, cached[1]
 
     def auth_token(self, credentials, token_life=None):
         logger = logging.getLogger(__name__)
@@ -105,16 +274,145 @@ class AuthenticationMixin(object):
         valid = user.get_token(timestamp) == token
         not_expired = timestamp + token_life >= int(time())
         if valid and not_expired:
+            self.audit('token.used', user)
             return user
         logger.info(u'Invalid auth token')
+        self.audit('auth.failed', user, backend='token', reason='token')
         return None
 
+    def issue_bearer_tokens(self, user, scopes=()):
+        """Return a dict with a new short-lived access token and a refresh
+        token for the user.
+
+        The access token can be verified without querying the database.
+        The refresh token can be exchanged by new tokens, with
+        `refresh_bearer_tokens`, until the user's password changes.
+        """
+        now = int(time())
+        scopes = list(scopes)
+        access_token = bearer.dumps(self.key_ring, {
+            'typ': bearer.ACCESS,
+            'sub': user.id,
+            'scp': scopes,
+            'exp': now + self.access_token_life,
+        })
+        refresh_token = bearer.dumps(self.key_ring, {
+            'typ': bearer.REFRESH,
+            'sub': user.id,
+            'scp': scopes,
+            'exp': now + self.refresh_token_life,
+            'pwd': self._get_password_binding(user),
+        })
+        return {
+            'token_type': 'Bearer',
+            'access_token': access_token,
+            'expires_in': self.access_token_life,
+            'refresh_token': refresh_token,
+        }
+
+    def verify_access_token(self, token):
+        """Return the claims of a valid access token or ``None``.
+        The user ID is the ``sub`` claim and the list of scopes the
+        ``scp`` claim. This doesn't query the database."""
+        return bearer.loads(self.key_ring, token, bearer.ACCESS)
+
+    def refresh_bearer_tokens(self, refresh_token):
+        """Exchange a valid refresh token by new tokens, with the same
+        scopes. Returns ``None`` if the token is invalid or expired or if the
+        user's password has changed."""
+        claims = bearer.loads(self.key_ring, refresh_token, bearer.REFRESH)
+        if not claims:
+            return None
+        user = self.User.by_id(claims['sub'])
+        if not user or user.deleted:
+            return None
+        binding = self._get_password_binding(user)
+        if not utils.constant_time_compare(binding, claims.get('pwd', '')):
+            return None
+        return self.issue_bearer_tokens(user, scopes=claims['scp'])
+
+    def auth_access_token(self, credentials):
+        """Authenticate with an access token. The claims of the token are
+        available as ``user.token_claims``.
+
+        If you don't need the user object, use `verify_access_token`
+        instead, and skip the query."""
+        claims = self.verify_access_token(credentials.get('access_token'))
+        if not claims:
+            if credentials.get('access_token'):
+                self.audit('auth.failed', backend='access_token', reason='token')
+            return None
+        user = self.User.by_id(claims['sub'])
+        if not user or user.deleted:
+            return None
+        user.token_claims = claims
+        self.audit('access_token.used', user)
+        return user
+
+    def _get_password_binding(self, user):
+        extract = utils.get_hash_extract(user.password)
+        return utils.keyed_hash(self.secret_key, extract)[:20]
+
+    def auth_api_key(self, credentials):
+        """Authenticate with an API key made by ``ApiKey.create``.
+        The key used is available as ``user.current_api_key``.
+
+        Because the keys are random and long, a keyed hash is enough to
+        protect them, so this takes just an indexed query and an HMAC.
+        """
+        logger = logging.getLogger(__name__)
+        value = credentials.get('api_key')
+        try:
+            prefix, secret = str(value).split('.', 1)
+        except ValueError:
+            logger.info(u'Invalid API key format')
+            return None
+
+        api_key = self.ApiKey.by_prefix(prefix)
+        if not api_key or api_key.is_revoked:
+            return None
+        key_hash = utils.keyed_hash(self.secret_key, secret)
+        if not utils.constant_time_compare(key_hash, api_key.key_hash):
+            logger.info(u'Invalid API key')
+            self.audit('auth.failed', backend='api_key', reason='api_key')
+            return None
+
+        user = api_key.user
+        if not user or user.deleted:
+            return None
+        self._touch_api_key(api_key)
+        self.audit('api_key.used', user, prefix=api_key.prefix)
+        user.current_api_key = api_key
+        return user
+
+    def _touch_api_key(self, api_key):
+        """Update the `last_used_at` of the key, but not more than once
+        every `api_key_touch_interval` seconds."""
+        now = datetime.utcnow()
+        last_used_at = api_key.last_used_at
+        interval = timedelta(seconds=self.api_key_touch_interval)
+        if last_used_at and now - last_used_at < interval:
+            return
+        table = api_key.__table__
+        self.db.session.execute(
+            table.update().where(table.c.id == api_key.id)
+            .values(last_used_at=now)
+        )
+        self.db.session.commit()
+
     def get_user(self, session=None):
         if session is None:
             session = self.session
         user = None
         uhmac = session.get(self.session_key)
-        if uhmac:
+        if not uhmac and getattr(self, 'RememberToken', None) is not None:
+            user = self._restore_from_remember_token(session)
+        elif uhmac and self.session_is_revoked(session):
+            logger = logging.getLogger(__name__)
+            logger.info(u'Revoked session')
+            self.audit('session.revoked')
+            self.logout(session)
+        elif uhmac:
             try:
                 uid = utils.split_uhmac(uhmac)
                 user = self.User.by_id(uid)
@@ -123,8 +421,11 @@ class AuthenticationMixin(object):
             except ValueError:
                 logger = logging.getLogger(__name__)
                 logger.warn(u'Tampered uhmac?')
+                self.audit('session.tampered', user)
                 user = None
                 self.logout(session)
+        if user is not None and self.activity_tracker is not None:
+            self.activity_tracker.touch(self, user)
         return user
 
     def login(self, user, remember=True, session=None):
@@ -138,19 +439,162 @@ class AuthenticationMixin(object):
         """
         logger = logging.getLogger(__name__)
         logger.debug(u'User `{0}` logged in'.format(user.login))
+        self.audit('login', user)
         if session is None:
             session = self.session
         session['permanent'] = remember
         session[self.session_key] = user.get_uhmac()
+        if self.revocation_list is not None:
+            session[self.session_id_key] = utils.random_token(12)
+        if remember and getattr(self, 'RememberToken', None) is not None:
+            session[REMEMBER_SET_KEY] = self.issue_remember_token(user)
         if callable(getattr(session, 'save', None)):
             session.save()
 
     def logout(self, session=None):
         if session is None:
             session = self.session
+        if self.audit_log is not None and session.get(self.session_key):
+            try:
+                self.audit('logout', int(utils.split_uhmac(session[self.session_key])))
+            except ValueError:
+                pass
         if self.session_key in session:
             del session[self.session_key]
         if self.clear_session_on_logout:
             session.clear()
+        if getattr(self, 'RememberToken', None) is not None:
+            self._forget_remember_token()
+            session[REMEMBER_SET_KEY] = u''
         if callable(getattr(session, 'save', None)):
             session.save()
+
+    def get_session_id(self, session=None):
+        """Return the random ID assigned to the session on login, if
+        a revocation list is being used."""
+        if session is None:
+            session = self.session
+        return session.get(self.session_id_key)
+
+    def revoke_session(self, session_id):
+        """Log out the session with this ID (see `get_session_id`)
+        without having to change the user's password."""
+        self.revocation_list.revoke(session_id)
+
+    def session_is_revoked(self, session):
+        if self.revocation_list is None:
+            return False
+        return self.revocation_list.is_revoked(session.get(self.session_id_key))
+
+    def issue_remember_token(self, user):
+        """Store a new persistent login token for the user and returns
+        the value for the cookie.
+
+        Only a keyed hash of the *validator* part of the token is stored,
+        so the tokens can't be used even if the database is compromised.
+        The *selector* part is used to find the token with a single
+        indexed lookup.
+        """
+        selector = utils.random_token(12)
+        validator = utils.random_token(32)
+        token = self.RememberToken(
+            selector=selector,
+            validator=utils.keyed_hash(self.secret_key, validator),
+            password_binding=self._get_password_binding(user),
+            user_id=user.id,
+            expires_at=datetime.utcnow() + timedelta(days=self.remember_life),
+        )
+        self.db.session.add(token)
+        self.db.session.commit()
+        return utils.make_remember_token(selector, validator)
+
+    def auth_remember_token(self, value):
+        """Return the user of a valid (and not expired) persistent login
+        token or ``None``. The used token is deleted, because a new one is
+        issued on every login.
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            selector, validator = utils.split_remember_token(value)
+        except ValueError:
+            logger.info(u'Invalid remember token format')
+            return None
+
+        token = self.RememberToken.by_selector(selector)
+        if not token:
+            return None
+        if token.is_expired:
+            self._delete_remember_token(token)
+            return None
+
+        expected = utils.keyed_hash(self.secret_key, validator)
+        if not utils.constant_time_compare(expected, token.validator):
+            # Someone knows the selector but not the validator,
+            # so the token could have been stolen.
+            logger.warning(u'Tampered remember token?')
+            self._delete_remember_token(token)
+            return None
+
+        user = self.User.by_id(token.user_id)
+        self._delete_remember_token(token)
+        if not user or not user.login:
+            return None
+        binding = self._get_password_binding(user)
+        if not utils.constant_time_compare(binding, token.password_binding):
+            logger.info(u'Remember token issued before a password change')
+            return None
+        return user
+
+    def purge_remember_tokens(self):
+        """Delete all the expired persistent login tokens.
+        Returns how many were deleted."""
+        return self.RememberToken.purge_expired()
+
+    def update_remember_cookie(self, response, session=None):
+        """Set (or delete) the persistent login cookie in the response if
+        it has changed during this request. Called by the setups
+        after each request."""
+        if session is None:
+            session = self.session
+        value = session.pop(REMEMBER_SET_KEY, None)
+        if value is None:
+            return response
+        if value:
+            max_age = self.remember_life * 24 * 60 * 60
+            self.wsgi.set_cookie(response, self.remember_cookie, value, max_age=max_age)
+        else:
+            self.wsgi.delete_cookie(response, self.remember_cookie)
+        if callable(getattr(session, 'save', None)):
+            session.save()
+        return response
+
+    def _restore_from_remember_token(self, session):
+        if self.request is None:
+            return None
+        value = self.wsgi.get_from_cookies(self.request, self.remember_cookie)
+        if not value:
+            return None
+        user = self.auth_remember_token(value)
+        if user:
+            self.login(user, remember=True, session=session)
+        else:
+            session[REMEMBER_SET_KEY] = u''
+        return user
+
+    def _forget_remember_token(self):
+        if self.request is None:
+            return
+        value = self.wsgi.get_from_cookies(self.request, self.remember_cookie)
+        if not value:
+            return
+        try:
+            selector, _ = utils.split_remember_token(value)
+        except ValueError:
+            return
+        token = self.RememberToken.by_selector(selector)
+        if token:
+            self._delete_remember_token(token)
+
+    def _delete_remember_token(self, token):
+        self.db.session.delete(token)
+        self.db.session.commit()
@@ -1,14 +1,22 @@
 # coding=utf-8
 from __future__ import print_function
 
-from jinja2 import Environment, PackageLoader
-
 from . import views
 from .constants import TEMPLATES
 
 
-def_loader = PackageLoader('authcode', 'templates')
-def_env = Environment(loader=def_loader)
+_def_env = None
+
+
+def get_default_env():
+    """Return the Jinja environment for the default templates.
+    It's created the first time is needed, so importing authcode
+    doesn't have to import Jinja."""
+    global _def_env
+    if _def_env is None:
+        from jinja2 import Environment, PackageLoader
+        _def_env = Environment(loader=PackageLoader('authcode', 'templates'))
+    return _def_env
 
 
 class ViewsMixin(object):
@@ -16,6 +24,8 @@ class ViewsMixin(object):
     ERROR_BAD_CSRF = 'BAD CSRF TOKEN'
     ERROR_SUSPENDED = 'ACCOUNT SUSPENDED'
     ERROR_CREDENTIALS = 'BAD CREDENTIALS'
+    ERROR_TOO_MANY_ATTEMPTS = 'TOO MANY ATTEMPTS'
+    ERROR_CHALLENGE = 'CHALLENGE FAILED'
 
     ERROR_BAD_TOKEN = 'WRONG TOKEN'
     ERROR_WRONG_TOKEN_USER = 'WRONG USER'
@@ -24,6 +34,8 @@ class ViewsMixin(object):
     ERROR_PASSW_TOO_LONG = 'TOO LONG'
     ERROR_PASSW_MISMATCH = 'MISMATCH'
     ERROR_PASSW_CURRENT = 'FAIL'
+    ERROR_PASSW_BREACHED = 'BREACHED'
+    ERROR_PASSW_REUSED = 'REUSED'
 
     def auth_sign_in(self, *args, **kwargs):
         request = self.request or kwargs.get('request') or args and args[0]
@@ -57,7 +69,7 @@ class ViewsMixin(object):
         return self.default_render(template, **kwargs)
 
     def default_render(self, template, **kwargs):
-        tmpl = def_env.get_template(template)
+        tmpl = get_default_env().get_template(template)
         return tmpl.render(kwargs)
 
     def render(self, template, **kwargs):
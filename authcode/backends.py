@@ -0,0 +1,176 @@
+# coding=utf-8
+"""
+    Registry of the authentication backends used by ``Auth.authenticate``.
+
+    Each backend declares the credential keys it needs, so a credential is
+    only passed to the backends that can handle it, instead of trying
+    all of them in turn.
+"""
+from timeit import default_timer
+
+
+class Backend(object):
+    __slots__ = ('func', 'name', 'keys', 'priority', 'interactive',
+                 'calls', 'hits', 'total_time')
+
+    def __init__(self, func, name, keys, priority, interactive=True):
+        self.func = func
+        self.name = name
+        self.keys = frozenset(keys) if keys is not None else None
+        self.priority = priority
+        self.interactive = interactive
+        self.calls = 0
+        self.hits = 0
+        self.total_time = 0.0
+
+    def __repr__(self):
+        return '<Backend {0}>'.format(self.name)
+
+
+class BackendRegistry(object):
+    """An ordered collection of authentication backends.
+
+    A backend is a function that takes a dict of credentials and returns
+    a user or ``None``. Backends with a higher ``priority`` are tried first,
+    and backends with the same priority, in the order they were registered.
+    """
+
+    def __init__(self):
+        self._backends = []
+        self._keys = frozenset()
+        self._dispatch = {}
+
+    def register(self, func, keys=None, priority=0, name=None, interactive=True):
+        """Add a backend.
+
+        :keys: iterable, optional
+            Names of the credentials the backend needs. The backend will be
+            called only if all of them are present (and not ``None``).
+            If not set, the backend is called for every credential.
+
+        :priority: int, optional
+            Backends with a higher priority are tried first.
+
+        :name: str, optional
+            Name for the stats. A backend already registered with this
+            name is replaced. By default, the name of the function (with
+            a numeric suffix if it's already used), and nothing is replaced.
+
+        :interactive: bool, optional
+            If the backend can be used to sign in from the login form.
+            Set it to ``False`` for machine credentials (like API keys),
+            that must not be exchanged for a full browser session.
+        """
+        if name:
+            self.unregister(name)
+        else:
+            name = self._get_unique_name(func)
+        self._backends.append(Backend(func, name, keys, priority, interactive))
+        self._backends.sort(key=lambda backend: -backend.priority)
+        self._update_index()
+        return func
+
+    def unregister(self, name):
+        self._backends = [backend for backend in self._backends
+                          if backend.name != name]
+        self._update_index()
+
+    def append(self, func):
+        """Add a backend that's called for every credential, like in the
+        old list of backends."""
+        return self.register(func)
+
+    def insert(self, index, func):
+        """Add a backend that's called for every credential, at this
+        position, like in the old list of backends. It takes the priority
+        of the backend it's inserted before."""
+        if self._backends:
+            neighbour = self._backends[min(index, len(self._backends) - 1)]
+            priority = neighbour.priority
+        else:
+            priority = 0
+        backend = Backend(func, self._get_unique_name(func), None, priority)
+        self._backends.insert(index, backend)
+        self._update_index()
+        return func
+
+    def remove(self, func):
+        """Remove a backend by its function, like in a list."""
+        for backend in self._backends:
+            if backend.func == func:
+                return self.unregister(backend.name)
+        raise ValueError('Backend not registered')
+
+    def get(self, name):
+        for backend in self._backends:
+            if backend.name == name:
+                return backend
+        return None
+
+    def match(self, credentials, interactive=False):
+        """Return the list of backends that can handle these credentials.
+        With ``interactive=True``, only the ones that can be used to
+        sign in from the login form."""
+        present = frozenset(
+            key for key in self._keys if credentials.get(key) is not None
+        )
+        backends = self._dispatch.get((present, interactive))
+        if backends is None:
+            backends = [
+                backend for backend in self._backends
+                if (backend.keys is None or backend.keys <= present) and
+                (backend.interactive or not interactive)
+            ]
+            # The keys are limited to the registered ones,
+            # so this can't grow forever.
+            self._dispatch[(present, interactive)] = backends
+        return backends
+
+    def authenticate(self, credentials, interactive=False):
+        for backend in self.match(credentials, interactive=interactive):
+            start = default_timer()
+            user = backend.func(credentials)
+            backend.total_time += default_timer() - start
+            backend.calls += 1
+            if user:
+                backend.hits += 1
+                return user
+        return None
+
+    def stats(self):
+        """Return a dict with the number of calls, successful authentications
+        and the total time spent by each backend."""
+        return dict(
+            (backend.name, {
+                'calls': backend.calls,
+                'hits': backend.hits,
+                'total_time': backend.total_time,
+            })
+            for backend in self._backends
+        )
+
+    def __iter__(self):
+        return iter([backend.func for backend in self._backends])
+
+    def __getitem__(self, index):
+        return [backend.func for backend in self._backends][index]
+
+    def __len__(self):
+        return len(self._backends)
+
+    def _get_unique_name(self, func):
+        base = getattr(func, '__name__', None) or repr(func)
+        names = set(backend.name for backend in self._backends)
+        name = base
+        suffix = 1
+        while name in names:
+            suffix += 1
+            name = '{0}_{1}'.format(base, suffix)
+        return name
+
+    def _update_index(self):
+        keys = set()
+        for backend in self._backends:
+            keys.update(backend.keys or ())
+        self._keys = frozenset(keys)
+        self._dispatch = {}
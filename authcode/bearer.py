@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+    Compact signed tokens for APIs.
+
+    An access token is ``<payload>.<signature>``, both base64-encoded.
+    The payload is a small JSON object with the user ID (``sub``),
+    the scopes (``scp``), the expiration time (``exp``) and the ID of the
+    key used to sign it (``kid``). Verifying it only takes an HMAC and a
+    clock check: no database query.
+"""
+import base64
+import hashlib
+import hmac
+import json
+from time import time
+
+from .utils import constant_time_compare
+from ._compat import to_bytes, to_native
+
+
+ACCESS = 'a'
+REFRESH = 'r'
+
+
+class KeyRing(object):
+    """The keys used to sign the tokens. The key with ID ``current`` signs
+    the new tokens; the rest are only used to verify the old ones, so the
+    keys can be rotated without invalidating all the tokens at once.
+    """
+
+    def __init__(self, keys, current):
+        # Derived keys, so the same secret can be safely used
+        # for other things.
+        self.keys = dict(
+            (to_native(kid), hmac.new(to_bytes(secret), b'authcode-bearer',
+                                      hashlib.sha256).digest())
+            for kid, secret in keys.items()
+        )
+        self.current = to_native(current)
+        assert self.current in self.keys, 'Unknown current key ID'
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+
+def b64encode(data):
+    return to_native(base64.urlsafe_b64encode(data).rstrip(b'='))
+
+
+def b64decode(data):
+    data = to_bytes(data)
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def sign(key, payload):
+    return b64encode(hmac.new(key, to_bytes(payload), hashlib.sha256).digest())
+
+
+def dumps(key_ring, claims):
+    claims = dict(claims, kid=key_ring.current)
+    payload = b64encode(to_bytes(json.dumps(claims, separators=(',', ':'))))
+    return '{0}.{1}'.format(payload, sign(key_ring.get(key_ring.current), payload))
+
+
+def loads(key_ring, token, typ, now=None):
+    """Return the claims of a valid and not expired token of type
+    ``typ`` or ``None``."""
+    try:
+        payload, signature = to_native(token).split('.', 1)
+        claims = json.loads(to_native(b64decode(payload)))
+        key = key_ring.get(claims['kid'])
+        if key is None:
+            return None
+        if not constant_time_compare(sign(key, payload), signature):
+            return None
+        if claims['typ'] != typ or claims['exp'] < (now or time()):
+            return None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return claims
@@ -0,0 +1,191 @@
+# coding=utf-8
+"""
+    Offline check of passwords against a list of breached passwords.
+
+    The list is a binary file of the SHA-1 digests of the passwords,
+    20 bytes each, sorted and without separators. It's searched with
+    a binary search over a memory map, so only the few pages touched
+    by a lookup are ever read into memory.
+
+    Convert a text dump (one hex digest per line, optionally followed by
+    ``:count``, like the public "Pwned Passwords" lists) with::
+
+        python -m authcode.breach convert pwned-passwords.txt breached.bin
+
+"""
+from __future__ import print_function
+
+import argparse
+from hashlib import sha1
+import heapq
+import mmap
+import os
+import tempfile
+import threading
+
+from ._compat import to_bytes
+
+
+WIDTH = 20  # size of a SHA-1 digest
+CHUNK_SIZE = 5000000  # digests sorted in memory at a time (~100 MB)
+
+
+class BreachedPasswords(object):
+    """A sorted file of SHA-1 digests of breached passwords.
+
+    The file is opened the first time it's needed and kept open.
+    Use ``password in breached`` to check a password.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._count = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, secret):
+        return self.contains_digest(sha1(to_bytes(secret)).digest())
+
+    def __len__(self):
+        self._open()
+        return self._count
+
+    def contains_digest(self, digest):
+        self._open()
+        data = self._data
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mid * WIDTH
+            value = data[start:start + WIDTH]
+            if value < digest:
+                lo = mid + 1
+            elif value > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def _open(self):
+        if self._count is not None:
+            return
+        with self._lock:
+            if self._count is not None:
+                return
+            size = os.path.getsize(self.path)
+            assert size % WIDTH == 0, \
+                '`{0}` is not a list of breached passwords'.format(self.path)
+            if size:
+                with open(self.path, 'rb') as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._count = size // WIDTH
+
+    def close(self):
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+            self._data = None
+            self._count = None
+
+
+def parse_line(line):
+    """Return the digest of a line ``HEX[:count]`` or ``None``
+    if it isn't valid."""
+    value = line.split(b':', 1)[0].strip()
+    if len(value) != WIDTH * 2:
+        return None
+    try:
+        return bytes(bytearray.fromhex(value.decode('ascii')))
+    except ValueError:
+        return None
+
+
+def convert(src, dst, chunk_size=CHUNK_SIZE):
+    """Convert the text file ``src`` into the binary file ``dst``.
+
+    The input doesn't need to be sorted: it's sorted in chunks of
+    ``chunk_size`` digests, saved to temporary files and merged
+    at the end. Duplicated digests are removed.
+    Returns the number of digests written.
+    """
+    chunks = []
+    try:
+        with open(src, 'rb') as f:
+            digests = []
+            for line in f:
+                digest = parse_line(line)
+                if digest is None:
+                    continue
+                digests.append(digest)
+                if len(digests) >= chunk_size:
+                    chunks.append(_save_chunk(digests))
+                    digests = []
+            if digests or not chunks:
+                chunks.append(_save_chunk(digests))
+
+        readers = [_read_chunk(path) for path in chunks]
+        return _write_unique(dst, heapq.merge(*readers))
+    finally:
+        for path in chunks:
+            os.remove(path)
+
+
+def _save_chunk(digests):
+    digests.sort()
+    fd, path = tempfile.mkstemp(suffix='.breach')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b''.join(digests))
+    return path
+
+
+def _read_chunk(path):
+    with open(path, 'rb') as f:
+        while True:
+            digest = f.read(WIDTH)
+            if len(digest) < WIDTH:
+                return
+            yield digest
+
+
+def _write_unique(dst, digests):
+    count = 0
+    last = None
+    with open(dst, 'wb') as f:
+        for digest in digests:
+            if digest == last:
+                continue
+            f.write(digest)
+            last = digest
+            count += 1
+    return count
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m authcode.breach')
+    subparsers = parser.add_subparsers(dest='command')
+    p_convert = subparsers.add_parser(
+        'convert', help='Convert a text list of SHA-1 hashes to the binary format')
+    p_convert.add_argument('src')
+    p_convert.add_argument('dst')
+    p_check = subparsers.add_parser(
+        'check', help='Check if a password is in a binary list')
+    p_check.add_argument('path')
+    p_check.add_argument('password')
+    args = parser.parse_args(args)
+
+    if args.command == 'convert':
+        count = convert(args.src, args.dst)
+        print('{0} digests written to {1}'.format(count, args.dst))
+    elif args.command == 'check':
+        found = args.password in BreachedPasswords(args.path)
+        print('Breached' if found else 'Not found')
+        return int(found)
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    import sys
+    sys.exit(main())
@@ -4,7 +4,7 @@
 DEFAULT_HASHER = 'pbkdf2_sha512'
 
 VALID_HASHERS = [
-    'sha512_crypt', 'pbkdf2_sha512', 'bcrypt',
+    'sha512_crypt', 'pbkdf2_sha512', 'bcrypt', 'argon2', 'scrypt',
     'sha256_crypt', 'pbkdf2_sha256', 'pbkdf2_sha1',
     'ldap_sha512_crypt', 'ldap_sha256_crypt',
     'ldap_pbkdf2_sha512', 'ldap_pbkdf2_sha256',
@@ -17,8 +17,21 @@ DEPRECATED_HASHERS = [
     'hex_sha512', 'hex_sha256', 'hex_sha1', 'hex_md5', 'hex_md4'
 ]
 
+# Default cost parameters of the memory-hard hashers (besides `rounds`).
+# argon2: 64 MiB, 4 lanes. The rounds (``time_cost``) default to 3.
+HASHER_PARAMS = {
+    'argon2': {'memory_cost': 64 * 1024, 'parallelism': 4},
+    'scrypt': {'parallelism': 1},
+}
+ARGON2_DEFAULT_ROUNDS = 3
+
 MIN_SECRET_LENGTH = 15
 
+# How `User.roles` can be loaded: a query (the default), with an extra
+# query for all the users of a query ('selectin' or 'subquery'),
+# with a JOIN ('joined') or with a query per user ('select').
+ROLES_LAZY = ('dynamic', 'select', 'selectin', 'joined', 'subquery')
+
 TEMPLATES = {
     'sign_in': 'sign-in.html',
     'sign_out': None,
@@ -0,0 +1,120 @@
+# coding=utf-8
+"""
+    Checks run by ``auth_password`` after finding the user but **before**
+    verifying the password, so requests that will be rejected anyway never
+    pay for the password hashing.
+
+    A gate is any callable that takes ``(auth, user, credentials)`` and
+    returns ``True`` to let the request continue. A gate can also have an
+    ``on_failure(auth, user, credentials)`` method, called when the
+    password turns out to be wrong, and an ``on_success`` one, with the
+    same arguments, called when it's right.
+
+    Set the list of gates with the ``login_gates`` setting, using either
+    callables or the names of the gates in this module.
+"""
+from datetime import datetime
+import threading
+
+from .utils import LRUCache
+
+
+def missing_password(auth, user, credentials):
+    """Reject users without a password."""
+    return bool(user.password)
+
+
+def suspended(auth, user, credentials):
+    """Reject deleted (suspended) users.
+
+    Notice that, unlike the check in the sign in view, this makes the view
+    to show a generic "wrong credentials" error even if the password
+    is right.
+    """
+    return not user.deleted
+
+
+def locked_out(auth, user, credentials):
+    """Reject users with a ``locked_until`` attribute in the future.
+    Add that column to your ``UserMixin`` to use this gate."""
+    locked_until = getattr(user, 'locked_until', None)
+    return not locked_until or locked_until <= datetime.utcnow()
+
+
+class LoginThrottle(object):
+    """Reject the login after ``max_failures`` wrong passwords, until
+    ``window`` seconds have passed since the last one. A successful
+    login resets the count. At most ``maxsize`` users are tracked.
+
+    The users are identified by their model name and ID, so users of
+    different `Auth` instances (eg: tenants) don't share their counts.
+    """
+
+    __name__ = 'throttled'
+
+    def __init__(self, max_failures=5, window=5 * 60, maxsize=10000):
+        self.max_failures = max_failures
+        self.failures = LRUCache(maxsize=maxsize, ttl=window)
+        self._lock = threading.Lock()
+
+    def __call__(self, auth, user, credentials):
+        return self.failures.get(get_user_key(auth, user), 0) < self.max_failures
+
+    def on_failure(self, auth, user, credentials):
+        key = get_user_key(auth, user)
+        with self._lock:
+            self.failures.set(key, self.failures.get(key, 0) + 1)
+
+    def on_success(self, auth, user, credentials):
+        key = get_user_key(auth, user)
+        with self._lock:
+            self.failures.pop(key)
+
+
+def get_user_key(auth, user):
+    return (auth.users_model_name, user.id)
+
+
+# Shared by all the `Auth` instances using the `'throttled'` name.
+throttled = LoginThrottle()
+
+GATES = {
+    'missing_password': missing_password,
+    'suspended': suspended,
+    'locked_out': locked_out,
+    'throttled': throttled,
+}
+
+
+def get_gate_name(gate):
+    return getattr(gate, '__name__', None) or gate.__class__.__name__
+
+
+def resolve_gates(gates):
+    return [gate if callable(gate) else GATES[gate] for gate in gates]
+
+
+def run_gates(auth, user, credentials):
+    """Return the name of the first gate that rejects the user or
+    ``None`` if all of them pass."""
+    for gate in resolve_gates(auth.login_gates):
+        if not gate(auth, user, credentials):
+            name = get_gate_name(gate)
+            auth.gate_rejections[name] += 1
+            return name
+    return None
+
+
+def run_failure_hooks(auth, user, credentials):
+    _run_hooks('on_failure', auth, user, credentials)
+
+
+def run_success_hooks(auth, user, credentials):
+    _run_hooks('on_success', auth, user, credentials)
+
+
+def _run_hooks(hook, auth, user, credentials):
+    for gate in resolve_gates(auth.login_gates):
+        func = getattr(gate, hook, None)
+        if func is not None:
+            func(auth, user, credentials)
@@ -0,0 +1,221 @@
+# coding=utf-8
+"""
+    Process-wide registry of password hashers.
+
+    Building a `CryptContext` (and testing its backend) is slow, so
+    `Auth` instances with the same hasher configuration share one,
+    built the first time any of them needs it.
+"""
+from math import log
+import os
+import threading
+from timeit import default_timer
+
+from . import utils
+from .constants import (
+    VALID_HASHERS, DEPRECATED_HASHERS, HASHER_PARAMS, ARGON2_DEFAULT_ROUNDS)
+
+
+_contexts = {}
+_lock = threading.Lock()
+
+# Cost parameters, other than `rounds`, that each hasher accepts
+TUNABLE = {
+    'argon2': ('memory_cost', 'time_cost', 'parallelism'),
+    'scrypt': ('memory_cost', 'parallelism'),
+}
+
+
+def get_context(hash, rounds=None, **params):
+    """Return a tuple ``(context, rounds)`` with the shared `CryptContext`
+    for this configuration and the number of rounds actually used
+    (``rounds`` adjusted to the limits of the algorithm).
+
+    ``params`` are extra cost parameters, like the ``memory_cost`` and
+    ``parallelism`` of argon2. Use `get_params` to validate them first.
+    """
+    hash = hash.replace('-', '_')
+    key = (hash, rounds, tuple(sorted(params.items())))
+    item = _contexts.get(key)
+    if item is not None:
+        return item
+
+    with _lock:
+        item = _contexts.get(key)
+        if item is None:
+            rounds = get_rounds(hash, rounds)
+            params = tuple(sorted(dict(HASHER_PARAMS.get(hash, {}), **params).items()))
+            # `rounds=None` and the default value are the same configuration
+            item = _contexts.get((hash, rounds, params))
+            if item is None:
+                item = (build_context(hash, rounds, params), rounds)
+                _contexts[(hash, rounds, params)] = item
+            _contexts[key] = item
+    return item
+
+
+def get_rounds(hash, rounds=None):
+    hasher = get_hasher(hash)
+    default_rounds = getattr(hasher, 'default_rounds', 1)
+    if hash == 'argon2':
+        default_rounds = ARGON2_DEFAULT_ROUNDS
+    min_rounds = getattr(hasher, 'min_rounds', 1)
+    max_rounds = getattr(hasher, 'max_rounds', float("inf"))
+    return min(max(rounds or default_rounds, min_rounds), max_rounds)
+
+
+def get_params(hash, rounds=None, memory_cost=None, time_cost=None,
+               parallelism=None):
+    """Validate the cost parameters of a hasher and return a tuple
+    ``(rounds, params)``, with ``params`` being a dict for `get_context`.
+
+    :memory_cost: in KiB. For scrypt, it sets the `rounds` (log2 of N):
+        with the default block size, scrypt uses N KiB.
+    :time_cost: the `rounds` of argon2.
+    :parallelism: number of lanes (argon2) or of parallel mixes (scrypt).
+
+    Raises a ValueError if they are invalid or the hasher doesn't use them.
+    """
+    hash = hash.replace('-', '_')
+    given = [
+        ('memory_cost', memory_cost),
+        ('time_cost', time_cost),
+        ('parallelism', parallelism),
+    ]
+    for name, value in given:
+        if value is None:
+            continue
+        if name not in TUNABLE.get(hash, ()):
+            raise ValueError('`{0}` is not a parameter of `{1}`'.format(name, hash))
+        if not isinstance(value, int) or value < 1:
+            raise ValueError('`{0}` must be a positive integer'.format(name))
+
+    if time_cost is not None:
+        if rounds is not None and rounds != time_cost:
+            raise ValueError('Use either `rounds` or `time_cost`')
+        rounds = time_cost
+
+    params = {}
+    if parallelism is not None:
+        params['parallelism'] = parallelism
+    if hash == 'argon2':
+        if memory_cost is not None:
+            params['memory_cost'] = memory_cost
+        defaults = HASHER_PARAMS['argon2']
+        lanes = params.get('parallelism', defaults['parallelism'])
+        memory = params.get('memory_cost', defaults['memory_cost'])
+        if memory < 8 * lanes:
+            raise ValueError('`memory_cost` must be at least 8 KiB per lane')
+    elif hash == 'scrypt' and memory_cost is not None:
+        log_n = int(log(memory_cost, 2))
+        if log_n < 1:
+            raise ValueError('`memory_cost` of scrypt must be at least 2 KiB')
+        if rounds is not None and rounds != log_n:
+            raise ValueError('Use either `rounds` or `memory_cost`')
+        rounds = log_n
+    return rounds, params
+
+
+def get_hasher(hash):
+    from passlib import hash as ph
+    return getattr(ph, hash)
+
+
+def build_context(hash, rounds, params=()):
+    from passlib.context import CryptContext
+
+    utils.test_hasher(get_hasher(hash))
+    op = {
+        'schemes': VALID_HASHERS + DEPRECATED_HASHERS,
+        'deprecated': DEPRECATED_HASHERS,
+        'default': hash,
+        hash + '__default_rounds': rounds
+    }
+    for name, value in params:
+        op[hash + '__' + name] = value
+    return CryptContext(**op)
+
+
+def calibrate(hash='argon2', rounds=None, memory_cost=None, time_cost=None,
+              parallelism=None, target=None, memory_budget=None, samples=3):
+    """Measure the cost of a hasher configuration in this machine.
+
+    :target: if set, the rounds are increased until hashing takes at
+        least this number of seconds.
+    :memory_budget: KiB of memory available for hashing, to limit
+        how many hashes can run at the same time.
+
+    Returns a dict with the configuration (`rounds` and `params`), the
+    ``seconds`` per hash, the ``memory`` (KiB) used per hash, the
+    ``hashes_per_core`` per second, and the ``max_hashes_per_second``
+    with all the cores (and the memory budget) of the machine.
+    """
+    hash = hash.replace('-', '_')
+    rounds, params = get_params(
+        hash, rounds, memory_cost=memory_cost, time_cost=time_cost,
+        parallelism=parallelism)
+    params = dict(HASHER_PARAMS.get(hash, {}), **params)
+    hasher = get_hasher(hash)
+    rounds = get_rounds(hash, rounds)
+    max_rounds = getattr(hasher, 'max_rounds', None) or rounds
+    log_rounds = getattr(hasher, 'rounds_cost', 'linear') == 'log2'
+
+    while True:
+        context = build_context(hash, rounds, tuple(sorted(params.items())))
+        seconds = _measure(context, samples)
+        if not target or seconds >= target or rounds >= max_rounds:
+            break
+        rounds = min(rounds + 1 if log_rounds else rounds * 2, max_rounds)
+
+    lanes = params.get('parallelism', 1) if hash == 'argon2' else 1
+    if hash == 'argon2':
+        memory = params['memory_cost']
+    elif hash == 'scrypt':
+        memory = 2 ** rounds
+    else:
+        memory = 0
+    cores = _cpu_count()
+    hashes_per_core = 1.0 / (seconds * lanes)
+    max_hashes = cores * hashes_per_core
+    if memory_budget and memory:
+        max_hashes = min(max_hashes, (memory_budget // memory) / seconds)
+    return {
+        'hash': hash,
+        'rounds': rounds,
+        'params': params,
+        'seconds': seconds,
+        'memory': memory,
+        'lanes': lanes,
+        'cores': cores,
+        'hashes_per_core': hashes_per_core,
+        'max_hashes_per_second': max_hashes,
+    }
+
+
+def _measure(context, samples):
+    times = []
+    for _ in range(samples):
+        start = default_timer()
+        context.hash(u'calibration password')
+        times.append(default_timer() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def clear():
+    """Forget all the shared hashers."""
+    with _lock:
+        _contexts.clear()
+
+
+def count():
+    """Return the number of different hashers built."""
+    return len(set(id(item[0]) for item in list(_contexts.values())))
@@ -0,0 +1,150 @@
+# coding=utf-8
+"""
+    Check a password against the previous hashes of a user.
+
+    Each check runs the (slow) password hashing, so they run in parallel
+    in a small pool of processes, and the first match stops the rest.
+    If the pool fails or is too slow, the checks run in this process instead.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from time import time
+
+from . import hashers
+
+try:
+    from concurrent.futures import (
+        ProcessPoolExecutor, FIRST_COMPLETED, TimeoutError, wait)
+except ImportError:  # pragma: no cover
+    # Python 2 without the `futures` backport
+    ProcessPoolExecutor = None
+
+
+# Each web worker has its own pool, so keep it small
+DEFAULT_WORKERS = 2
+
+# Max seconds to wait for the pool before checking in this process.
+DEFAULT_TIMEOUT = 10
+
+_pool = None
+_pool_pid = None
+_pool_workers = None
+_lock = threading.Lock()
+
+
+def get_pool(workers=None):
+    """Return the shared pool of processes, started the first time
+    it's needed (in each process, so it works after a fork) and
+    rebuilt if the number of ``workers`` changes."""
+    global _pool, _pool_pid, _pool_workers
+    workers = workers or DEFAULT_WORKERS
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid and _pool_workers == workers:
+        return _pool
+    with _lock:
+        if _pool is None or _pool_pid != pid or _pool_workers != workers:
+            if _pool is not None and _pool_pid == pid:
+                _pool.shutdown(wait=False)
+            _pool = _new_pool(workers)
+            _pool_pid = pid
+            _pool_workers = workers
+    return _pool
+
+
+def _new_pool(workers):
+    # Forking copies the locks held by other threads of this process,
+    # so a forked worker can deadlock. Start the workers from a clean
+    # process instead, if the platform (and Python version) allows it.
+    get_all_start_methods = getattr(multiprocessing, 'get_all_start_methods', None)
+    if get_all_start_methods is not None:
+        methods = get_all_start_methods()
+        for method in ('forkserver', 'spawn'):
+            if method in methods:
+                try:
+                    return ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=multiprocessing.get_context(method))
+                except TypeError:  # pragma: no cover
+                    # Python < 3.7
+                    break
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=True)
+        _pool = None
+
+
+def verify(config, secret, hashed):
+    """Verify a (prepared) secret against a hash, using the shared hasher
+    for ``config``, a tuple ``(hash, rounds, params)``."""
+    hash, rounds, params = config
+    context, _ = hashers.get_context(hash, rounds, **dict(params))
+    try:
+        return context.verify(secret, hashed)
+    except ValueError:
+        return False
+
+
+def any_matches(config, candidates, workers=None, timeout=None):
+    """Return ``True`` if any of the ``candidates``, a list of tuples
+    ``(secret, hashed)``, matches.
+
+    With ``workers=0`` (or just one candidate), they are checked in this
+    process instead. They are also checked here if the pool doesn't
+    finish in ``timeout`` seconds (by default, `DEFAULT_TIMEOUT`).
+    """
+    if not candidates:
+        return False
+    if workers == 0 or len(candidates) == 1 or ProcessPoolExecutor is None:
+        return _any_matches_here(config, candidates)
+    try:
+        return _any_matches_in_pool(config, candidates, workers, timeout)
+    except Exception:
+        # eg: a `BrokenProcessPool`, not being able to start the processes
+        # or a `TimeoutError` because they are stuck.
+        logger = logging.getLogger(__name__)
+        logger.exception(u'Password history pool failed, checking in-process')
+        _discard_pool()
+        return _any_matches_here(config, candidates)
+
+
+def _any_matches_here(config, candidates):
+    return any(verify(config, secret, hashed) for secret, hashed in candidates)
+
+
+def _any_matches_in_pool(config, candidates, workers, timeout=None):
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    deadline = time() + timeout
+    pool = get_pool(workers)
+    pending = set(
+        pool.submit(verify, config, secret, hashed)
+        for secret, hashed in candidates
+    )
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=max(deadline - time(), 0),
+                return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(
+                    u'Password history checks took more than {0}s'.format(timeout))
+            if any(future.result() for future in done):
+                return True
+        return False
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _discard_pool():
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False)
+        _pool = None
@@ -0,0 +1,240 @@
+# coding=utf-8
+"""
+    Report of the password hashes stored in the users table: how many use
+    each scheme, at which cost, and how many will be upgraded the next time
+    their users log in.
+
+    The hashes are read in batches (ordered by ID, so each batch is a cheap
+    indexed query) and only their prefixes are parsed, without running any
+    password hashing, so it works in constant memory with any number of
+    users.
+
+    From the command line::
+
+        python -m authcode.inventory myapp.models:auth --csv hashes.csv
+
+"""
+from __future__ import print_function
+
+from collections import Counter
+import argparse
+import csv
+import importlib
+
+from sqlalchemy import select
+
+from . import utils
+from .constants import DEPRECATED_HASHERS, HASHER_PARAMS
+
+
+# Prefixes of the hashes of each scheme, most specific first
+PREFIXES = [
+    ('{CRYPT}$6$', 'ldap_sha512_crypt'),
+    ('{CRYPT}$5$', 'ldap_sha256_crypt'),
+    ('{CRYPT}$2', 'ldap_bcrypt'),
+    ('{PBKDF2-SHA512}', 'ldap_pbkdf2_sha512'),
+    ('{PBKDF2-SHA256}', 'ldap_pbkdf2_sha256'),
+    ('$pbkdf2-sha512$', 'pbkdf2_sha512'),
+    ('$pbkdf2-sha256$', 'pbkdf2_sha256'),
+    ('$pbkdf2$', 'pbkdf2_sha1'),
+    ('$6$', 'sha512_crypt'),
+    ('$5$', 'sha256_crypt'),
+    ('$2a$', 'bcrypt'),
+    ('$2b$', 'bcrypt'),
+    ('$2y$', 'bcrypt'),
+    ('$argon2', 'argon2'),
+    ('$scrypt$', 'scrypt'),
+    ('pbkdf2_sha256$', 'django_pbkdf2_sha256'),
+    ('pbkdf2_sha1$', 'django_pbkdf2_sha1'),
+    ('bcrypt$', 'django_bcrypt'),
+    ('sha1$', 'django_salted_sha1'),
+    ('md5$', 'django_salted_md5'),
+    ('crypt$', 'django_des_crypt'),
+]
+
+HEX_LENGTHS = {128: 'hex_sha512', 64: 'hex_sha256', 40: 'hex_sha1', 32: 'hex_md5'}
+HEX_CHARS = frozenset('0123456789abcdefABCDEF')
+
+CSV_HEADER = ['scheme', 'cost', 'params', 'upgrade', 'user_id']
+
+MAX_CACHED = 1000
+
+
+def parse_hash(hashed):
+    """Return a tuple ``(scheme, cost, params)`` for a stored hash,
+    without verifying anything. ``params`` are the ones of the authcode
+    envelope (eg: the pepper ID), as a string.
+    """
+    if not hashed:
+        return 'none', '', ''
+    params, hashed = utils.split_hash_envelope(hashed)
+    params = ','.join('{0}={1}'.format(*item) for item in sorted(params.items()))
+
+    for prefix, scheme in PREFIXES:
+        if hashed.startswith(prefix):
+            return scheme, get_cost(scheme, hashed), params
+    if len(hashed) in HEX_LENGTHS and HEX_CHARS.issuperset(hashed):
+        # `hex_md4` looks exactly like `hex_md5`
+        return HEX_LENGTHS[len(hashed)], '', params
+    return 'unknown', '', params
+
+
+def get_cost(scheme, hashed):
+    """Extract the rounds (or the cost parameters) from the hash."""
+    if scheme.startswith('ldap_'):
+        hashed = hashed.split('}', 1)[-1]
+        scheme = scheme[5:]
+    parts = hashed.split('$')
+    if scheme.startswith('pbkdf2') and not hashed.startswith('$'):
+        # {PBKDF2-SHA256}29000$salt$checksum
+        return parts[0]
+    if scheme.startswith('django_'):
+        return parts[1] if scheme in ('django_pbkdf2_sha256', 'django_pbkdf2_sha1') else ''
+    if scheme in ('sha512_crypt', 'sha256_crypt'):
+        if parts[2].startswith('rounds='):
+            return parts[2][len('rounds='):]
+        return '5000'
+    if scheme == 'argon2':
+        # $argon2id$v=19$m=65536,t=3,p=4$...
+        return parts[3] if len(parts) > 3 else ''
+    if len(parts) > 2:
+        return parts[2]
+    return ''
+
+
+def format_cost(scheme, rounds, params):
+    """Return the cost of a hash made with this configuration, in the
+    same format as `get_cost`."""
+    if scheme.startswith('ldap_'):
+        scheme = scheme[5:]
+    if scheme == 'bcrypt':
+        return '{0:02d}'.format(rounds)
+    if scheme == 'argon2':
+        return 'm={0},t={1},p={2}'.format(
+            params['memory_cost'], rounds, params['parallelism'])
+    if scheme == 'scrypt':
+        return 'ln={0},r={1},p={2}'.format(
+            rounds, params.get('block_size', 8), params['parallelism'])
+    return str(rounds)
+
+
+def get_current_key(auth):
+    """Return the ``(scheme, cost, params)`` of the new hashes, from the
+    configuration of the `Auth`, without running any password hashing."""
+    scheme = auth.hash.replace('-', '_')
+    hash_params = dict(HASHER_PARAMS.get(scheme, {}), **auth.hash_params)
+    params = ','.join(
+        '{0}={1}'.format(*item) for item in sorted(auth.get_hash_params().items()))
+    return scheme, format_cost(scheme, auth.rounds, hash_params), params
+
+
+def iter_hashes(auth, batch_size=10000):
+    """Yield lists of ``(user_id, password)`` of all the users, in batches."""
+    table = auth.User.__table__
+    last_id = None
+    while True:
+        query = select([table.c.id, table.c.password])
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        query = query.order_by(table.c.id).limit(batch_size)
+        rows = auth.db.session.execute(query).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def hash_inventory(auth, batch_size=10000, csv_file=None):
+    """Return a dict with the number of hashes of each ``(scheme, cost,
+    params)`` and how many of them will be upgraded the next time their
+    users log in (none if ``Auth.update_hash`` is disabled).
+
+    :csv_file: an open file to write a row with the bucket of every user.
+    """
+    current = get_current_key(auth)
+    writer = None
+    if csv_file is not None:
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_HEADER)
+
+    # The parsing and the upgrade check are cached by prefix, not by hash,
+    # because there are only a few different configurations.
+    buckets = Counter()
+    signatures = {}
+    for rows in iter_hashes(auth, batch_size=batch_size):
+        keys = []
+        for user_id, hashed in rows:
+            signature = utils.get_hash_signature(hashed)
+            cache_key = repr(signature)
+            key = signatures.get(cache_key)
+            if key is None:
+                key = parse_hash(hashed)
+                upgrade = bool(auth.update_hash and hashed) and key != current
+                key += (upgrade, )
+                if len(signatures) >= MAX_CACHED:
+                    # Hashes without rounds include part of the salt
+                    signatures.clear()
+                signatures[cache_key] = key
+            keys.append(key)
+            if writer is not None:
+                writer.writerow(list(key) + [user_id])
+        buckets.update(keys)
+
+    report = []
+    for (scheme, cost, params, upgrade), count in buckets.most_common():
+        report.append({
+            'scheme': scheme,
+            'cost': cost,
+            'params': params,
+            'deprecated': scheme in DEPRECATED_HASHERS,
+            'upgrade': upgrade,
+            'count': count,
+        })
+    return {
+        'total': sum(buckets.values()),
+        'upgrade': sum(item['count'] for item in report if item['upgrade']),
+        'buckets': report,
+    }
+
+
+def format_report(report):
+    lines = [
+        u'{0:<22} {1:<28} {2:<16} {3:<8} {4:>10}'.format(
+            'scheme', 'cost', 'params', 'upgrade', 'count'),
+    ]
+    for item in report['buckets']:
+        scheme = item['scheme'] + (' (deprecated)' if item['deprecated'] else '')
+        lines.append(u'{0:<22} {1:<28} {2:<16} {3:<8} {4:>10}'.format(
+            scheme, item['cost'], item['params'],
+            'yes' if item['upgrade'] else 'no', item['count']))
+    lines.append(u'{0} hashes, {1} to be upgraded'.format(
+        report['total'], report['upgrade']))
+    return u'\n'.join(lines)
+
+
+def import_auth(path):
+    """Import an `Auth` instance from a ``module:attribute`` path."""
+    module, _, attr = path.partition(':')
+    return getattr(importlib.import_module(module), attr or 'auth')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m authcode.inventory')
+    parser.add_argument('auth', help='`module:attribute` of the Auth instance')
+    parser.add_argument('--csv', help='Write the bucket of every user to this file')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args(args)
+
+    auth = import_auth(args.auth)
+    if args.csv:
+        with open(args.csv, 'w') as csv_file:
+            report = hash_inventory(auth, args.batch_size, csv_file=csv_file)
+    else:
+        report = hash_inventory(auth, args.batch_size)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    import sys
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# coding=utf-8
+"""
+    Framework-free WSGI middleware.
+
+    The identity of the user is stored in a signed cookie, so it can be
+    resolved without any server-side session, once, before calling the
+    wrapped application. The cookie is bound to the user's password hash
+    and checked against the database when it's renewed (or in every
+    request, with ``verify_user=True``), so changing the password or
+    deleting the user logs out its cookies. Paths can be protected with
+    rules that are enforced before the application is even called.
+
+    The application can read from the WSGI environ:
+
+    - ``authcode.identity``: the claims of the cookie (the user ID is
+      ``sub``) or ``None``.
+    - ``authcode.get_user``: a function that loads (only once) the user.
+    - ``authcode.login``: a function that takes a user and logs it in.
+    - ``authcode.logout``: a function that logs out the current user
+      (and revokes the cookie, if the auth has a ``revocation_list``).
+"""
+from time import time
+
+from . import bearer, utils
+from ._compat import PY2, to_native
+
+if PY2:  # pragma: no cover
+    from urllib import quote
+else:
+    from urllib.parse import quote
+
+
+COOKIE = 'c'
+
+
+class AuthMiddleware(object):
+    """
+    :app: the WSGI application to wrap.
+    :auth: the `~authcode.Auth` instance.
+    :rules: a list of ``(path_prefix, rule)``. For each request, the rule
+        with the longest matching prefix is used. Prefixes match whole
+        path segments: ``/admin`` matches ``/admin`` and ``/admin/users``,
+        but not ``/administrator``. A rule can be:
+
+        - ``False`` or ``None``: public.
+        - ``True``: the user must be logged in.
+        - a callable that takes the identity and the environ and returns
+          ``True`` to allow the request (the user must be logged in).
+
+        Paths without a matching rule are public.
+    :cookie_name: name of the signed cookie.
+    :max_age: seconds before the cookie expires. It's renewed when more
+        than half of this has passed.
+    :url_sign_in: if set, anonymous users trying to access a protected path
+        are redirected there instead of getting a 401 error.
+    :secure: mark the cookie as HTTPS-only.
+    :verify_user: check the user in the database in every request instead
+        of only when the cookie is renewed.
+    """
+
+    def __init__(self, app, auth, rules=(), cookie_name='auth',
+                 max_age=24 * 60 * 60, url_sign_in=None, secure=False,
+                 verify_user=False):
+        self.app = app
+        self.auth = auth
+        self.cookie_name = cookie_name
+        self.max_age = max_age
+        self.url_sign_in = url_sign_in
+        self.secure = secure
+        self.verify_user = verify_user
+        # Longest prefixes first
+        self.rules = sorted(rules, key=lambda rule: -len(rule[0]))
+
+    def __call__(self, environ, start_response):
+        identity = self.get_identity(environ)
+        state = {'cookie': None}
+        cache = {}
+
+        renew = identity and identity['exp'] - time() < self.max_age / 2.0
+        if renew or (identity and self.verify_user):
+            user = self.load_user(identity)
+            cache['user'] = user
+            if user is None:
+                identity = None
+                state['cookie'] = self.make_cookie(None)
+            elif renew:
+                state['cookie'] = self.make_cookie(user)
+
+        def _start_response(status, headers, exc_info=None):
+            if state['cookie'] is not None:
+                headers = list(headers) + [('Set-Cookie', state['cookie'])]
+            return start_response(status, headers, exc_info)
+
+        rule = self.get_rule(environ.get('PATH_INFO') or '/')
+        if rule:
+            if not identity:
+                return self.login_required(environ, _start_response)
+            if callable(rule) and not rule(identity, environ):
+                return self.forbidden(environ, _start_response)
+
+        self.set_environ(environ, identity, state, cache)
+        return self.app(environ, _start_response)
+
+    def get_identity(self, environ):
+        value = get_cookie(environ, self.cookie_name)
+        if not value:
+            return None
+        claims = bearer.loads(self.auth.key_ring, value, COOKIE)
+        if not claims:
+            return None
+        revocation_list = self.auth.revocation_list
+        if revocation_list is not None and revocation_list.is_revoked(claims.get('sid')):
+            return None
+        return claims
+
+    def load_user(self, identity):
+        """Return the user of the identity or ``None`` if it no longer
+        exists, is deleted or has changed its password."""
+        user = self.auth.User.by_id(identity['sub'])
+        if not user or user.deleted:
+            return None
+        binding = self.auth._get_password_binding(user)
+        if not utils.constant_time_compare(binding, identity.get('pwd', '')):
+            return None
+        return user
+
+    def get_rule(self, path):
+        for prefix, rule in self.rules:
+            if path_matches(path, prefix):
+                return rule
+        return None
+
+    def set_environ(self, environ, identity, state, cache):
+        auth = self.auth
+
+        def get_user():
+            if not identity:
+                return None
+            if 'user' not in cache:
+                cache['user'] = auth.User.by_id(identity['sub'])
+            return cache['user']
+
+        def login(user):
+            state['cookie'] = self.make_cookie(user)
+
+        def logout():
+            revocation_list = auth.revocation_list
+            if identity and revocation_list is not None:
+                revocation_list.revoke(identity.get('sid'))
+            state['cookie'] = self.make_cookie(None)
+
+        environ['authcode.identity'] = identity
+        environ['authcode.get_user'] = get_user
+        environ['authcode.login'] = login
+        environ['authcode.logout'] = logout
+
+    def make_cookie(self, user):
+        """Return the value of a ``Set-Cookie`` header for this user,
+        or to delete the cookie if ``user`` is ``None``."""
+        if user is None:
+            value = ''
+            max_age = 0
+        else:
+            value = bearer.dumps(self.auth.key_ring, {
+                'typ': COOKIE,
+                'sub': user.id,
+                'sid': utils.random_token(12),
+                'pwd': self.auth._get_password_binding(user),
+                'exp': int(time()) + self.max_age,
+            })
+            max_age = self.max_age
+        cookie = '{0}={1}; Path=/; Max-Age={2}; HttpOnly; SameSite=Lax'.format(
+            self.cookie_name, value, max_age)
+        if self.secure:
+            cookie += '; Secure'
+        return cookie
+
+    def login_required(self, environ, start_response):
+        if self.url_sign_in:
+            path = environ.get('SCRIPT_NAME', '') + (environ.get('PATH_INFO') or '/')
+            location = '{0}?{1}={2}'.format(
+                self.url_sign_in, self.auth.redirect_key, quote(path))
+            start_response('303 See Other', [('Location', location)])
+            return [b'']
+        start_response('401 Unauthorized', [('Content-Type', 'text/plain')])
+        return [b'Unauthorized']
+
+    def forbidden(self, environ, start_response):
+        start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+        return [b'Forbidden']
+
+
+def path_matches(path, prefix):
+    """Is `path` the same as `prefix` or inside it?"""
+    if not path.startswith(prefix):
+        return False
+    if len(path) == len(prefix) or prefix.endswith('/'):
+        return True
+    return path[len(prefix)] == '/'
+
+
+def get_cookie(environ, name):
+    """Read a cookie without parsing the whole header, most of the time."""
+    header = environ.get('HTTP_COOKIE')
+    if not header or name not in header:
+        return None
+    for chunk in header.split(';'):
+        key, _, value = chunk.strip().partition('=')
+        if key == name:
+            return to_native(value.strip('"'))
+    return None
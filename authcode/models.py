@@ -1,13 +1,15 @@
 # coding=utf-8
+from datetime import datetime
 import logging
 
 from sqlalchemy import (
-    Table, Column, Integer, Unicode, String, DateTime, Boolean, ForeignKey,
+    Table, Column, Integer, Unicode, UnicodeText, String, DateTime, Boolean,
+    ForeignKey, Index, and_, exists, false, func, select,
 )
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import validates, relationship, backref
+from sqlalchemy.orm import validates, relationship, backref, joinedload
 
-from .utils import get_uhmac, get_token
+from .utils import get_uhmac, get_token, keyed_hash, random_token
 from ._compat import to_unicode, to_native
 
 
@@ -64,7 +66,10 @@ def get_auth_user_mixin(auth, roles=False):
         def __hash_password(self, key, secret):
             logger = logging.getLogger(__name__)
             logger.debug(u'Hash updated for user `{0}`'.format(self.login))
-            return auth.hash_password(secret)
+            hashed = auth.hash_password(secret)
+            if hashed and getattr(auth, 'PasswordHistory', None) is not None:
+                auth.PasswordHistory.add(self, hashed)
+            return hashed
 
         @validates('login')
         def __clean_login(self, key, login):
@@ -118,6 +123,259 @@ def get_auth_user_mixin(auth, roles=False):
     return AuthUserMixin
 
 
+def extend_remember_token_model(auth, User):
+    db = auth.db
+    AuthRememberTokenMixin = get_auth_remember_token_mixin(auth)
+
+    name = '{0}RememberToken'.format(auth.users_model_name)
+    attrs = {
+        '__tablename__': '{0}_remember_tokens'.format(User.__tablename__),
+        'id': Column(Integer, primary_key=True),
+        'selector': Column(String(32), nullable=False, unique=True, index=True),
+        'validator': Column(String(64), nullable=False),
+        # Keyed hash of part of the password hash, so changing
+        # the password invalidates the token.
+        'password_binding': Column(String(20), nullable=False, default=u''),
+        'user_id': Column(Integer, ForeignKey(User.id), nullable=False, index=True),
+        'expires_at': Column(DateTime, nullable=False, index=True),
+    }
+    return type(name, (AuthRememberTokenMixin, DictSerializable, db.Model), attrs)
+
+
+def get_auth_remember_token_mixin(auth):
+    db = auth.db
+
+    class AuthRememberTokenMixin(object):
+
+        @classmethod
+        def by_selector(cls, selector):
+            return db.session.query(cls).filter(cls.selector == selector).first()
+
+        @classmethod
+        def purge_expired(cls, now=None):
+            """Delete all the expired tokens in a single statement.
+            Returns the number of deleted rows."""
+            now = now or datetime.utcnow()
+            table = cls.__table__
+            result = db.session.execute(
+                table.delete().where(table.c.expires_at < now)
+            )
+            db.session.commit()
+            return result.rowcount
+
+        @classmethod
+        def delete_for_user(cls, user_id):
+            table = cls.__table__
+            db.session.execute(
+                table.delete().where(table.c.user_id == user_id)
+            )
+
+        @property
+        def is_expired(self):
+            return self.expires_at < datetime.utcnow()
+
+        def __repr__(self):
+            repr = '<RememberToken {0}>'.format(self.selector)
+            return to_native(repr)
+
+    return AuthRememberTokenMixin
+
+
+def extend_session_model(auth, User):
+    db = auth.db
+    AuthSessionMixin = get_auth_session_mixin(auth)
+
+    name = '{0}Session'.format(auth.users_model_name)
+    attrs = {
+        '__tablename__': '{0}_sessions'.format(User.__tablename__),
+        'sid': Column(String(64), primary_key=True),
+        'user_id': Column(Integer, ForeignKey(User.id), nullable=True, index=True),
+        'data': Column(UnicodeText, nullable=False, default=u'{}'),
+        'created_at': Column(DateTime, nullable=False, default=datetime.utcnow),
+        'expires_at': Column(DateTime, nullable=False, index=True),
+    }
+    return type(name, (AuthSessionMixin, DictSerializable, db.Model), attrs)
+
+
+def get_auth_session_mixin(auth):
+    db = auth.db
+
+    class AuthSessionMixin(object):
+
+        @classmethod
+        def by_sid(cls, sid, now=None):
+            now = now or datetime.utcnow()
+            return (db.session.query(cls)
+                    .filter(cls.sid == sid, cls.expires_at > now)
+                    .first())
+
+        @classmethod
+        def by_user_id(cls, user_id, now=None):
+            now = now or datetime.utcnow()
+            return (db.session.query(cls)
+                    .filter(cls.user_id == user_id, cls.expires_at > now)
+                    .order_by(cls.created_at)
+                    .all())
+
+        def __repr__(self):
+            repr = '<Session {0}>'.format(self.sid[:8])
+            return to_native(repr)
+
+    return AuthSessionMixin
+
+
+def extend_api_key_model(auth, User):
+    db = auth.db
+    AuthApiKeyMixin = get_auth_api_key_mixin(auth, User)
+
+    name = '{0}ApiKey'.format(auth.users_model_name)
+    attrs = {
+        '__tablename__': '{0}_api_keys'.format(User.__tablename__),
+        'id': Column(Integer, primary_key=True),
+        'prefix': Column(String(16), nullable=False, unique=True, index=True),
+        'key_hash': Column(String(64), nullable=False),
+        'user_id': Column(Integer, ForeignKey(User.id), nullable=False, index=True),
+        'name': Column(Unicode(255), nullable=False, default=u''),
+        'scopes': Column(Unicode(1024), nullable=False, default=u''),
+        'created_at': Column(DateTime, nullable=False, default=datetime.utcnow),
+        'last_used_at': Column(DateTime, nullable=True),
+        'revoked_at': Column(DateTime, nullable=True),
+    }
+    ApiKey = type(name, (AuthApiKeyMixin, DictSerializable, db.Model), attrs)
+
+    ApiKey.user = relationship(
+        User, enable_typechecks=False,
+        backref=backref('api_keys', lazy='dynamic')
+    )
+    return ApiKey
+
+
+def extend_password_history_model(auth, User):
+    db = auth.db
+    AuthPasswordHistoryMixin = get_auth_password_history_mixin(auth)
+
+    name = '{0}PasswordHistory'.format(auth.users_model_name)
+    attrs = {
+        '__tablename__': '{0}_password_history'.format(User.__tablename__),
+        'id': Column(Integer, primary_key=True),
+        'user_id': Column(Integer, ForeignKey(User.id), nullable=False, index=True),
+        'password': Column(String(255), nullable=False),
+        'created_at': Column(DateTime, nullable=False, default=datetime.utcnow),
+    }
+    PasswordHistory = type(
+        name, (AuthPasswordHistoryMixin, DictSerializable, db.Model), attrs)
+
+    PasswordHistory.user = relationship(
+        User, enable_typechecks=False,
+        backref=backref('password_history', lazy='dynamic',
+                        cascade='all, delete-orphan')
+    )
+    return PasswordHistory
+
+
+def get_auth_password_history_mixin(auth):
+    db = auth.db
+
+    class AuthPasswordHistoryMixin(object):
+
+        @classmethod
+        def add(cls, user, hashed):
+            """Add the hash to the history of the user, keeping only the
+            last `auth.password_history` ones (including this)."""
+            if user.id is not None:
+                cls.prune(user.id, keep=auth.password_history - 1)
+            user.password_history.append(cls(password=hashed))
+
+        @classmethod
+        def get_hashes(cls, user_id, limit=None):
+            """Return the last hashes of the user, newest first."""
+            table = cls.__table__
+            limit = limit or auth.password_history
+            rows = db.session.execute(
+                select([table.c.password])
+                .where(table.c.user_id == user_id)
+                .order_by(table.c.id.desc())
+                .limit(limit)
+            )
+            return [row[0] for row in rows]
+
+        @classmethod
+        def prune(cls, user_id, keep):
+            """Delete all but the last ``keep`` hashes of the user."""
+            table = cls.__table__
+            query = table.delete().where(table.c.user_id == user_id)
+            if keep > 0:
+                newest = (
+                    select([table.c.id])
+                    .where(table.c.user_id == user_id)
+                    .order_by(table.c.id.desc())
+                    .limit(keep)
+                    .alias('newest')
+                )
+                # Wrapped because MySQL doesn't support LIMIT in a
+                # subquery used with IN
+                query = query.where(~table.c.id.in_(select([newest.c.id])))
+            db.session.execute(query)
+
+    return AuthPasswordHistoryMixin
+
+
+def get_auth_api_key_mixin(auth, User):
+    db = auth.db
+
+    class AuthApiKeyMixin(object):
+
+        @classmethod
+        def create(cls, user, name=u'', scopes=()):
+            """Make a new API key for the user.
+
+            Returns a tuple with the new key object and the full key.
+            Only a keyed hash of the secret part of the key is stored, so
+            this is the only time you can read it.
+            """
+            prefix = random_token(6)
+            secret = random_token(32)
+            api_key = cls(
+                prefix=prefix,
+                key_hash=keyed_hash(auth.secret_key, secret),
+                user_id=user.id,
+                name=to_unicode(name),
+                scopes=u' '.join(to_unicode(scope) for scope in scopes),
+            )
+            db.session.add(api_key)
+            return api_key, '{0}.{1}'.format(prefix, secret)
+
+        @classmethod
+        def by_prefix(cls, prefix):
+            """Return the API key with this prefix and its user
+            in a single query."""
+            return (db.session.query(cls)
+                    .options(joinedload(cls.user))
+                    .filter(cls.prefix == prefix)
+                    .first())
+
+        def get_scopes(self):
+            return self.scopes.split()
+
+        def has_scope(self, *names):
+            """Check if the key has any of these scopes."""
+            scopes = self.get_scopes()
+            return any(to_unicode(name) in scopes for name in names)
+
+        @property
+        def is_revoked(self):
+            return self.revoked_at is not None
+
+        def revoke(self):
+            self.revoked_at = datetime.utcnow()
+
+        def __repr__(self):
+            repr = '<ApiKey {0}>'.format(self.prefix)
+            return to_native(repr)
+
+    return AuthApiKeyMixin
+
+
 def extend_role_model(auth, User, RoleMixin=None):
     db = auth.db
     AuthRoleMixin = get_auth_role_mixin(auth, User)
@@ -139,11 +397,20 @@ def extend_role_model(auth, User, RoleMixin=None):
         Column('user_id', Integer, ForeignKey(User.id), primary_key=True),
         Column('role_id', Integer, ForeignKey(Role.id), primary_key=True)
     )
+    # The primary key only helps to find the roles of a user.
+    # This one is for the users of a role, already sorted by ID.
+    Index(
+        'ix_{0}_role_id_user_id'.format(UserRolesTable.name),
+        UserRolesTable.c.role_id, UserRolesTable.c.user_id
+    )
+    auth.UserRoles = UserRolesTable
 
+    # A role can have too many users to load them all at once,
+    # so only the loading of the roles of a user is configurable.
     Role.users = relationship(
         User, lazy='dynamic', order_by=User.login,
         secondary=UserRolesTable, enable_typechecks=False,
-        backref=backref('roles', lazy='dynamic')
+        backref=backref('roles', lazy=auth.roles_lazy)
     )
 
     extend_user_model_with_role_methods(auth, db, User, Role)
@@ -176,6 +443,90 @@ def get_auth_role_mixin(auth, User):
             db.session.add(role)
             return role
 
+        @classmethod
+        def assign(cls, names, users):
+            """Give these roles (by name) to these users, with a single
+            ``INSERT ... SELECT`` that skips the ones they already have.
+            Missing roles are created. Returns the number of rows inserted.
+
+            ``users`` can be a list of users (or user IDs) or a query of
+            user IDs, eg: ``db.session.query(User.id).filter(...)``, to
+            do it without sending the IDs to the database.
+            Notice that the roles already loaded in the session are
+            not updated.
+            """
+            names = [to_unicode(name).strip() for name in names]
+            for name in names:
+                cls.get_or_create(name)
+            db.session.flush()
+
+            table = auth.UserRoles
+            roles = cls.__table__
+            users_table = User.__table__
+            user_ids = _get_user_ids(users)
+            assigned = select([table.c.user_id]).where(and_(
+                table.c.user_id == users_table.c.id,
+                table.c.role_id == roles.c.id,
+            ))
+            query = select([users_table.c.id, roles.c.id]).where(and_(
+                users_table.c.id.in_(user_ids),
+                roles.c.name.in_(names),
+                ~exists(assigned),
+            ))
+            result = db.session.execute(
+                table.insert().from_select(['user_id', 'role_id'], query))
+            auth.audit('roles.assigned', roles=names, count=result.rowcount)
+            return result.rowcount
+
+        @classmethod
+        def revoke(cls, names, users):
+            """Remove these roles (by name) from these users, with a single
+            ``DELETE``. ``users`` is like in `assign`.
+            Returns the number of rows deleted.
+            """
+            names = [to_unicode(name).strip() for name in names]
+            table = auth.UserRoles
+            roles = cls.__table__
+            role_ids = select([roles.c.id]).where(roles.c.name.in_(names))
+            result = db.session.execute(
+                table.delete().where(and_(
+                    table.c.role_id.in_(role_ids),
+                    table.c.user_id.in_(_get_user_ids(users)),
+                ))
+            )
+            auth.audit('roles.revoked', roles=names, count=result.rowcount)
+            return result.rowcount
+
+        def users_page(self, after=None, limit=100):
+            """Return a list of at most ``limit`` users of this role, sorted
+            by login, starting after the ``after`` login (the last one of
+            the previous page). Unlike with an offset, every page is as
+            fast as the first one.
+            """
+            query = self.users
+            if after is not None:
+                query = query.filter(User.login > to_unicode(after))
+            return query.limit(limit).all()
+
+        def iter_users(self, batch_size=1000):
+            """Yield all the users of this role, sorted by ID, loading
+            them ``batch_size`` at a time.
+            """
+            table = auth.UserRoles
+            last_id = None
+            while True:
+                query = db.session.query(User).join(
+                    table, table.c.user_id == User.id
+                ).filter(table.c.role_id == self.id)
+                if last_id is not None:
+                    query = query.filter(table.c.user_id > last_id)
+                users = query.order_by(table.c.user_id).limit(batch_size).all()
+                if not users:
+                    return
+                for user in users:
+                    yield user
+                last_id = users[-1].id
+
         def __repr__(self):
             repr = '<Role {0}>'.format(self.name)
             return to_native(repr)
@@ -183,6 +534,15 @@ def get_auth_role_mixin(auth, User):
     return AuthRoleMixin
 
 
+def _get_user_ids(users):
+    """Return a list of IDs or a selectable for an ``IN`` clause."""
+    if hasattr(users, 'statement'):  # ORM query
+        return users.statement
+    if hasattr(users, 'alias'):  # Core select
+        return users
+    return [getattr(user, 'id', user) for user in users]
+
+
 def extend_user_model_with_role_methods(auth, db, User, Role):
 
     def _auth_base_query(cls):
@@ -191,11 +551,18 @@ def extend_user_model_with_role_methods(auth, db, User, Role):
 
     User._auth_base_query = classmethod(_auth_base_query)
 
+    def _in_roles(self, role):
+        if auth.roles_lazy == 'dynamic':
+            # Ask the database instead of loading all the roles
+            return self.roles.filter(Role.id == role.id).count() > 0
+        return role in self.roles
+
     def _add_role(self, name):
         """Adds a role (by name) to the user."""
         role = Role.get_or_create(name)
-        if role not in self.roles:
+        if role.id is None or not _in_roles(self, role):
             self.roles.append(role)
+            auth.audit('role.added', self, role=role.name)
         return self
 
     User.add_role = _add_role
@@ -205,8 +572,9 @@ def extend_user_model_with_role_methods(auth, db, User, Role):
         role = Role.by_name(name)
         if not role:
             return self
-        if role in self.roles:
+        if _in_roles(self, role):
             self.roles.remove(role)
+            auth.audit('role.removed', self, role=role.name)
         return self
 
     User.remove_role = _remove_role
@@ -220,3 +588,33 @@ def extend_user_model_with_role_methods(auth, db, User, Role):
         return False
 
     User.has_role = _has_role
+
+    def _query_with_roles(cls, *names, **kwargs):
+        """Return a query of the users with any (or, with ``any=False``,
+        all) of these roles (by name), filtered by the database.
+        """
+        match_any = kwargs.pop('any', True)
+        if kwargs:
+            raise TypeError('Unexpected arguments: {0}'.format(', '.join(kwargs)))
+        names = set(to_unicode(name).strip() for name in names)
+        table = auth.UserRoles
+        roles = Role.__table__
+        role_ids = select([roles.c.id]).where(roles.c.name.in_(names))
+        query = db.session.query(cls)
+        if not names:
+            return query.filter(false()) if match_any else query
+        if match_any:
+            return query.filter(exists(
+                select([table.c.user_id]).where(and_(
+                    table.c.user_id == cls.id,
+                    table.c.role_id.in_(role_ids),
+                ))
+            ))
+        user_ids = select([table.c.user_id]).where(
+            table.c.role_id.in_(role_ids)
+        ).group_by(table.c.user_id).having(
+            func.count(table.c.role_id) == len(names)
+        )
+        return query.filter(cls.id.in_(user_ids))
+
+    User.query_with_roles = classmethod(_query_with_roles)
@@ -0,0 +1,207 @@
+# coding=utf-8
+"""
+    In-memory list of revoked sessions.
+
+    Revoked IDs are kept in time buckets, so expiring them is just
+    dropping the oldest set, and checking an ID costs a few set lookups
+    instead of a database query. The list can be synchronized between
+    processes through a backend.
+"""
+import io
+import logging
+import os
+import threading
+from time import time
+
+from ._compat import to_native, to_unicode
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows
+    fcntl = None
+
+
+class MemoryBackend(object):
+    """Doesn't share anything. Useful for single-process servers and tests.
+    """
+
+    def publish(self, ident, timestamp):
+        pass
+
+    def fetch(self):
+        return []
+
+
+class FileBackend(object):
+    """Share the revoked IDs through an append-only file, so it can be used
+    by all the processes in the same machine.
+
+    Each line is ``<timestamp> <id>``. Lines are small, so appending them
+    is atomic. Each process remembers up to where it has read the file.
+    Appending and compacting take a lock on the file (where ``fcntl`` is
+    available), so no ID is written to a file that is being replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def publish(self, ident, timestamp):
+        line = u'{0} {1}\n'.format(int(timestamp), to_unicode(ident))
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                _lock(fd)
+                # The file could have been replaced by `compact`
+                # while waiting for the lock.
+                if _is_current(fd, self.path):
+                    os.write(fd, line.encode('utf8'))
+                    return
+            finally:
+                os.close(fd)
+
+    def fetch(self):
+        """Return a list of ``(timestamp, id)`` appended since the last call.
+        """
+        # The offset is shared by all the threads of the process
+        with self._lock:
+            return self._fetch()
+
+    def _fetch(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # The file has been compacted or replaced
+            self._inode = stat.st_ino
+            self._offset = 0
+        if stat.st_size == self._offset:
+            return []
+
+        with io.open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Ignore an incomplete last line
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        return list(self._parse(data[:end]))
+
+    def compact(self, ttl):
+        """Rewrite the file without the entries older than ``ttl`` seconds.
+        """
+        min_timestamp = time() - ttl
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            _lock(fd)
+            with io.open(self.path, 'rb') as f:
+                entries = list(self._parse(f.read()))
+            tmp_path = self.path + '.tmp'
+            with io.open(tmp_path, 'wb') as f:
+                for timestamp, ident in entries:
+                    if timestamp >= min_timestamp:
+                        line = u'{0} {1}\n'.format(int(timestamp), ident)
+                        f.write(line.encode('utf8'))
+            os.rename(tmp_path, self.path)
+        finally:
+            os.close(fd)
+
+    def _parse(self, data):
+        for line in data.splitlines():
+            try:
+                timestamp, ident = line.split(b' ', 1)
+                yield int(timestamp), to_native(ident)
+            except ValueError:
+                continue
+
+
+def _lock(fd):
+    """Lock the file until ``fd`` is closed."""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _is_current(fd, path):
+    try:
+        return os.fstat(fd).st_ino == os.stat(path).st_ino
+    except OSError:
+        return False
+
+
+class RevocationList(object):
+    """A set of revoked IDs that are forgotten after ``ttl`` seconds.
+    The ``ttl`` should be at least the lifetime of your sessions.
+
+    The IDs are stored in ``buckets`` sets, each one covering
+    ``ttl / buckets`` seconds, so an ID lives between ``ttl`` and
+    ``ttl + ttl / buckets`` seconds.
+
+    :backend: used to share the revoked IDs with other processes.
+        Default is :class:`MemoryBackend`.
+    :sync_interval: min seconds between checks for IDs revoked by
+        other processes.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60, buckets=24, backend=None,
+                 sync_interval=1):
+        self.ttl = ttl
+        self.bucket_size = float(ttl) / buckets
+        self.backend = backend or MemoryBackend()
+        self.sync_interval = sync_interval
+        self._buckets = {}
+        self._last_sync = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def revoke(self, ident, now=None):
+        now = now or time()
+        self._add(ident, now)
+        self.backend.publish(ident, now)
+
+    def is_revoked(self, ident, now=None):
+        if not ident:
+            return False
+        now = now or time()
+        if now - self._last_sync >= self.sync_interval:
+            self.sync(now)
+        for ids in list(self._buckets.values()):
+            if ident in ids:
+                return True
+        return False
+
+    def sync(self, now=None):
+        now = now or time()
+        with self._sync_lock:
+            self._last_sync = now
+            try:
+                entries = self.backend.fetch()
+            except (IOError, OSError):
+                logger = logging.getLogger(__name__)
+                logger.exception(u'Could not sync the revocation list')
+                entries = []
+            min_timestamp = now - self.ttl
+            for timestamp, ident in entries:
+                if timestamp >= min_timestamp:
+                    self._add(ident, timestamp)
+            self._expire(now)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._buckets.values())
+
+    def _add(self, ident, timestamp):
+        index = int(timestamp // self.bucket_size)
+        with self._lock:
+            self._buckets.setdefault(index, set()).add(ident)
+
+    def _expire(self, now):
+        min_index = int((now - self.ttl) // self.bucket_size)
+        with self._lock:
+            for index in list(self._buckets):
+                if index < min_index:
+                    del self._buckets[index]
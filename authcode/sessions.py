@@ -0,0 +1,238 @@
+# coding=utf-8
+"""
+    Server-side session store.
+
+    The sessions are stored in a table, indexed by user, so all of them
+    can be listed and revoked at once ("log out everywhere").
+    A small in-process LRU cache avoids a query on every request.
+"""
+from datetime import datetime, timedelta
+import json
+import logging
+
+from . import utils
+from ._compat import to_unicode
+from .models import extend_session_model
+
+
+class ServerSession(dict):
+    """A session whose data lives in a :class:`SessionStore`.
+    Only the session ID is sent to the browser.
+    """
+
+    def __init__(self, sid, data=None, new=False):
+        super(ServerSession, self).__init__(data or {})
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+    def _changed(self):
+        self.modified = True
+
+    def __setitem__(self, key, value):
+        super(ServerSession, self).__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super(ServerSession, self).__delitem__(key)
+        self._changed()
+
+    def clear(self):
+        super(ServerSession, self).clear()
+        self._changed()
+
+    def pop(self, key, *args):
+        if key in self:
+            self._changed()
+        return super(ServerSession, self).pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._changed()
+        return super(ServerSession, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super(ServerSession, self).update(*args, **kwargs)
+        self._changed()
+
+
+class SessionStore(object):
+    """Stores the sessions in a table generated alongside the ``User``
+    model. Call ``db.create_all()`` **after** creating the store.
+
+    :auth: the :class:`~authcode.Auth` instance.
+    :lifetime: seconds a session lives after its last change.
+    :cache_size: max number of sessions to keep in memory.
+    :cache_ttl: seconds a session can be read from the cache before
+        checking the database again. Because the cache is per-process,
+        a revoked session can still be *read* in other processes for, at
+        most, this number of seconds. It can't be saved again, though:
+        saving a session whose row is gone starts an empty one.
+    :cookie_name: name of the cookie with the session ID.
+    """
+
+    def __init__(self, auth, lifetime=24 * 60 * 60, cache_size=1000,
+                 cache_ttl=10, cookie_name='session'):
+        self.auth = auth
+        self.db = auth.db
+        self.lifetime = lifetime
+        self.cookie_name = cookie_name
+        self.cache = utils.LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.Session = extend_session_model(auth, auth.User)
+        auth.session_store = self
+
+    def new(self, session_class=ServerSession):
+        return session_class(utils.random_token(32), new=True)
+
+    def open(self, sid, session_class=ServerSession):
+        """Return the session with this ID or a new empty one if not found
+        or expired."""
+        if not sid:
+            return self.new(session_class)
+        cached = self.cache.get(sid)
+        if cached is not None:
+            data, expires_at = cached
+            if expires_at > datetime.utcnow():
+                return session_class(sid, data)
+        row = self.Session.by_sid(sid)
+        if row is None:
+            return self.new(session_class)
+        data = json.loads(row.data)
+        self.cache.set(sid, (data, row.expires_at))
+        return session_class(sid, data)
+
+    def save(self, session):
+        """Store the session. An empty session is deleted instead.
+
+        If the logged user has changed, the session is stored under a new
+        ID, preventing session fixation attacks. If the session no longer
+        exists (it was revoked or has expired), its data is discarded and
+        it's replaced by an empty one, so a revoked session can't come back.
+        """
+        if not session:
+            if not session.new:
+                self.revoke(session.sid)
+            return
+        if not session.new:
+            row = self.db.session.query(self.Session).get(session.sid)
+            if row is None:
+                self.cache.pop(session.sid)
+                dict.clear(session)
+                session.sid = utils.random_token(32)
+                session.new = True
+                session.modified = False
+                return
+        user_id = self._get_user_id(session)
+        if not session.new and row.user_id != user_id:
+            self.revoke(session.sid)
+            session.sid = utils.random_token(32)
+            session.new = True
+
+        expires_at = datetime.utcnow() + timedelta(seconds=self.lifetime)
+        data = dict(session)
+        if session.new:
+            row = self.Session(sid=session.sid)
+            self.db.session.add(row)
+        row.user_id = user_id
+        row.data = to_unicode(json.dumps(data))
+        row.expires_at = expires_at
+        self.db.session.commit()
+        session.new = False
+        session.modified = False
+        self.cache.set(session.sid, (data, expires_at))
+
+    def list_for_user(self, user_id):
+        """Return the active sessions of this user."""
+        return self.Session.by_user_id(user_id)
+
+    def revoke(self, sid):
+        """Delete a session by its ID."""
+        table = self.Session.__table__
+        self.db.session.execute(table.delete().where(table.c.sid == sid))
+        self.db.session.commit()
+        self.cache.pop(sid)
+
+    def revoke_user(self, user_id, keep=None):
+        """Delete all the sessions of this user, except the one with the ID
+        ``keep``, using a single indexed statement.
+        Returns how many sessions were deleted."""
+        logger = logging.getLogger(__name__)
+        table = self.Session.__table__
+        stmt = table.delete().where(table.c.user_id == user_id)
+        if keep:
+            stmt = stmt.where(table.c.sid != keep)
+        result = self.db.session.execute(stmt)
+        self.db.session.commit()
+        for sid, (data, _) in self.cache.items():
+            if sid != keep and self._get_user_id(data) == user_id:
+                self.cache.pop(sid)
+        logger.debug(u'{0} sessions revoked for user `{1}`'.format(
+            result.rowcount, user_id))
+        return result.rowcount
+
+    def gc(self, batch_size=1000):
+        """Delete the expired sessions, in batches of ``batch_size`` rows
+        so the table is never locked for long.
+        Returns how many sessions were deleted."""
+        table = self.Session.__table__
+        now = datetime.utcnow()
+        total = 0
+        while True:
+            sids = [
+                row[0] for row in self.db.session.execute(
+                    table.select()
+                    .with_only_columns([table.c.sid])
+                    .where(table.c.expires_at <= now)
+                    .limit(batch_size)
+                )
+            ]
+            if not sids:
+                break
+            self.db.session.execute(table.delete().where(table.c.sid.in_(sids)))
+            self.db.session.commit()
+            total += len(sids)
+        return total
+
+    def get_cookie_max_age(self):
+        return self.lifetime
+
+    def _get_user_id(self, data):
+        uhmac = data.get(self.auth.session_key)
+        if not uhmac:
+            return None
+        try:
+            return int(utils.split_uhmac(uhmac))
+        except ValueError:
+            return None
+
+
+def get_flask_session_interface(store):
+    from flask.sessions import SessionInterface, SessionMixin
+
+    class FlaskServerSession(ServerSession, SessionMixin):
+        pass
+
+    class FlaskSessionInterface(SessionInterface):
+
+        def open_session(self, app, request):
+            sid = request.cookies.get(store.cookie_name)
+            return store.open(sid, session_class=FlaskServerSession)
+
+        def save_session(self, app, session, response):
+            domain = self.get_cookie_domain(app)
+            path = self.get_cookie_path(app)
+            if not session.modified:
+                return
+            store.save(session)
+            if not session:
+                response.delete_cookie(store.cookie_name, domain=domain, path=path)
+                return
+            response.set_cookie(
+                store.cookie_name, session.sid,
+                max_age=store.get_cookie_max_age(),
+                domain=domain, path=path, httponly=True,
+                secure=self.get_cookie_secure(app),
+            )
+
+    return FlaskSessionInterface()
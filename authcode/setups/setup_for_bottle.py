@@ -4,7 +4,7 @@ from ..utils import LazyUser, eval_url
 
 def setup_for_bottle(
         auth, app, send_email=None, render=None,
-        session=None, request=None, urloptions=None):
+        session=None, request=None, urloptions=None, session_store=None):
     import bottle
 
     auth.request = request or bottle.request
@@ -25,21 +25,95 @@ def setup_for_bottle(
             request.session = request.environ['beaker.session']
     """
 
-    @bottle.hook('before_request')
+    if session_store is not None:
+        setup_bottle_session_store(session_store, app)
+
+    @app.hook('before_request')
     def after_request():
-        auth.session = session or getattr(bottle.request, 'session') \
-            or bottle.request.environ.get('beaker.session')
-        assert auth.session, 'Session not found'
+        auth.session = session
+        if auth.session is None:
+            auth.session = getattr(bottle.request, 'session', None)
+        if auth.session is None:
+            auth.session = bottle.request.environ.get('beaker.session')
+        if auth.session is None:
+            raise RuntimeError('Session not found')
 
         # By doing this, ``bottle.request`` now has a ``user`` attribute
         # that it's replaced by the real user object the first time is used.
         LazyUser(auth, bottle.request, user_name=auth.user_name)
 
+    if getattr(auth, 'RememberToken', None) is not None:
+        # Before the session store saves the session, because it
+        # changes the session.
+        get_response_plugin(app).funcs.insert(0, auth.update_remember_cookie)
+
     if auth.views:
         assert auth.render
         setup_for_bottle_views(auth, app, urloptions)
 
 
+class ResponsePlugin(object):
+    """Calls functions with the response of every route, after its callback.
+
+    Unlike an ``after_request`` hook, they also get the `HTTPResponse`
+    raised (eg: by ``bottle.redirect``) or returned by the callback,
+    so the cookies they set aren't lost.
+    """
+    name = 'authcode_response'
+    api = 2
+
+    def __init__(self):
+        self.funcs = []
+
+    def apply(self, callback, route):
+        import bottle
+
+        def wrapper(*args, **kwargs):
+            try:
+                rv = callback(*args, **kwargs)
+            except bottle.HTTPResponse as resp:
+                self.run(resp)
+                raise
+            self.run(rv if isinstance(rv, bottle.HTTPResponse) else bottle.response)
+            return rv
+
+        return wrapper
+
+    def run(self, response):
+        for func in self.funcs:
+            func(response)
+
+
+def get_response_plugin(app):
+    for plugin in app.plugins:
+        if isinstance(plugin, ResponsePlugin):
+            return plugin
+    return app.install(ResponsePlugin())
+
+
+def setup_bottle_session_store(store, app):
+    import bottle
+
+    @app.hook('before_request')
+    def open_session():
+        sid = bottle.request.get_cookie(store.cookie_name)
+        bottle.request.session = store.open(sid)
+
+    def save_session(response):
+        session = getattr(bottle.request, 'session', None)
+        if session is None or not session.modified:
+            return
+        store.save(session)
+        if session:
+            response.set_cookie(
+                store.cookie_name, session.sid,
+                max_age=store.get_cookie_max_age(), path='/', httponly=True)
+        else:
+            response.delete_cookie(store.cookie_name, path='/')
+
+    get_response_plugin(app).funcs.append(save_session)
+
+
 def setup_for_bottle_views(auth, app, urloptions):
     urloptions = urloptions or {}
 
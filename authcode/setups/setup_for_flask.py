@@ -4,9 +4,13 @@ from ..utils import LazyUser, eval_url
 
 def setup_for_flask(
         auth, app, send_email=None, render=None,
-        session=None, request=None, urloptions=None):
+        session=None, request=None, urloptions=None, session_store=None):
     import flask
 
+    if session_store is not None:
+        from ..sessions import get_flask_session_interface
+        app.session_interface = get_flask_session_interface(session_store)
+
     auth.request = request or flask.request
     if session is not None:
         auth.session = session
@@ -26,6 +30,11 @@ def setup_for_flask(
 
     app.before_request_funcs.setdefault(None, []).insert(0, set_user)
 
+    if getattr(auth, 'RememberToken', None) is not None:
+        @app.after_request
+        def update_remember_cookie(response):
+            return auth.update_remember_cookie(response)
+
     if auth.views:
         assert auth.render
         setup_for_flask_views(auth, app, urloptions)
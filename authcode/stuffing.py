@@ -0,0 +1,243 @@
+# coding=utf-8
+"""
+    Detection of credential stuffing with fixed memory.
+
+    Credential stuffing shows up as a source (an IP address) trying many
+    *different* logins, or as an account failing from many sources.
+    Instead of exact counters, that could grow without limit during an
+    attack, this uses:
+
+    - a small HyperLogLog per source, to estimate the number of distinct
+      logins it has tried, for at most ``max_sources`` sources;
+    - a count-min sketch for the failures of every account.
+
+    Both are kept for the current and the previous ``window``, and the
+    previous one is weighted down as time passes, to get a sliding
+    estimate without storing timestamps.
+
+    Usage::
+
+        auth = Auth(SECRET_KEY, db=db, stuffing_detector=StuffingDetector())
+
+"""
+from array import array
+from hashlib import sha1
+from math import log
+import struct
+import threading
+from time import time
+
+from ._compat import to_bytes, to_unicode
+from .utils import LRUCache
+
+
+ALLOW = 'allow'
+FRICTION = 'friction'
+REJECT = 'reject'
+
+
+def hash64(value):
+    return struct.unpack('<Q', sha1(to_bytes(value)).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """Estimates the number of distinct values added, using
+    ``2 ** precision`` bytes."""
+
+    def __init__(self, precision=6):
+        self.precision = precision
+        self.m = m = 1 << precision
+        self.registers = bytearray(m)
+        if m == 16:
+            self.alpha = 0.673
+        elif m == 32:
+            self.alpha = 0.697
+        elif m == 64:
+            self.alpha = 0.709
+        else:
+            self.alpha = 0.7213 / (1 + 1.079 / m)
+
+    def add(self, value):
+        hashed = hash64(value)
+        index = hashed & (self.m - 1)
+        rest = hashed >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.m
+        estimate = self.alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * log(float(m) / zeros)
+        return estimate
+
+
+class CountMinSketch(object):
+    """Estimates the count of each key (never less than the real one),
+    using ``width * depth`` counters."""
+
+    def __init__(self, width=4096, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('l', [0]) * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        h1, h2 = struct.unpack('<QQ', sha1(to_bytes(key)).digest()[:16])
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, n=1):
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += n
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class StuffingDetector(object):
+    """
+    :window: seconds of history considered.
+    :friction_logins, reject_logins: number of distinct logins tried by
+        a source to ask for an extra check (eg: a CAPTCHA) or to reject
+        its sign in attempts.
+    :friction_failures, reject_failures: the same, for the number of
+        failures of an account, from any source.
+    :max_sources: max number of sources tracked (the least recently
+        seen are forgotten first).
+    :precision: of the HyperLogLog of each source.
+    :width, depth: of the count-min sketch of the accounts.
+    """
+
+    def __init__(self, window=10 * 60,
+                 friction_logins=5, reject_logins=20,
+                 friction_failures=10, reject_failures=50,
+                 max_sources=10000, precision=6, width=4096, depth=4):
+        self.window = window
+        self.friction_logins = friction_logins
+        self.reject_logins = reject_logins
+        self.friction_failures = friction_failures
+        self.reject_failures = reject_failures
+        self.precision = precision
+        self.width = width
+        self.depth = depth
+        # {source: [generation, hll, previous_hll, failures]}
+        self.sources = LRUCache(maxsize=max_sources)
+        self._generation = None
+        self._accounts = None
+        self._prev_accounts = None
+        self.failures = 0
+        self.verdicts = {ALLOW: 0, FRICTION: 0, REJECT: 0}
+        self._lock = threading.Lock()
+        self._rotate(self._get_generation())
+
+    def record_failure(self, source, login):
+        """Record a failed sign in for this login from this source."""
+        login = normalize_login(login)
+        with self._lock:
+            generation = self._get_generation()
+            if generation != self._generation:
+                self._rotate(generation)
+            self._accounts.add(login)
+            self.failures += 1
+            if source:
+                stats = self._get_source(source, generation)
+                stats[1].add(login)
+                stats[3] += 1
+
+    def check(self, source, login):
+        """Return `ALLOW`, `FRICTION` or `REJECT` for a sign in attempt."""
+        logins = self.estimate_logins(source) if source else 0
+        failures = self.estimate_failures(login) if login else 0
+        if logins >= self.reject_logins or failures >= self.reject_failures:
+            verdict = REJECT
+        elif logins >= self.friction_logins or failures >= self.friction_failures:
+            verdict = FRICTION
+        else:
+            verdict = ALLOW
+        self.verdicts[verdict] += 1
+        return verdict
+
+    def estimate_logins(self, source):
+        """Estimated number of distinct logins that failed from this source."""
+        stats = self.sources.get(source)
+        if stats is None:
+            return 0
+        with self._lock:
+            generation = self._get_generation()
+            weight = self._get_weight()
+            if stats[0] == generation:
+                total = stats[1].count()
+                if stats[2] is not None:
+                    total += stats[2].count() * weight
+            elif stats[0] == generation - 1:
+                total = stats[1].count() * weight
+            else:
+                total = 0
+        return int(round(total))
+
+    def estimate_failures(self, login):
+        """Estimated number of failures of this login, from any source."""
+        login = normalize_login(login)
+        with self._lock:
+            generation = self._get_generation()
+            if generation != self._generation:
+                self._rotate(generation)
+            weight = self._get_weight()
+            total = self._accounts.estimate(login)
+            if self._prev_accounts is not None:
+                total += self._prev_accounts.estimate(login) * weight
+        return int(round(total))
+
+    def snapshot(self, top=10):
+        """Return a dict with the current state, for dashboards."""
+        sources = []
+        for source, stats in self.sources.items():
+            sources.append((source, self.estimate_logins(source), stats[3]))
+        sources.sort(key=lambda item: item[1], reverse=True)
+        return {
+            'window': self.window,
+            'failures': self.failures,
+            'verdicts': dict(self.verdicts),
+            'sources_tracked': len(sources),
+            'top_sources': [
+                {'source': source, 'logins': logins, 'failures': failures}
+                for source, logins, failures in sources[:top]
+            ],
+            'memory': self.memory_size(),
+        }
+
+    def memory_size(self):
+        """Upper bound, in bytes, of the memory used by the counters."""
+        per_source = 2 * (1 << self.precision)
+        accounts = 2 * self.width * self.depth * array('l').itemsize
+        return self.sources.maxsize * per_source + accounts
+
+    def _get_generation(self):
+        return int(time() // self.window)
+
+    def _get_weight(self):
+        """Weight of the previous window: from 1 at the start
+        of the current one to 0 at its end."""
+        return 1.0 - (time() % self.window) / float(self.window)
+
+    def _rotate(self, generation):
+        if self._generation is not None and generation == self._generation + 1:
+            self._prev_accounts = self._accounts
+        else:
+            self._prev_accounts = None
+        self._accounts = CountMinSketch(self.width, self.depth)
+        self._generation = generation
+
+    def _get_source(self, source, generation):
+        stats = self.sources.get(source)
+        if stats is None or stats[0] < generation - 1:
+            stats = [generation, HyperLogLog(self.precision), None, 0]
+            self.sources.set(source, stats)
+        elif stats[0] == generation - 1:
+            stats[:] = [generation, HyperLogLog(self.precision), stats[1], 0]
+        return stats
+
+
+def normalize_login(login):
+    return to_unicode(login or u'').strip().lower()
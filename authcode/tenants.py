@@ -0,0 +1,136 @@
+# coding=utf-8
+"""
+    Serve many user populations ("tenants") from the same process.
+
+    Each tenant is an `Auth` instance, built the first time it's needed,
+    with its own models (named after the tenant). The right one for a
+    request is selected by its host or by the first segment of its path.
+"""
+import threading
+
+from .auth import Auth
+
+
+class TenantRouter(object):
+    """Holds the configuration of many tenants.
+
+    :secret_key: default secret key for all the tenants.
+    :db_factory: callable that takes a database URI and returns a database
+        object (eg: ``sqlalchemy_wrapper.SQLAlchemy``). Tenants with the
+        same URI share the same database object (and engine).
+
+    The rest of the ``key=value`` pairs are default settings for the `Auth`
+    of every tenant.
+    """
+
+    def __init__(self, secret_key, db_factory=None, **defaults):
+        self.secret_key = secret_key
+        self.db_factory = db_factory
+        self.defaults = defaults
+        self.configs = {}
+        self.hosts = {}
+        self.paths = {}
+        self.databases = {}
+        self._auths = {}
+        self._lock = threading.RLock()
+
+    def add(self, name, hosts=(), path=None, database=None, **config):
+        """Add the configuration of a tenant.
+
+        :name: name of the tenant, also used as the `prefix` of its `Auth`.
+        :hosts: list of hostnames that select this tenant.
+        :path: first segment of the URL paths that select this tenant.
+            By default, the name of the tenant.
+        :database: URI of the tenant's database. Needs a `db_factory`.
+            You can also use a ``db`` setting with a database object.
+
+        The rest of the ``key=value`` pairs are settings for the `Auth`
+        of this tenant.
+
+        A tenant can be added again, to replace its configuration, only
+        until its `Auth` is built, because its models can't be redefined.
+        Raises a ValueError otherwise.
+        """
+        name = normalize_name(name)
+        config = dict(self.defaults, **config)
+        config.setdefault('prefix', name)
+        if database is not None:
+            config['database'] = database
+        with self._lock:
+            if name in self._auths:
+                raise ValueError(
+                    'The tenant `{0}` is already in use'.format(name))
+            self.configs[name] = config
+            self._forget_routes(name)
+            for host in hosts:
+                self.hosts[normalize_host(host)] = name
+            path = name if path is None else path
+            if path:
+                self.paths[path.strip('/')] = name
+
+    def get(self, name):
+        """Return the `Auth` of this tenant, building it if needed."""
+        name = normalize_name(name)
+        auth = self._auths.get(name)
+        if auth is not None:
+            return auth
+        with self._lock:
+            auth = self._auths.get(name)
+            if auth is None:
+                auth = self._auths[name] = self._build(name)
+        return auth
+
+    def match(self, host=None, path=None):
+        """Return the `Auth` of the tenant selected by this host or path
+        or ``None`` if there isn't one."""
+        name = None
+        if host:
+            name = self.hosts.get(normalize_host(host))
+        if name is None and path:
+            name = self.paths.get(path.lstrip('/').split('/', 1)[0])
+        if name is None:
+            return None
+        return self.get(name)
+
+    def match_environ(self, environ):
+        """Like `match` but using a WSGI environ."""
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME')
+        return self.match(host=host, path=environ.get('PATH_INFO'))
+
+    def is_built(self, name):
+        return normalize_name(name) in self._auths
+
+    def _forget_routes(self, name):
+        for routes in (self.hosts, self.paths):
+            for key in [key for key, value in routes.items() if value == name]:
+                del routes[key]
+
+    def _build(self, name):
+        config = dict(self.configs[name])
+        secret_key = config.pop('secret_key', self.secret_key)
+        database = config.pop('database', None)
+        if database is not None and 'db' not in config:
+            config['db'] = self._get_database(database)
+        return Auth(secret_key, **config)
+
+    def _get_database(self, uri):
+        db = self.databases.get(uri)
+        if db is None:
+            assert self.db_factory, 'A `db_factory` is needed to use `database`'
+            db = self.databases[uri] = self.db_factory(uri)
+        return db
+
+    def __contains__(self, name):
+        return normalize_name(name) in self.configs
+
+    def __len__(self):
+        return len(self.configs)
+
+
+def normalize_name(name):
+    return name.lower().replace(' ', '')
+
+
+def normalize_host(host):
+    """Lowercase and remove the port."""
+    return host.lower().split(':', 1)[0]
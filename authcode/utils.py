@@ -1,6 +1,12 @@
 # coding=utf-8
+from collections import OrderedDict
+import atexit
+import base64
 import hashlib
 import hmac
+import json
+import os
+import threading
 from time import time
 
 from ._compat import to_bytes, to_unicode
@@ -39,6 +45,57 @@ def get_hash_extract(hash):
     return half[-10:]
 
 
+# Prefix of the hashes with extra parameters, eg: the ID of the pepper used.
+# `$authcode$p=2$pbkdf2-sha512$25000$...`
+HASH_ENVELOPE = '$authcode$'
+
+
+# Fixed key of the pre-hashing. The secret part is the pepper.
+PREHASH_KEY = b'authcode.prehash'
+
+
+def prehash(secret):
+    """Reduce the secret to 88 chars using HMAC-SHA512."""
+    mac = hmac.new(PREHASH_KEY, msg=to_bytes(secret), digestmod=hashlib.sha512)
+    return to_unicode(base64.b64encode(mac.digest()))
+
+
+def make_hash_envelope(params, hashed):
+    """Add the ``params`` (a dict) to the hash made by passlib.
+    Without params the hash is returned unchanged."""
+    if not params:
+        return hashed
+    params = ','.join(
+        '{0}={1}'.format(key, value) for key, value in sorted(params.items()))
+    return HASH_ENVELOPE + params + hashed
+
+
+def split_hash_envelope(hashed):
+    """Return a tuple ``(params, hashed)`` with the params of the envelope
+    of the hash (if any) and the hash made by passlib."""
+    if not hashed or not hashed.startswith(HASH_ENVELOPE):
+        return {}, hashed
+    params, hashed = hashed[len(HASH_ENVELOPE):].split('$', 1)
+    params = dict(param.split('=', 1) for param in params.split(',') if param)
+    return params, '$' + hashed
+
+
+def get_hash_signature(hashed):
+    """Return what identifies the configuration used to make the hash
+    (params of the envelope, scheme and rounds) but not the hash itself."""
+    params, hashed = split_hash_envelope(hashed)
+    return sorted(params.items()), get_hash_prefix(hashed)
+
+
+def get_hash_prefix(hashed):
+    """Return the scheme and cost parts of a hash made by passlib."""
+    parts = (hashed or '').split('$')
+    if len(parts) > 1 and parts[1].startswith('argon2'):
+        # $argon2id$v=19$m=65536,t=3,p=4$salt$checksum
+        return parts[:4]
+    return parts[:3]
+
+
 def get_uhmac(user, secret):
     """Make an unique identifier for the user (stored in the session),
     so it can stay logged between requests.
@@ -90,6 +147,74 @@ def get_token(user, secret, timestamp=None):
     return token
 
 
+def random_token(nbytes=32):
+    """Return a random URL-safe string with ``nbytes`` of entropy."""
+    token = base64.urlsafe_b64encode(os.urandom(nbytes)).rstrip(b'=')
+    return token.decode('ascii')
+
+
+def keyed_hash(secret, value):
+    """Return the hex HMAC-SHA256 of ``value`` using ``secret`` as the key.
+
+    Useful for storing high-entropy random values (like the validator of
+    a "remember me" token), where a slow KDF would be a waste.
+    """
+    mac = hmac.new(to_bytes(secret), msg=to_bytes(value), digestmod=hashlib.sha256)
+    return mac.hexdigest()
+
+
+def get_credentials_key(secret, login, password, hashed):
+    """Return a keyed hash of the credentials and the stored password hash,
+    to be used as a cache key for already verified credentials.
+    The key changes if the stored hash changes.
+    """
+    value = json.dumps([to_unicode(login), to_unicode(password), to_unicode(hashed)])
+    return keyed_hash(secret, value)
+
+
+def constant_time_compare(val1, val2):
+    """Return ``True`` if the two strings are equal, taking the same
+    time no matter how many characters match.
+    """
+    val1 = to_bytes(val1)
+    val2 = to_bytes(val2)
+    compare_digest = getattr(hmac, 'compare_digest', None)
+    if compare_digest is not None:
+        return compare_digest(val1, val2)
+    if len(val1) != len(val2):  # pragma: no cover
+        return False
+    result = 0  # pragma: no cover
+    for x, y in zip(bytearray(val1), bytearray(val2)):  # pragma: no cover
+        result |= x ^ y
+    return result == 0  # pragma: no cover
+
+
+def parse_basic_authorization(header):
+    """Return the ``(login, password)`` from the value of an HTTP Basic
+    ``Authorization`` header or ``None`` if it's not valid.
+    """
+    try:
+        scheme, value = to_unicode(header).strip().split(None, 1)
+        if scheme.lower() != u'basic':
+            return None
+        value = to_unicode(base64.b64decode(to_bytes(value)))
+        login, password = value.split(u':', 1)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return login, password
+
+
+def make_remember_token(selector, validator):
+    return '{0}${1}'.format(selector, validator)
+
+
+def split_remember_token(token):
+    selector, validator = token.split('$', 1)
+    if not selector or not validator:
+        raise ValueError
+    return selector, validator
+
+
 def split_uhmac(uhmac):
     uid, mac = uhmac.split('$', 1)
     return uid
@@ -100,6 +225,116 @@ def split_token(token):
     return from36(t36), uid
 
 
+class LRUCache(object):
+    """A thread-safe mapping that holds at most ``maxsize`` items,
+    discarding the least recently used ones first.
+
+    If ``ttl`` (in seconds) is set, items older than that are
+    also discarded when read.
+    """
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time():
+                return default
+            self._data[key] = item
+            return value
+
+    def set(self, key, value):
+        expires = time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def items(self):
+        with self._lock:
+            return [(key, item[0]) for key, item in self._data.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
+
+
+_missing = object()
+
+
+class BackgroundWriter(object):
+    """Base class for objects that buffer data in memory and write it
+    with a background thread, every ``flush_interval`` seconds (or
+    sooner, when woken up) and when the process exits.
+
+    Subclasses implement `flush`.
+    """
+
+    thread_name = 'authcode-writer'
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def flush(self):  # pragma: no cover
+        raise NotImplementedError
+
+    def close(self):
+        """Stop the writer and write the pending data."""
+        self._closed = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and \
+                thread is not threading.current_thread():
+            thread.join(self.flush_interval * 2 + 1)
+        self.flush()
+
+    def _ensure_writer(self):
+        # Threads don't survive a fork, so the workers start their own
+        # the first time they have something to write.
+        pid = os.getpid()
+        if self._pid == pid or self._closed:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.thread_name)
+            self._thread.daemon = True
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.close)
+            self._pid = pid
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
 class LazyUser(object):
     """Acts as a proxy for the current user.  Forwards all operations to
     the proxied user.  The only operations not supported for forwarding
@@ -2,6 +2,7 @@
 from datetime import datetime
 
 from ._compat import to_unicode
+from .stuffing import FRICTION, REJECT
 
 
 def pop_next_url(auth, request, session):
@@ -25,10 +26,19 @@ def sign_in(auth, request, session, *args, **kwargs):
         if auth.session_key in session:
             del session[auth.session_key]
 
+        verdict = auth.check_stuffing(request, credentials.get('login'))
+        if verdict == FRICTION and auth.stuffing_challenge:
+            kwargs['challenge'] = True
+            if not auth.stuffing_challenge(request):
+                verdict = REJECT
+
         if not auth.csrf_token_is_valid(request):
             kwargs['error'] = auth.ERROR_BAD_CSRF
+        elif verdict == REJECT:
+            kwargs['error'] = auth.ERROR_CHALLENGE if kwargs.get('challenge') \
+                else auth.ERROR_TOO_MANY_ATTEMPTS
         else:
-            user = auth.authenticate(credentials)
+            user = auth.authenticate(credentials, interactive=True)
             if user and user.deleted:
                 kwargs['error'] = auth.ERROR_SUSPENDED
             elif user:
@@ -98,6 +108,7 @@ def reset_password(auth, request, token=None, *args, **kwargs):
                 'expire_after': auth.token_life,
             }
             _email_token(auth, user, data)
+            auth.audit('password.reset_requested', user)
             kwargs['ok'] = True
         else:
             kwargs['error'] = auth.ERROR_WRONG_TOKEN_USER
@@ -146,12 +157,19 @@ def change_password(auth, request, manual=True, *args, **kwargs):
         elif (not np2) or (np1 != np2):
             kwargs['error'] = auth.ERROR_PASSW_MISMATCH
 
+        elif auth.password_is_breached(np1):
+            kwargs['error'] = auth.ERROR_PASSW_BREACHED
+
         elif manual and not user.has_password(password):
             kwargs['error'] = auth.ERROR_PASSW_CURRENT
 
+        elif auth.password_in_history(user, np1):
+            kwargs['error'] = auth.ERROR_PASSW_REUSED
+
         else:
             user.password = np1
             auth.db.session.commit()
+            auth.audit('password.changed', user, manual=manual)
             auth.login(user)
             kwargs['ok'] = True
 
@@ -6,6 +6,9 @@ from .._compat import to_native
 
 HTTP_FORBIDDEN = 403
 
+# Where the parsed request data is cached
+PARSED_KEY = 'authcode.parsed'
+
 
 def get_site_name(request):
     """Return the domain:port part of the URL without scheme.
@@ -69,7 +72,7 @@ def raise_forbidden(msg='You are not allowed to access this.'):
 def get_from_params(request, key):
     """Try to read a value named ``key`` from the GET parameters.
     """
-    return request.query.get(key)
+    return _get_parsed(request)['params'].get(key)
 
 
 def get_from_headers(request, key):
@@ -78,10 +81,49 @@ def get_from_headers(request, key):
     return request.headers.get(key)
 
 
+def get_remote_addr(request):
+    """Return the IP address of the client.
+    """
+    return request.remote_addr
+
+
+def get_from_cookies(request, key):
+    """Try to read a value named ``key`` from the cookies.
+    """
+    return request.get_cookie(key)
+
+
+def set_cookie(response, key, value, max_age=None):
+    """Set a cookie in the response. The cookie is not readable
+    from JavaScript.
+    """
+    response.set_cookie(key, value, max_age=max_age, path='/', httponly=True)
+
+
+def delete_cookie(response, key):
+    """Delete a cookie in the response.
+    """
+    response.delete_cookie(key, path='/')
+
+
 def get_post_data(request):
     """Return all the POST data from the request.
     """
-    return request.forms
+    return _get_parsed(request)['post_data']
+
+
+def _get_parsed(request):
+    """Parse the request data only once per request and cache the
+    result in the WSGI environ.
+    """
+    parsed = request.environ.get(PARSED_KEY)
+    if parsed is None:
+        parsed = {
+            'params': dict(request.query.items()),
+            'post_data': dict(request.forms.items()),
+        }
+        request.environ[PARSED_KEY] = parsed
+    return parsed
 
 
 def make_response(body, mimetype='text/html'):
@@ -1,11 +1,14 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-from .._compat import to_native
+from .._compat import text_type, to_native
 
 
 HTTP_SEE_OTHER = 303
 
+# Where the parsed request data is cached
+PARSED_KEY = 'authcode.parsed'
+
 
 def get_full_path(request):
     """Return the current relative path including the query string.
@@ -55,9 +58,7 @@ def raise_forbidden(msg='You are not allowed to access this.'):
 def get_from_params(request, key):
     """Try to read a value named ``key`` from the GET parameters.
     """
-    data = getattr(request, 'json', None) or request.values
-    value = data.get(key)
-    return to_native(value)
+    return _get_parsed(request)['params'].get(key)
 
 
 def get_from_headers(request, key):
@@ -67,10 +68,69 @@ def get_from_headers(request, key):
     return to_native(value)
 
 
+def get_remote_addr(request):
+    """Return the IP address of the client.
+    """
+    return request.remote_addr
+
+
+def get_from_cookies(request, key):
+    """Try to read a value named ``key`` from the cookies.
+    """
+    value = request.cookies.get(key)
+    return to_native(value)
+
+
+def set_cookie(response, key, value, max_age=None):
+    """Set a cookie in the response. The cookie is not readable
+    from JavaScript.
+    """
+    response.set_cookie(key, value, max_age=max_age, httponly=True)
+
+
+def delete_cookie(response, key):
+    """Delete a cookie in the response.
+    """
+    response.delete_cookie(key)
+
+
 def get_post_data(request):
     """Return all the POST data from the request.
     """
-    return getattr(request, 'json', None) or request.form or {}
+    return _get_parsed(request)['post_data']
+
+
+def _get_parsed(request):
+    """Parse the request data only once per request and cache the
+    normalized result in the WSGI environ.
+    """
+    parsed = request.environ.get(PARSED_KEY)
+    if parsed is None:
+        json = _get_json(request)
+        if json:
+            params = post_data = _normalize(json.items())
+        else:
+            params = _normalize(request.values.items())
+            post_data = _normalize(request.form.items())
+        parsed = {'params': params, 'post_data': post_data}
+        request.environ[PARSED_KEY] = parsed
+    return parsed
+
+
+def _get_json(request):
+    get_json = getattr(request, 'get_json', None)
+    if get_json is not None:
+        json = get_json(silent=True)
+    else:
+        json = getattr(request, 'json', None)
+    return json if isinstance(json, dict) else None
+
+
+def _normalize(items):
+    return dict(
+        (key, to_native(value) if isinstance(value, (text_type, bytes)) else value)
+        for key, value in items
+    )
 
 
 def make_response(body, mimetype='text/html'):
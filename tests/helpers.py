@@ -2,5 +2,20 @@
 from hashlib import md5
 import os
 
+from sqlalchemy_wrapper import SQLAlchemy
+import authcode
+
 
 SECRET_KEY = md5(os.urandom(32)).hexdigest()
+
+
+def get_auth(uri='sqlite:///:memory:', logins=(u'meh', ), **kwargs):
+    """Return an `authcode.Auth` with a new database, and the list of its
+    users, one for each login, all with the password ``foobar``."""
+    db = SQLAlchemy(uri)
+    auth = authcode.Auth(SECRET_KEY, db=db, **kwargs)
+    db.create_all()
+    users = [auth.User(login=login, password='foobar') for login in logins]
+    db.session.add_all(users)
+    db.session.commit()
+    return auth, users
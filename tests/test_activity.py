@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import print_function
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime
+from authcode.activity import ActivityTracker
+
+from helpers import get_auth
+
+
+class UserMixin(object):
+    last_seen = Column(DateTime, nullable=True)
+
+
+def _get_tracker(tmpdir, **kwargs):
+    tracker = ActivityTracker(flush_interval=60, **kwargs)
+    auth, users = get_auth(
+        'sqlite:///' + str(tmpdir.join('db.sqlite')),
+        logins=[u'user0', u'user1', u'user2'],
+        UserMixin=UserMixin, activity_tracker=tracker)
+    return auth, tracker, users
+
+
+def _get_last_seen(auth):
+    table = auth.User.__table__
+    rows = auth.db.engine.execute(table.select().order_by(table.c.id)).fetchall()
+    return [row.last_seen for row in rows]
+
+
+def test_touch_from_get_user(tmpdir):
+    auth, tracker, users = _get_tracker(tmpdir)
+    session = {}
+    auth.login(users[0], session=session)
+    for _ in range(10):
+        assert auth.get_user(session=session)
+    assert len(tracker.pending[auth.User.__table__]) == 1
+    assert not auth.db.session.dirty
+
+    assert tracker.flush() == 1
+    last_seen = _get_last_seen(auth)
+    assert last_seen[0] is not None
+    assert last_seen[1:] == [None, None]
+    assert tracker.flush() == 0
+
+
+def test_bulk_update(tmpdir):
+    auth, tracker, users = _get_tracker(tmpdir, batch_size=2)
+    now = datetime.utcnow()
+    for user in users:
+        tracker.touch(auth, user, now=now)
+    assert tracker.flush() == 3
+    assert _get_last_seen(auth) == [now, now, now]
+
+
+def test_interval(tmpdir):
+    auth, tracker, users = _get_tracker(tmpdir)
+    user = users[0]
+    now = datetime.utcnow()
+    tracker.touch(auth, user, now=now)
+    tracker.flush()
+
+    tracker.recent.clear()
+    tracker.touch(auth, user, now=now + timedelta(seconds=10))
+    assert tracker.flush() == 0
+
+    tracker.recent.clear()
+    later = now + timedelta(seconds=tracker.interval + 1)
+    tracker.touch(auth, user, now=later)
+    assert tracker.flush() == 1
+    assert _get_last_seen(auth)[0] == later
+
+
+def test_close_flushes(tmpdir):
+    auth, tracker, users = _get_tracker(tmpdir)
+    tracker.touch(auth, users[1])
+    tracker.close()
+    assert _get_last_seen(auth)[1] is not None
+
+
+class BrokenEngine(object):
+    def __init__(self, callback=None):
+        self.callback = callback
+
+    def begin(self):
+        if self.callback:
+            self.callback()
+        raise RuntimeError('The database is down')
+
+
+def test_failed_write_is_retried(tmpdir):
+    auth, tracker, users = _get_tracker(tmpdir)
+    table = auth.User.__table__
+    now = datetime.utcnow()
+    later = now + timedelta(seconds=tracker.interval + 1)
+    tracker.touch(auth, users[0], now=now)
+    tracker.touch(auth, users[1], now=now)
+
+    def touch_again():
+        # While the failed write was in progress
+        tracker.recent.clear()
+        tracker.touch(auth, users[1], now=later)
+
+    engine = tracker.engines[table]
+    tracker.engines[table] = BrokenEngine(touch_again)
+    assert tracker.flush() == 0
+    assert tracker.pending[table] == {users[0].id: now, users[1].id: later}
+
+    tracker.engines[table] = engine
+    assert tracker.flush() == 2
+    assert _get_last_seen(auth) == [now, later, None]
@@ -0,0 +1,69 @@
+# coding=utf-8
+from __future__ import print_function
+from datetime import datetime, timedelta
+
+from helpers import get_auth
+
+
+def test_api_key_model():
+    auth, [user] = get_auth(api_keys=True)
+    ApiKey = auth.ApiKey
+    assert ApiKey.__tablename__ == 'users_api_keys'
+    assert ApiKey.__table__.c.prefix.index
+
+    api_key, value = ApiKey.create(user, name=u'CI', scopes=['read', 'write'])
+    auth.db.session.commit()
+    prefix, secret = value.split('.')
+    assert api_key.prefix == prefix
+    assert secret not in api_key.key_hash
+    assert list(user.api_keys) == [api_key]
+    assert api_key.user == user
+    assert api_key.get_scopes() == ['read', 'write']
+    assert api_key.has_scope('admin', 'read')
+    assert not api_key.has_scope('admin')
+    assert ApiKey.by_prefix(prefix) == api_key
+
+
+def test_authenticate_with_api_key():
+    auth, [user] = get_auth(api_keys=True)
+    api_key, value = auth.ApiKey.create(user, scopes=['read'])
+    auth.db.session.commit()
+
+    auth_user = auth.authenticate({'api_key': value})
+    assert auth_user == user
+    assert auth_user.current_api_key == api_key
+    assert auth.backends.stats()['password']['calls'] == 0
+
+    prefix, secret = value.split('.')
+    assert auth.authenticate({'api_key': prefix + '.' + secret[::-1]}) is None
+    assert auth.authenticate({'api_key': 'nope.' + secret}) is None
+    assert auth.authenticate({'api_key': 'foobar'}) is None
+    assert auth.authenticate({'api_key': ''}) is None
+
+
+def test_revoked_api_key():
+    auth, [user] = get_auth(api_keys=True)
+    api_key, value = auth.ApiKey.create(user)
+    auth.db.session.commit()
+    api_key.revoke()
+    auth.db.session.commit()
+    assert auth.authenticate({'api_key': value}) is None
+
+
+def test_api_key_last_used_is_coalesced():
+    auth, [user] = get_auth(api_keys=True, api_key_touch_interval=60)
+    api_key, value = auth.ApiKey.create(user)
+    auth.db.session.commit()
+    assert api_key.last_used_at is None
+
+    auth.authenticate({'api_key': value})
+    last_used_at = api_key.last_used_at
+    assert last_used_at
+
+    auth.authenticate({'api_key': value})
+    assert api_key.last_used_at == last_used_at
+
+    api_key.last_used_at = datetime.utcnow() - timedelta(seconds=61)
+    auth.db.session.commit()
+    auth.authenticate({'api_key': value})
+    assert api_key.last_used_at > last_used_at
@@ -0,0 +1,114 @@
+# coding=utf-8
+from __future__ import print_function
+import json
+import time
+
+from sqlalchemy_wrapper import SQLAlchemy
+from authcode.audit import AuditLog, JSONLinesSink, MemorySink, SQLSink
+
+from helpers import get_auth
+
+
+def test_authentication_events():
+    sink = MemorySink()
+    audit_log = AuditLog(sink)
+    auth, [user] = get_auth(audit_log=audit_log)
+    session = {}
+
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'})
+    assert not auth.authenticate({'login': u'meh', 'password': 'wrong'})
+    assert not auth.authenticate({'login': u'nope', 'password': 'foobar'})
+    auth.login(user, session=session)
+    auth.logout(session=session)
+    assert auth.authenticate({'token': user.get_token()})
+
+    audit_log.flush()
+    events = [(e['event'], e['user_id'], e['data'].get('reason')) for e in sink.events]
+    assert events == [
+        ('auth.failed', user.id, 'password'),
+        ('auth.failed', None, 'not_found'),
+        ('login', user.id, None),
+        ('logout', user.id, None),
+        ('token.used', user.id, None),
+    ]
+    assert audit_log.written == 5
+
+
+def test_role_events():
+    sink = MemorySink()
+    audit_log = AuditLog(sink)
+    auth, [user] = get_auth(audit_log=audit_log, roles=True)
+    user.add_role('admin')
+    user.add_role('admin')
+    user.remove_role('admin')
+    audit_log.flush()
+    assert [(e['event'], e['data']) for e in sink.events] == [
+        ('role.added', {'role': 'admin'}),
+        ('role.removed', {'role': 'admin'}),
+    ]
+
+
+def test_no_audit_log():
+    auth, [user] = get_auth()
+    auth.audit('login', user)
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'})
+
+
+def test_sampling():
+    sink = MemorySink()
+    audit_log = AuditLog(sink, sample_rates={'token.used': 0})
+    audit_log.emit('token.used', 1)
+    audit_log.emit('login', 1)
+    audit_log.flush()
+    assert [e['event'] for e in sink.events] == ['login']
+
+
+def test_bounded_buffer():
+    sink = MemorySink()
+    audit_log = AuditLog(sink, maxsize=3, batch_size=100, flush_interval=60)
+    for i in range(5):
+        audit_log.emit('login', i)
+    assert audit_log.dropped == 2
+    audit_log.flush()
+    assert [e['user_id'] for e in sink.events] == [2, 3, 4]
+
+
+def test_background_writer():
+    sink = MemorySink()
+    audit_log = AuditLog(sink, batch_size=2, flush_interval=0.05)
+    audit_log.emit('login', 1)
+    audit_log.emit('logout', 1)
+    for _ in range(100):
+        if len(sink.events) == 2:
+            break
+        time.sleep(0.01)
+    assert len(sink.events) == 2
+    audit_log.emit('login', 2)
+    audit_log.close()
+    assert len(sink.events) == 3
+
+
+def test_jsonlines_sink(tmpdir):
+    path = str(tmpdir.join('audit.jsonl'))
+    audit_log = AuditLog(JSONLinesSink(path))
+    audit_log.emit('login', 1)
+    audit_log.emit('role.added', 1, role='admin')
+    audit_log.flush()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['event'] for line in lines] == ['login', 'role.added']
+    assert lines[1]['data'] == {'role': 'admin'}
+
+
+def test_sql_sink(tmpdir):
+    db = SQLAlchemy('sqlite:///' + str(tmpdir.join('audit.sqlite')))
+    sink = SQLSink(db)
+    # The table is created with the first write, not before
+    assert not db.engine.has_table(sink.table.name)
+    audit_log = AuditLog(sink, batch_size=2)
+    for i in range(3):
+        audit_log.emit('login', i, ip='127.0.0.1')
+    audit_log.close()
+    rows = db.engine.execute(sink.table.select()).fetchall()
+    assert [row.user_id for row in rows] == [0, 1, 2]
+    assert json.loads(rows[0].data) == {'ip': '127.0.0.1'}
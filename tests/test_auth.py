@@ -128,6 +128,112 @@ def test_use_pepper():
     assert not auth.password_is_valid(p, hashed)
 
 
+def test_versioned_peppers():
+    p = 'password'
+    auth = authcode.Auth(SECRET_KEY, peppers={1: 'abc'}, pepper_id=1,
+                         hash='sha512_crypt')
+    hashed = auth.hash_password(p)
+    assert hashed.startswith('$authcode$p=1$6$')
+    assert auth.password_is_valid(p, hashed)
+
+    # Rotated: the old hashes still use the old pepper
+    auth = authcode.Auth(SECRET_KEY, peppers={1: 'abc', 2: 'def'}, pepper_id=2,
+                         hash='sha512_crypt')
+    assert auth.password_is_valid(p, hashed)
+    hashed2 = auth.hash_password(p)
+    assert hashed2.startswith('$authcode$p=2$')
+    assert auth.password_is_valid(p, hashed2)
+
+    # Removed
+    auth = authcode.Auth(SECRET_KEY, peppers={2: 'def'}, pepper_id=2,
+                         hash='sha512_crypt')
+    assert not auth.password_is_valid(p, hashed)
+
+
+def test_legacy_pepper_with_versioned_peppers():
+    p = 'password'
+    auth = authcode.Auth(SECRET_KEY, pepper='123', hash='sha512_crypt')
+    hashed = auth.hash_password(p)
+    auth = authcode.Auth(SECRET_KEY, pepper='123', peppers={1: 'abc'}, pepper_id=1,
+                         hash='sha512_crypt')
+    assert auth.password_is_valid(p, hashed)
+
+
+def test_hmac_pepper():
+    p = 'password'
+    auth = authcode.Auth(SECRET_KEY, peppers={'k1': 'abc'}, pepper_id='k1',
+                         pepper_hmac=True, hash='sha512_crypt')
+    hashed = auth.hash_password(p)
+    assert hashed.startswith('$authcode$a=hmac,p=k1$6$')
+    assert auth.password_is_valid(p, hashed)
+    assert not auth.password_is_valid('passwor', hashed)
+
+    auth = authcode.Auth(SECRET_KEY, peppers={'k1': 'abc'}, pepper_id='k1',
+                         hash='sha512_crypt')
+    assert auth.password_is_valid(p, hashed)
+    assert not auth.password_is_valid(p, hashed.replace('a=hmac,', ''))
+
+
+def test_prehash():
+    auth = authcode.Auth(SECRET_KEY, pepper='123', prehash=True, hash='bcrypt')
+    long1 = 'a' * 100 + '1'
+    long2 = 'a' * 100 + '2'
+    hashed = auth.hash_password(long1)
+    assert hashed.startswith('$authcode$h=sha512$2')
+    assert auth.password_is_valid(long1, hashed)
+    assert not auth.password_is_valid(long2, hashed)
+    assert len(auth.prepare_password(long1, {'h': 'sha512'})) == 88
+    assert auth.prepare_password('foo', {'h': 'sha512'}) != \
+        auth.prepare_password('foo', {'h': 'sha512', 'a': 'hmac'})
+
+    # Legacy hashes still work
+    legacy = authcode.Auth(SECRET_KEY, pepper='123', hash='bcrypt')
+    assert auth.password_is_valid('foobar', legacy.hash_password('foobar'))
+    assert legacy.password_is_valid(long1, hashed)
+
+
+def test_migrate_pepper_on_authenticate():
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, pepper='123', hash='pbkdf2_sha512')
+    User = auth.User
+    db.create_all()
+    credentials = {'login': u'meh', 'password': 'foobar'}
+    user = User(**credentials)
+    db.session.add(user)
+    db.session.commit()
+    legacy_hash = user.password
+
+    auth.peppers = {1: 'abc'}
+    auth.pepper_id = 1
+    encrypt_calls = []
+    hasher = auth.hasher
+    auth.hasher = Counting(hasher, encrypt_calls)
+
+    assert auth.authenticate(credentials)
+    assert user.password.startswith('$authcode$p=1$pbkdf2-sha512$')
+    assert user.password != legacy_hash
+    # The sample hash and the new one
+    assert len(encrypt_calls) == 2
+
+    assert auth.authenticate(credentials)
+    assert auth.authenticate(credentials)
+    assert len(encrypt_calls) == 2
+
+
+class Counting(object):
+
+    def __init__(self, hasher, calls):
+        self.hasher = hasher
+        self.calls = calls
+
+    def encrypt(self, secret):
+        self.calls.append(1)
+        return self.hasher.encrypt(secret)
+
+    def verify(self, secret, hashed):
+        return self.hasher.verify(secret, hashed)
+
+
 def test_unsupported_hash():
     with pytest.raises(authcode.WrongHashAlgorithm):
         authcode.Auth(SECRET_KEY, hash='foobar')
@@ -533,3 +639,29 @@ def test_replace_hash_password_method():
 
     auth_user = auth.authenticate({})
     assert not auth_user
+
+
+def test_warmup():
+    import sys
+    from sqlalchemy import event
+    from sqlalchemy.orm import mapperlib
+
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, roles=True)
+    checkouts = []
+    event.listen(db.engine, 'checkout', lambda *args: checkouts.append(1))
+    steps = auth.warmup()
+
+    assert list(steps) == ['models', 'hasher', 'templates', 'keys']
+    assert all(elapsed >= 0 for elapsed in steps.values())
+    assert auth._hasher is not None
+    assert 'jinja2' in sys.modules
+    assert not mapperlib.Mapper._new_mappers
+    # The database wasn't used
+    assert not checkouts
+
+
+def test_warmup_without_db():
+    auth = authcode.Auth(SECRET_KEY)
+    steps = auth.warmup()
+    assert list(steps) == ['hasher', 'templates', 'keys']
@@ -0,0 +1,132 @@
+# coding=utf-8
+from __future__ import print_function
+
+from sqlalchemy_wrapper import SQLAlchemy
+import authcode
+from authcode.backends import BackendRegistry
+
+from helpers import SECRET_KEY
+
+
+def test_dispatch_by_keys():
+    calls = []
+
+    def by_password(credentials):
+        calls.append('password')
+
+    def by_token(credentials):
+        calls.append('token')
+        return credentials['token'] == 'good'
+
+    registry = BackendRegistry()
+    registry.register(by_password, keys=('login', 'password'))
+    registry.register(by_token, keys=('token',))
+
+    assert registry.authenticate({'token': 'good'})
+    assert calls == ['token']
+    assert not registry.authenticate({'login': 'meh', 'password': None})
+    assert calls == ['token']
+    assert not registry.authenticate({'login': 'meh', 'password': ''})
+    assert calls == ['token', 'password']
+    assert not registry.authenticate({'foo': 'bar'})
+    assert calls == ['token', 'password']
+
+
+def test_priorities_and_catch_all():
+    calls = []
+
+    def make_backend(name, result=None):
+        def backend(credentials):
+            calls.append(name)
+            return result
+        backend.__name__ = name
+        return backend
+
+    registry = BackendRegistry()
+    registry.register(make_backend('low'), keys=('a',), priority=-1)
+    registry.register(make_backend('normal'), keys=('a',))
+    registry.append(make_backend('any'))
+    registry.register(make_backend('high', True), keys=('a', 'b'), priority=10)
+
+    assert [f.__name__ for f in registry] == ['high', 'normal', 'any', 'low']
+    assert not registry.authenticate({'a': 1})
+    assert calls == ['normal', 'any', 'low']
+
+    calls[:] = []
+    assert registry.authenticate({'a': 1, 'b': 2})
+    assert calls == ['high']
+
+
+def test_unregister_and_stats():
+    registry = BackendRegistry()
+    registry.register(lambda c: c['x'] == 1, keys=('x',), name='ex')
+    registry.authenticate({'x': 1})
+    registry.authenticate({'x': 2})
+    stats = registry.stats()['ex']
+    assert stats['calls'] == 2
+    assert stats['hits'] == 1
+    assert stats['total_time'] >= 0
+
+    registry.unregister('ex')
+    assert len(registry) == 0
+    assert not registry.authenticate({'x': 1})
+
+
+def test_interactive_backends():
+    registry = BackendRegistry()
+    registry.register(lambda c: 'form', keys=('login',), name='form')
+    registry.register(lambda c: 'machine', keys=('key',), name='machine',
+                      interactive=False)
+
+    assert registry.authenticate({'key': 1}) == 'machine'
+    assert registry.authenticate({'key': 1}, interactive=True) is None
+    assert registry.authenticate({'login': 1}, interactive=True) == 'form'
+    assert registry.stats()['machine']['calls'] == 1
+
+
+def test_list_compatibility():
+    registry = BackendRegistry()
+    registry.register(lambda c: None, keys=('a',), name='first')
+    registry.append(lambda c: 'one')
+    registry.append(lambda c: 'two')
+    assert len(registry) == 3
+    assert sorted(registry.stats()) == ['<lambda>', '<lambda>_2', 'first']
+
+    def catch_all(credentials):
+        return 'zero'
+
+    registry.insert(0, catch_all)
+    assert registry[0] is catch_all
+    assert registry[-1]({}) == 'two'
+    assert registry.authenticate({'a': 1}) == 'zero'
+
+    registry.remove(catch_all)
+    assert len(registry) == 3
+    assert registry.authenticate({'a': 1}) == 'one'
+
+    registry.register(lambda c: 'replaced', name='first')
+    assert len(registry) == 3
+
+
+def test_auth_backends():
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db)
+    db.create_all()
+    user = auth.User(login=u'meh', password='foobar')
+    db.session.add(user)
+    db.session.commit()
+
+    assert auth.backends.get('password').keys == frozenset(['login', 'password'])
+    assert auth.authenticate({'token': user.get_token()}) == user
+    assert auth.backends.stats()['password']['calls'] == 0
+    assert auth.backends.stats()['token']['hits'] == 1
+
+    def auth_master_key(credentials):
+        if credentials['master_key'] == 'open sesame':
+            return auth.User.by_id(1)
+
+    auth.backends.register(auth_master_key, keys=('master_key',))
+    assert auth.authenticate({'master_key': 'open sesame'}) == user
+
+    auth.backends = [auth_master_key]
+    assert auth.authenticate({'master_key': 'open sesame'}) == user
@@ -0,0 +1,77 @@
+# coding=utf-8
+from __future__ import print_function
+import base64
+
+from authcode.utils import parse_basic_authorization
+
+from helpers import get_auth
+
+
+def _header(login, password):
+    value = u'{0}:{1}'.format(login, password).encode('utf8')
+    return 'Basic ' + base64.b64encode(value).decode('ascii')
+
+
+def _count_hashes(auth):
+    calls = []
+    password_is_valid = auth.password_is_valid
+
+    def counting(secret, hashed):
+        calls.append(1)
+        return password_is_valid(secret, hashed)
+
+    auth.password_is_valid = counting
+    return calls
+
+
+def test_parse_basic_authorization():
+    assert parse_basic_authorization(_header('meh', 'foo:bar')) == ('meh', 'foo:bar')
+    assert parse_basic_authorization('Bearer lalala') is None
+    assert parse_basic_authorization('Basic ???') is None
+    assert parse_basic_authorization('Basic') is None
+    assert parse_basic_authorization(None) is None
+
+
+def test_authenticate_with_basic_auth():
+    auth, [user] = get_auth()
+    assert auth.authenticate({'authorization': _header('meh', 'foobar')}) == user
+    assert auth.authenticate({'authorization': _header('meh', 'wrong')}) is None
+    assert auth.authenticate({'authorization': _header('wtf', 'foobar')}) is None
+    assert auth.authenticate({'authorization': 'Basic xxx'}) is None
+
+
+def test_basic_auth_cache():
+    auth, [user] = get_auth()
+    calls = _count_hashes(auth)
+    credentials = {'authorization': _header('meh', 'foobar')}
+
+    assert auth.authenticate(credentials) == user
+    assert auth.authenticate(credentials) == user
+    assert auth.authenticate(credentials) == user
+    assert len(calls) == 1
+
+    # Wrong passwords are never cached
+    assert auth.authenticate({'authorization': _header('meh', 'wrong')}) is None
+    assert auth.authenticate({'authorization': _header('meh', 'wrong')}) is None
+    assert len(calls) == 3
+
+    # The plain password isn't stored
+    for key, user_id in auth.basic_auth_cache.items():
+        assert 'foobar' not in key
+        assert user_id == user.id
+
+    # Changing the password invalidates the cache
+    user.password = 'lalala'
+    auth.db.session.commit()
+    assert auth.authenticate(credentials) is None
+    assert len(calls) == 4
+
+
+def test_basic_auth_cache_disabled():
+    auth, [user] = get_auth(basic_auth_cache_ttl=0)
+    calls = _count_hashes(auth)
+    credentials = {'authorization': _header('meh', 'foobar')}
+    assert auth.authenticate(credentials) == user
+    assert auth.authenticate(credentials) == user
+    assert len(calls) == 2
+    assert auth.basic_auth_cache is None
@@ -0,0 +1,87 @@
+# coding=utf-8
+from __future__ import print_function
+from time import time
+
+from authcode import bearer
+import pytest
+
+from helpers import get_auth
+
+
+def test_access_token():
+    auth, [user] = get_auth()
+    tokens = auth.issue_bearer_tokens(user, scopes=['read'])
+    assert tokens['token_type'] == 'Bearer'
+    assert tokens['expires_in'] == auth.access_token_life
+
+    claims = auth.verify_access_token(tokens['access_token'])
+    assert claims['sub'] == user.id
+    assert claims['scp'] == ['read']
+
+    # A refresh token can't be used as an access token
+    assert auth.verify_access_token(tokens['refresh_token']) is None
+    assert auth.verify_access_token('foobar') is None
+    assert auth.verify_access_token('foo.bar') is None
+    assert auth.verify_access_token(None) is None
+
+    payload, signature = tokens['access_token'].split('.')
+    assert auth.verify_access_token(payload + '.' + signature[::-1]) is None
+
+    auth2, [_] = get_auth(token_keys={'1': 'another secret key'})
+    assert auth2.verify_access_token(tokens['access_token']) is None
+
+
+def test_expired_access_token():
+    auth, [user] = get_auth()
+    key_ring = auth.key_ring
+    token = bearer.dumps(key_ring, {
+        'typ': bearer.ACCESS, 'sub': user.id, 'scp': [], 'exp': int(time()) - 1,
+    })
+    assert auth.verify_access_token(token) is None
+
+
+def test_key_rotation():
+    keys = {'1': 'old secret key', '2': 'new secret key'}
+    auth, [user] = get_auth(token_keys={'1': keys['1']})
+    old_token = auth.issue_bearer_tokens(user)['access_token']
+
+    auth, [user] = get_auth(token_keys=keys, token_key_id='2')
+    new_token = auth.issue_bearer_tokens(user)['access_token']
+    assert auth.verify_access_token(old_token)['kid'] == '1'
+    assert auth.verify_access_token(new_token)['kid'] == '2'
+
+
+def test_key_ring_needs_current_key_id():
+    keys = {'9': 'old secret key', '10': 'new secret key'}
+    auth, [user] = get_auth(token_keys=keys)
+    with pytest.raises(ValueError):
+        auth.key_ring
+
+    auth, [user] = get_auth(token_keys=keys, token_key_id='10')
+    token = auth.issue_bearer_tokens(user)['access_token']
+    assert auth.verify_access_token(token)['kid'] == '10'
+
+
+def test_refresh_tokens():
+    auth, [user] = get_auth()
+    tokens = auth.issue_bearer_tokens(user, scopes=['read', 'write'])
+
+    new_tokens = auth.refresh_bearer_tokens(tokens['refresh_token'])
+    claims = auth.verify_access_token(new_tokens['access_token'])
+    assert claims['sub'] == user.id
+    assert claims['scp'] == ['read', 'write']
+
+    assert auth.refresh_bearer_tokens(tokens['access_token']) is None
+
+    user.password = 'lalala'
+    auth.db.session.commit()
+    assert auth.refresh_bearer_tokens(tokens['refresh_token']) is None
+
+
+def test_authenticate_with_access_token():
+    auth, [user] = get_auth()
+    tokens = auth.issue_bearer_tokens(user, scopes=['read'])
+    auth_user = auth.authenticate({'access_token': tokens['access_token']})
+    assert auth_user == user
+    assert auth_user.token_claims['scp'] == ['read']
+    assert auth.authenticate({'access_token': 'foo'}) is None
@@ -0,0 +1,72 @@
+# coding=utf-8
+from __future__ import print_function
+from hashlib import sha1
+
+from sqlalchemy_wrapper import SQLAlchemy
+import pytest
+import authcode
+from authcode import breach
+
+from helpers import SECRET_KEY
+
+
+BREACHED = [u'password', u'123456', u'qwerty', u'letmein', u'contraseña']
+
+
+def _write_dump(path, passwords):
+    lines = [
+        u'{0}:{1}'.format(sha1(p.encode('utf8')).hexdigest().upper(), i)
+        for i, p in enumerate(passwords)
+    ]
+    path.write_text(u'\n'.join(lines) + u'\nnot a hash\n', encoding='utf8')
+
+
+def test_convert_and_lookup(tmpdir):
+    src = tmpdir.join('dump.txt')
+    dst = str(tmpdir.join('breached.bin'))
+    _write_dump(src, BREACHED + BREACHED[:2])
+
+    assert breach.convert(str(src), dst, chunk_size=2) == len(BREACHED)
+    breached = breach.BreachedPasswords(dst)
+    assert len(breached) == len(BREACHED)
+    for password in BREACHED:
+        assert password in breached
+    assert u'correct horse battery staple' not in breached
+    assert u'passwor' not in breached
+    breached.close()
+
+
+def test_empty_list(tmpdir):
+    src = tmpdir.join('dump.txt')
+    dst = str(tmpdir.join('breached.bin'))
+    src.write_text(u'', encoding='utf8')
+    assert breach.convert(str(src), dst) == 0
+    assert u'password' not in breach.BreachedPasswords(dst)
+
+
+def test_command_line(tmpdir):
+    src = tmpdir.join('dump.txt')
+    dst = str(tmpdir.join('breached.bin'))
+    _write_dump(src, BREACHED)
+    assert breach.main(['convert', str(src), dst]) == 0
+    assert breach.main(['check', dst, 'qwerty']) == 1
+    assert breach.main(['check', dst, 'foobar']) == 0
+
+
+def test_hash_password_rejects_breached(tmpdir):
+    src = tmpdir.join('dump.txt')
+    dst = str(tmpdir.join('breached.bin'))
+    _write_dump(src, BREACHED)
+    breach.convert(str(src), dst)
+
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, breached_passwords=dst)
+    User = auth.User
+    db.create_all()
+
+    assert auth.hash_password(u'foobar')
+    with pytest.raises(ValueError):
+        auth.hash_password(u'letmein')
+    with pytest.raises(ValueError):
+        User(login=u'meh', password=u'qwerty')
+    assert isinstance(auth.breached_passwords, breach.BreachedPasswords)
@@ -0,0 +1,107 @@
+# coding=utf-8
+from __future__ import print_function
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime
+from authcode.gates import LoginThrottle
+
+from helpers import get_auth
+
+
+def _count_hashes(auth):
+    calls = []
+    password_is_valid = auth.password_is_valid
+
+    def counting(secret, hashed):
+        calls.append(1)
+        return password_is_valid(secret, hashed)
+
+    auth.password_is_valid = counting
+    return calls
+
+
+def test_suspended_gate():
+    auth, [user] = get_auth(login_gates=['missing_password', 'suspended'])
+    calls = _count_hashes(auth)
+    credentials = {'login': u'meh', 'password': 'foobar'}
+    assert auth.authenticate(credentials)
+    assert len(calls) == 1
+
+    user.deleted = True
+    auth.db.session.commit()
+    assert auth.authenticate(credentials) is None
+    assert len(calls) == 1
+    assert auth.gate_rejections['suspended'] == 1
+
+
+def test_missing_password_gate():
+    auth, [user] = get_auth()
+    user.set_raw_password(None)
+    calls = _count_hashes(auth)
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'}) is None
+    assert not calls
+    assert auth.gate_rejections['missing_password'] == 1
+
+
+def test_locked_out_gate():
+    class UserMixin(object):
+        locked_until = Column(DateTime, nullable=True)
+
+    auth, [user] = get_auth(UserMixin=UserMixin, login_gates=['locked_out'])
+    credentials = {'login': u'meh', 'password': 'foobar'}
+    user.locked_until = datetime.utcnow() + timedelta(minutes=5)
+    auth.db.session.commit()
+    assert auth.authenticate(credentials) is None
+
+    user.locked_until = datetime.utcnow() - timedelta(minutes=5)
+    auth.db.session.commit()
+    assert auth.authenticate(credentials)
+
+
+def test_throttle_gate():
+    throttle = LoginThrottle(max_failures=2, window=60)
+    auth, [user] = get_auth(login_gates=['missing_password', throttle])
+    calls = _count_hashes(auth)
+
+    assert auth.authenticate({'login': u'meh', 'password': 'wrong'}) is None
+    assert auth.authenticate({'login': u'meh', 'password': 'wrong'}) is None
+    assert len(calls) == 2
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'}) is None
+    assert len(calls) == 2
+    assert auth.gate_rejections['throttled'] == 1
+
+    throttle.failures.clear()
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'})
+
+
+def test_throttle_resets_on_success():
+    throttle = LoginThrottle(max_failures=3, window=60)
+    auth, [user] = get_auth(login_gates=[throttle])
+
+    for _ in range(2):
+        assert auth.authenticate({'login': u'meh', 'password': 'wrong'}) is None
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'})
+    for _ in range(2):
+        assert auth.authenticate({'login': u'meh', 'password': 'wrong'}) is None
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'})
+
+
+def test_throttle_is_per_auth():
+    throttle = LoginThrottle(max_failures=2, window=60)
+    auth1, [user1] = get_auth(login_gates=[throttle], users_model_name='T1User')
+    auth2, [user2] = get_auth(login_gates=[throttle], users_model_name='T2User')
+    assert user1.id == user2.id
+
+    for _ in range(2):
+        assert auth1.authenticate({'login': u'meh', 'password': 'wrong'}) is None
+    assert auth1.authenticate({'login': u'meh', 'password': 'foobar'}) is None
+    assert auth2.authenticate({'login': u'meh', 'password': 'foobar'})
+
+
+def test_custom_gate():
+    def only_admins(auth, user, credentials):
+        return user.login == u'admin'
+
+    auth, [user] = get_auth(login_gates=['missing_password', only_admins])
+    assert auth.authenticate({'login': u'meh', 'password': 'foobar'}) is None
+    assert auth.gate_rejections == {'only_admins': 1}
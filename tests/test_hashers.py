@@ -0,0 +1,121 @@
+# coding=utf-8
+from __future__ import print_function
+
+import pytest
+import authcode
+from authcode import hashers
+
+from helpers import SECRET_KEY
+
+
+def test_shared_hashers():
+    hashers.clear()
+    auths = [
+        authcode.Auth(SECRET_KEY, prefix='tenant{0}'.format(i), hash='pbkdf2_sha512')
+        for i in range(20)
+    ]
+    assert hashers.count() == 0
+
+    for auth in auths:
+        auth.hash_password('foobar')
+    assert hashers.count() == 1
+    assert len(set(id(auth.hasher) for auth in auths)) == 1
+
+
+def test_different_configurations():
+    hashers.clear()
+    auth1 = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512', rounds=1000)
+    auth2 = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512', rounds=2000)
+    auth3 = authcode.Auth(SECRET_KEY, hash='sha512_crypt', rounds=1000)
+    assert auth1.hasher is not auth2.hasher
+    assert auth1.hasher is not auth3.hasher
+    assert auth1.rounds == 1000
+    assert hashers.count() == 3
+
+    hashed = auth1.hash_password('foobar')
+    assert auth2.password_is_valid('foobar', hashed)
+    assert auth3.password_is_valid('foobar', hashed)
+
+
+def test_default_rounds_are_the_same_configuration():
+    hashers.clear()
+    default_rounds = hashers.get_rounds('pbkdf2_sha512')
+    auth1 = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512')
+    auth2 = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512', rounds=default_rounds)
+    assert auth1.hasher is auth2.hasher
+    assert auth1.rounds == default_rounds
+
+
+def test_rounds_before_first_use():
+    auth = authcode.Auth(SECRET_KEY, hash='sha512_crypt', rounds=10)
+    assert auth.rounds == 1000
+    assert auth._hasher is None
+    auth2 = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512')
+    assert auth2.rounds == hashers.get_rounds('pbkdf2_sha512')
+    assert auth2._hasher is None
+
+
+def test_set_hasher():
+    auth = authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512', rounds=1000)
+    hasher = auth.hasher
+    auth.set_hasher('sha512_crypt', rounds=1000)
+    assert auth.hash == 'sha512-crypt'
+    assert auth.hasher is not hasher
+    assert auth.hash_password('foobar').startswith('$6$')
+
+
+def test_scrypt():
+    auth = authcode.Auth(SECRET_KEY, hash='scrypt', memory_cost=1024, parallelism=2)
+    assert auth.rounds == 10
+    hashed = auth.hash_password('foobar')
+    assert hashed.startswith('$scrypt$ln=10,r=8,p=2$')
+    assert auth.password_is_valid('foobar', hashed)
+
+    other = authcode.Auth(SECRET_KEY, hash='scrypt', rounds=10, parallelism=2)
+    assert other.hasher is auth.hasher
+
+
+def test_argon2():
+    pytest.importorskip('argon2')
+    auth = authcode.Auth(
+        SECRET_KEY, hash='argon2', memory_cost=1024, time_cost=2, parallelism=2)
+    hashed = auth.hash_password('foobar')
+    assert hashed.startswith('$argon2id$')
+    assert 'm=1024,t=2,p=2' in hashed
+    assert auth.password_is_valid('foobar', hashed)
+
+
+def test_invalid_cost_params():
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='pbkdf2_sha512', memory_cost=1024)
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='scrypt', time_cost=3)
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='argon2', parallelism=0)
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='argon2', memory_cost=16, parallelism=4)
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='argon2', rounds=2, time_cost=3)
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, hash='scrypt', rounds=12, memory_cost=1024)
+
+
+def test_hash_prefix_includes_argon2_costs():
+    from authcode import utils
+    hashed = '$argon2id$v=19$m=1024,t=2,p=2$c2FsdA$Y2hlY2tzdW0'
+    assert utils.get_hash_prefix(hashed) == ['', 'argon2id', 'v=19', 'm=1024,t=2,p=2']
+    assert utils.get_hash_prefix('$pbkdf2-sha512$1000$salt$sum') == ['', 'pbkdf2-sha512', '1000']
+
+
+def test_calibrate():
+    report = hashers.calibrate('scrypt', memory_cost=1024, samples=1,
+                               memory_budget=4096)
+    assert report['rounds'] == 10
+    assert report['memory'] == 1024
+    assert report['seconds'] > 0
+    assert report['hashes_per_core'] > 0
+    assert report['max_hashes_per_second'] <= 4 / report['seconds']
+
+    report = hashers.calibrate('pbkdf2_sha512', rounds=1000, target=0.001, samples=1)
+    assert report['rounds'] >= 1000
+    assert report['seconds'] >= 0.001 or report['rounds'] == hashers.get_hasher('pbkdf2_sha512').max_rounds
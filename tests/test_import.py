@@ -0,0 +1,54 @@
+# coding=utf-8
+"""
+Guards against making ``import authcode`` slower again.
+Each test runs in a fresh interpreter, so nothing is already imported.
+"""
+from __future__ import print_function
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = [
+    'passlib', 'argon2', 'bcrypt', 'jinja2', 'flask', 'bottle', 'werkzeug',
+]
+
+
+def _run(code):
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return out.decode('utf8').strip()
+
+
+def _imported_after(code):
+    code = code + (
+        '\nimport sys'
+        '\nprint(",".join(m for m in {0!r} if m in sys.modules))'
+    ).format(HEAVY_MODULES)
+    return [m for m in _run(code).split(',') if m]
+
+
+def test_import_is_lazy():
+    assert _imported_after('import authcode') == []
+
+
+def test_create_auth_is_lazy():
+    code = (
+        'import authcode\n'
+        'from sqlalchemy.ext.declarative import declarative_base\n'
+        'class DB(object):\n'
+        '    Model = declarative_base()\n'
+        '    metadata = Model.metadata\n'
+        'auth = authcode.Auth("x" * 32, db=DB(), roles=True)\n'
+    )
+    assert _imported_after(code) == []
+
+
+def test_hasher_is_built_on_first_use():
+    code = (
+        'import authcode\n'
+        'auth = authcode.Auth("x" * 32, rounds=1000)\n'
+        'assert auth.password_is_valid("foobar", auth.hash_password("foobar"))\n'
+    )
+    assert _imported_after(code) == ['passlib']
+
@@ -0,0 +1,106 @@
+# coding=utf-8
+from __future__ import print_function
+import io
+
+from passlib import hash as ph
+import authcode
+from authcode import inventory
+
+from helpers import SECRET_KEY, get_auth
+
+
+def test_parse_hash():
+    assert inventory.parse_hash(None) == ('none', '', '')
+    assert inventory.parse_hash(ph.pbkdf2_sha512.using(rounds=1000).hash('x')) == \
+        ('pbkdf2_sha512', '1000', '')
+    assert inventory.parse_hash(ph.sha512_crypt.using(rounds=6000).hash('x')) == \
+        ('sha512_crypt', '6000', '')
+    assert inventory.parse_hash(ph.hex_sha1.hash('x')) == ('hex_sha1', '', '')
+    assert inventory.parse_hash(ph.ldap_pbkdf2_sha256.using(rounds=2000).hash('x')) == \
+        ('ldap_pbkdf2_sha256', '2000', '')
+    assert inventory.parse_hash('$authcode$h=sha512,p=2$2b$12$' + 'a' * 53) == \
+        ('bcrypt', '12', 'h=sha512,p=2')
+    assert inventory.parse_hash('$argon2id$v=19$m=1024,t=2,p=2$c2FsdA$Y2hl') == \
+        ('argon2', 'm=1024,t=2,p=2', '')
+    assert inventory.parse_hash('lalala')[0] == 'unknown'
+
+
+def _get_auth_with_old_hashes():
+    logins = [u'user{0}'.format(i) for i in range(7)]
+    auth, users = get_auth(logins=logins, hash='pbkdf2_sha512', rounds=1000)
+    old = [
+        ph.hex_sha1.hash('foobar'),
+        ph.pbkdf2_sha512.using(rounds=500).hash('foobar'),
+        None,
+    ]
+    for user, hashed in zip(reversed(users), old):
+        user.set_raw_password(hashed)
+    auth.db.session.commit()
+    return auth
+
+
+def test_hash_inventory():
+    auth = _get_auth_with_old_hashes()
+    report = inventory.hash_inventory(auth, batch_size=2)
+    assert report['total'] == 7
+    assert report['upgrade'] == 2
+
+    buckets = dict(
+        ((item['scheme'], item['cost']), item) for item in report['buckets'])
+    assert buckets[('pbkdf2_sha512', '1000')]['count'] == 4
+    assert not buckets[('pbkdf2_sha512', '1000')]['upgrade']
+    assert buckets[('pbkdf2_sha512', '500')]['upgrade']
+    assert buckets[('hex_sha1', '')]['deprecated']
+    assert buckets[('none', '')]['count'] == 1
+    assert not buckets[('none', '')]['upgrade']
+    assert report['buckets'][0]['count'] == 4
+
+    text = inventory.format_report(report)
+    assert '7 hashes, 2 to be upgraded' in text
+
+
+def test_hash_inventory_without_update_hash():
+    auth = _get_auth_with_old_hashes()
+    auth.update_hash = False
+    report = inventory.hash_inventory(auth)
+    assert report['total'] == 7
+    assert report['upgrade'] == 0
+    assert not any(item['upgrade'] for item in report['buckets'])
+
+
+def test_current_key():
+    configs = [
+        ('pbkdf2_sha512', 1000), ('sha512_crypt', 6000), ('bcrypt', 5),
+        ('scrypt', 4), ('ldap_pbkdf2_sha256', 2000), ('ldap_bcrypt', 5),
+    ]
+    for hash, rounds in configs:
+        auth = authcode.Auth(SECRET_KEY, hash=hash, rounds=rounds)
+        hashed = auth.hash_password('foobar')
+        assert inventory.get_current_key(auth) == inventory.parse_hash(hashed)
+
+    auth = authcode.Auth(SECRET_KEY, hash='bcrypt', rounds=5, prehash=True,
+                         peppers={2: 'pepper'}, pepper_id=2)
+    hashed = auth.hash_password('foobar')
+    assert inventory.get_current_key(auth) == inventory.parse_hash(hashed)
+
+
+class NoHashing(object):
+    def __getattr__(self, name):
+        raise AssertionError('The hasher was used')
+
+
+def test_hash_inventory_does_not_hash():
+    auth = _get_auth_with_old_hashes()
+    auth.hasher = NoHashing()
+    report = inventory.hash_inventory(auth)
+    assert report['upgrade'] == 2
+
+
+def test_csv():
+    auth = _get_auth_with_old_hashes()
+    csv_file = io.StringIO() if str is not bytes else io.BytesIO()
+    inventory.hash_inventory(auth, csv_file=csv_file)
+    lines = csv_file.getvalue().strip().splitlines()
+    assert lines[0].split(',') == inventory.CSV_HEADER
+    assert len(lines) == 8
+    assert lines[-1].split(',')[0] == 'hex_sha1'
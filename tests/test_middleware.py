@@ -0,0 +1,169 @@
+# coding=utf-8
+from __future__ import print_function
+
+from sqlalchemy_wrapper import SQLAlchemy
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+import authcode
+from authcode.middleware import AuthMiddleware
+from authcode.revocation import RevocationList
+
+from helpers import SECRET_KEY
+
+
+def _get_app(**kwargs):
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, revocation_list=RevocationList())
+    db.create_all()
+    user = auth.User(login=u'meh', password='foobar')
+    db.session.add(user)
+    db.session.commit()
+
+    def app(environ, start_response):
+        path = environ['PATH_INFO']
+        if path == '/sign-in/':
+            environ['authcode.login'](user)
+            body = 'welcome'
+        elif path == '/sign-out/':
+            environ['authcode.logout']()
+            body = 'bye'
+        else:
+            user_ = environ['authcode.get_user']()
+            body = user_.login if user_ else 'anonymous'
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [body.encode('utf8')]
+
+    def is_admin(identity, environ):
+        return identity['sub'] != user.id
+
+    rules = [
+        ('/private/', True),
+        ('/private/public/', False),
+        ('/admin/', is_admin),
+        ('/staff', True),
+    ]
+    mw = AuthMiddleware(app, auth, rules=rules, **kwargs)
+    return auth, user, mw
+
+
+def test_public_paths():
+    auth, user, mw = _get_app()
+    client = Client(mw, BaseResponse)
+    resp = client.get('/')
+    assert resp.data == b'anonymous'
+    resp = client.get('/private/public/')
+    assert resp.data == b'anonymous'
+    # Prefixes match whole path segments
+    resp = client.get('/staffing/')
+    assert resp.data == b'anonymous'
+    assert client.get('/staff').status_code == 401
+    assert client.get('/staff/foo/').status_code == 401
+
+
+def test_protected_paths():
+    auth, user, mw = _get_app()
+    client = Client(mw, BaseResponse)
+    assert client.get('/private/').status_code == 401
+    assert client.get('/admin/').status_code == 401
+
+    resp = client.get('/sign-in/')
+    cookie = resp.headers['Set-Cookie']
+    assert cookie.startswith('auth=')
+    assert 'HttpOnly' in cookie
+
+    resp = client.get('/private/')
+    assert resp.data == b'meh'
+    assert 'Set-Cookie' not in resp.headers
+    assert client.get('/admin/').status_code == 403
+
+    client.get('/sign-out/')
+    assert client.get('/private/').status_code == 401
+
+
+def test_redirect_to_sign_in():
+    auth, user, mw = _get_app(url_sign_in='/sign-in/')
+    client = Client(mw, BaseResponse)
+    resp = client.get('/private/foo/')
+    assert resp.status_code == 303
+    assert resp.headers['Location'].endswith('/sign-in/?next=/private/foo/')
+
+
+def test_tampered_cookie():
+    auth, user, mw = _get_app()
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    client.set_cookie('localhost', 'auth', value[:-2] + 'xx')
+    assert client.get('/private/').status_code == 401
+    client.set_cookie('localhost', 'auth', value)
+    assert client.get('/private/').status_code == 200
+
+
+def test_cookie_is_renewed():
+    auth, user, mw = _get_app(max_age=100)
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    mw.max_age = 1000
+    client.set_cookie('localhost', 'auth', value)
+    resp = client.get('/private/')
+    assert resp.status_code == 200
+    assert 'Max-Age=1000' in resp.headers['Set-Cookie']
+
+
+def test_revoked_cookie():
+    auth, user, mw = _get_app()
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    client.set_cookie('localhost', 'auth', value)
+    identity = mw.get_identity({'HTTP_COOKIE': 'auth=' + value})
+    auth.revoke_session(identity['sid'])
+    assert client.get('/private/').status_code == 401
+
+
+def test_logout_revokes_the_cookie():
+    auth, user, mw = _get_app()
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    client.set_cookie('localhost', 'auth', value)
+    client.get('/sign-out/')
+
+    # A copy of the cookie no longer works
+    client = Client(mw, BaseResponse)
+    client.set_cookie('localhost', 'auth', value)
+    assert client.get('/private/').status_code == 401
+
+
+def test_cookie_is_bound_to_the_password():
+    auth, user, mw = _get_app(max_age=100)
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    client.set_cookie('localhost', 'auth', value)
+    user.password = 'lalalala'
+    auth.db.session.commit()
+
+    mw.max_age = 1000
+    resp = client.get('/private/')
+    assert resp.status_code == 401
+    assert 'Max-Age=0' in resp.headers['Set-Cookie']
+
+
+def test_deleted_user_cookie_is_not_renewed():
+    auth, user, mw = _get_app(max_age=100)
+    client = Client(mw, BaseResponse)
+    value = mw.make_cookie(user).split(';')[0].split('=', 1)[1]
+    client.set_cookie('localhost', 'auth', value)
+    user.deleted = True
+    auth.db.session.commit()
+
+    mw.max_age = 1000
+    assert client.get('/private/').status_code == 401
+
+
+def test_verify_user():
+    auth, user, mw = _get_app(verify_user=True)
+    client = Client(mw, BaseResponse)
+    client.get('/sign-in/')
+    assert client.get('/private/').status_code == 200
+
+    user.password = 'lalalala'
+    auth.db.session.commit()
+    assert client.get('/private/').status_code == 401
@@ -2,7 +2,9 @@
 from __future__ import print_function
 
 import authcode
+from sqlalchemy import func, select
 from sqlalchemy_wrapper import SQLAlchemy
+import pytest
 
 from helpers import SECRET_KEY
 
@@ -285,3 +287,143 @@ def test_naked_sqlalchemy():
 
     assert user.get_token()
     assert user.get_uhmac()
+
+
+def test_roles_lazy():
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, roles=True, roles_lazy='selectin')
+    User = auth.User
+    db.create_all()
+    user = User(login=u'meh', password='foobar')
+    db.session.add(user)
+    user.add_role('admin')
+    user.add_role('admin')
+    user.add_role('editor')
+    db.session.commit()
+    assert sorted(role.name for role in user.roles) == ['admin', 'editor']
+    assert user.has_role('editor')
+    user.remove_role('editor')
+    db.session.commit()
+    assert [role.name for role in user.roles] == ['admin']
+
+    db.session.expunge_all()
+    users = db.session.query(User).all()
+    db.session.close()
+    # Already loaded
+    assert [role.name for role in users[0].roles] == ['admin']
+
+    with pytest.raises(ValueError):
+        authcode.Auth(SECRET_KEY, db=db, roles=True, roles_lazy='lalala')
+
+
+def _get_bulk_auth(n=20):
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, roles=True)
+    db.create_all()
+    users = [auth.User(login=u'user{0}'.format(i)) for i in range(n)]
+    db.session.add_all(users)
+    db.session.commit()
+    return auth, users
+
+
+def _count_roles(auth):
+    query = select([func.count()]).select_from(auth.UserRoles)
+    return auth.db.session.execute(query).scalar()
+
+
+def test_bulk_assign():
+    auth, users = _get_bulk_auth()
+    Role = auth.Role
+    users[0].add_role('admin')
+    auth.db.session.commit()
+
+    inserted = Role.assign(['admin', 'editor'], users[:10])
+    auth.db.session.commit()
+    assert inserted == 19
+    assert _count_roles(auth) == 20
+    assert users[5].has_role('editor')
+    assert not users[15].has_role('editor')
+
+    # Users from a query
+    User = auth.User
+    query = auth.db.session.query(User.id).filter(User.login.like(u'user1%'))
+    inserted = Role.assign(['reader'], query)
+    assert inserted == 11  # user1, user10..user19
+    assert Role.assign(['reader'], query) == 0
+
+
+def test_bulk_revoke():
+    auth, users = _get_bulk_auth()
+    Role = auth.Role
+    Role.assign(['admin', 'editor'], users)
+    auth.db.session.commit()
+    assert _count_roles(auth) == 40
+
+    deleted = Role.revoke(['editor', 'nope'], [user.id for user in users[:5]])
+    auth.db.session.commit()
+    assert deleted == 5
+    assert _count_roles(auth) == 35
+    assert not users[0].has_role('editor')
+    assert users[0].has_role('admin')
+    assert users[5].has_role('editor')
+
+
+def test_role_users_index():
+    auth, _ = _get_bulk_auth(n=1)
+    indexes = [
+        [column.name for column in index.columns]
+        for index in auth.UserRoles.indexes
+    ]
+    assert ['role_id', 'user_id'] in indexes
+
+
+def test_role_users_page():
+    auth, users = _get_bulk_auth(n=25)
+    auth.Role.assign(['admin'], users[::2])
+    auth.db.session.commit()
+    role = auth.Role.by_name('admin')
+
+    logins = []
+    after = None
+    while True:
+        page = role.users_page(after=after, limit=5)
+        if not page:
+            break
+        assert len(page) <= 5
+        logins.extend(user.login for user in page)
+        after = page[-1].login
+    assert logins == sorted(user.login for user in users[::2])
+
+
+def test_role_iter_users():
+    auth, users = _get_bulk_auth(n=25)
+    auth.Role.assign(['admin'], users[1::3])
+    auth.db.session.commit()
+    role = auth.Role.by_name('admin')
+
+    ids = [user.id for user in role.iter_users(batch_size=2)]
+    assert ids == sorted(user.id for user in users[1::3])
+    assert list(auth.Role.get_or_create(u'empty').iter_users()) == []
+
+
+def test_query_with_roles():
+    auth, users = _get_bulk_auth(n=10)
+    User = auth.User
+    auth.Role.assign(['admin'], users[:4])
+    auth.Role.assign(['editor'], users[2:6])
+    auth.db.session.commit()
+
+    def logins(query):
+        return sorted(user.login for user in query)
+
+    assert logins(User.query_with_roles('admin', 'editor')) == \
+        sorted(user.login for user in users[:6])
+    assert logins(User.query_with_roles('admin', 'editor', any=False)) == \
+        sorted(user.login for user in users[2:4])
+    assert logins(User.query_with_roles('editor', 'nope', any=False)) == []
+    assert logins(User.query_with_roles()) == []
+    assert len(logins(User.query_with_roles(any=False))) == 10
+    assert User.query_with_roles('admin').filter(
+        User.login == u'user1').count() == 1
+    with pytest.raises(TypeError):
+        User.query_with_roles('admin', all=True)
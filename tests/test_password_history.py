@@ -0,0 +1,145 @@
+# coding=utf-8
+from __future__ import print_function
+import os
+
+from authcode._compat import to_unicode
+from authcode import history
+from flask import Flask
+import authcode
+
+from helpers import get_auth
+
+
+# Fast enough to hash the whole history in every test
+FAST_HASH = {'hash': 'pbkdf2_sha512', 'rounds': 1000}
+
+
+def test_history_is_pruned():
+    auth, [user] = get_auth(password_history=3, **FAST_HASH)
+    assert user.password_history.count() == 1
+
+    for password in ['pass1', 'pass2', 'pass3', 'pass4']:
+        user.password = password
+        auth.db.session.commit()
+
+    hashes = auth.PasswordHistory.get_hashes(user.id)
+    assert len(hashes) == 3
+    assert hashes[0] == user.password
+    assert user.password_history.count() == 3
+
+
+def test_password_in_history():
+    auth, [user] = get_auth(password_history=3, password_history_workers=0, **FAST_HASH)
+    for password in ['pass1', 'pass2', 'pass3']:
+        user.password = password
+        auth.db.session.commit()
+
+    assert auth.password_in_history(user, 'pass3')  # current
+    assert auth.password_in_history(user, 'pass1')
+    assert not auth.password_in_history(user, 'foobar')  # too old
+    assert not auth.password_in_history(user, 'other')
+
+
+def test_parallel_verification():
+    auth, [user] = get_auth(password_history=5, password_history_workers=2, **FAST_HASH)
+    for password in ['pass1', 'pass2', 'pass3', 'pass4']:
+        user.password = password
+        auth.db.session.commit()
+    try:
+        assert auth.password_in_history(user, 'pass2')
+        assert auth.password_in_history(user, 'foobar')
+        assert not auth.password_in_history(user, 'other')
+    finally:
+        history.shutdown()
+
+
+def test_current_password_without_history():
+    auth, [user] = get_auth(password_history=3, password_history_workers=0, **FAST_HASH)
+    table = auth.PasswordHistory.__table__
+    auth.db.session.execute(table.delete())
+    auth.db.session.commit()
+    assert auth.PasswordHistory.get_hashes(user.id) == []
+    assert auth.password_in_history(user, 'foobar')
+
+
+def test_pool_is_rebuilt_with_other_workers():
+    try:
+        pool = history.get_pool()
+        assert pool._max_workers == history.DEFAULT_WORKERS
+        assert history.get_pool() is pool
+        other = history.get_pool(1)
+        assert other is not pool
+        assert other._max_workers == 1
+    finally:
+        history.shutdown()
+
+
+def test_pool_errors_fall_back_to_this_process(monkeypatch):
+    auth, [user] = get_auth(password_history=3, password_history_workers=2, **FAST_HASH)
+    user.password = 'pass1'
+    auth.db.session.commit()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('broken pool')
+
+    monkeypatch.setattr(history, '_any_matches_in_pool', broken)
+    assert auth.password_in_history(user, 'foobar')
+    assert not auth.password_in_history(user, 'other')
+
+
+def test_pool_timeout_falls_back_to_this_process(monkeypatch):
+    auth, [user] = get_auth(password_history=3, password_history_workers=2,
+                            password_history_timeout=5, **FAST_HASH)
+    user.password = 'pass1'
+    auth.db.session.commit()
+    timeouts = []
+
+    def stuck(futures, timeout=None, return_when=None):
+        timeouts.append(timeout)
+        return set(), futures
+
+    monkeypatch.setattr(history, 'wait', stuck)
+    try:
+        assert auth.password_in_history(user, 'foobar')
+        assert not auth.password_in_history(user, 'other')
+    finally:
+        history.shutdown()
+    assert timeouts and all(0 < timeout <= 5 for timeout in timeouts)
+
+
+def test_pool_does_not_fork():
+    try:
+        pool = history.get_pool()
+        mp_context = getattr(pool, '_mp_context', None)
+        if mp_context is not None:
+            assert mp_context.get_start_method() != 'fork'
+    finally:
+        history.shutdown()
+
+
+def test_without_history():
+    auth, [user] = get_auth()
+    assert not hasattr(auth, 'PasswordHistory')
+    assert not auth.password_in_history(user, 'foobar')
+
+
+def test_change_password_reused():
+    auth, [user] = get_auth(password_history=3, password_history_workers=0,
+                            password_minlen=3, **FAST_HASH)
+    app = Flask('test')
+    app.secret_key = os.urandom(32)
+    app.testing = True
+    authcode.setup_for_flask(auth, app)
+    auth.session = {}
+    client = app.test_client()
+    auth.login(user)
+    csrf_token = auth.get_csrf_token()
+
+    r = client.post(auth.url_change_password, data=dict(
+        password='foobar', np1='foobar', np2='foobar', _csrf_token=csrf_token))
+    assert u'<!-- ERROR REUSED -->' in to_unicode(r.data)
+
+    r = client.post(auth.url_change_password, data=dict(
+        password='foobar', np1='lalala', np2='lalala', _csrf_token=csrf_token))
+    assert u'<!-- ERROR' not in to_unicode(r.data)
+    assert user.has_password('lalala')
@@ -0,0 +1,176 @@
+# coding=utf-8
+from __future__ import print_function
+from datetime import datetime, timedelta
+import os
+
+from flask import Flask
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+import authcode
+from authcode import wsgi
+from authcode.auth_authentication_mixin import REMEMBER_SET_KEY
+import bottle
+
+from helpers import get_auth
+
+
+def test_remember_token_model():
+    auth, [user] = get_auth(remember_tokens=True)
+    assert auth.RememberToken.__tablename__ == 'users_remember_tokens'
+    assert auth.RememberToken.__table__.c.selector.index
+
+
+def test_issue_and_auth_remember_token():
+    auth, [user] = get_auth(remember_tokens=True)
+    value = auth.issue_remember_token(user)
+    selector, validator = value.split('$')
+
+    token = auth.RememberToken.by_selector(selector)
+    assert token.user_id == user.id
+    assert validator not in token.validator
+
+    assert auth.auth_remember_token(value) == user
+    # Tokens can be used only once
+    assert auth.auth_remember_token(value) is None
+    assert auth.RememberToken.by_selector(selector) is None
+
+
+def test_password_change_invalidates_remember_tokens():
+    auth, [user] = get_auth(remember_tokens=True)
+    value = auth.issue_remember_token(user)
+    user.password = 'newpassword'
+    auth.db.session.commit()
+    assert auth.auth_remember_token(value) is None
+
+    value = auth.issue_remember_token(user)
+    assert auth.auth_remember_token(value) == user
+
+
+def test_wrong_remember_token():
+    auth, [user] = get_auth(remember_tokens=True)
+    value = auth.issue_remember_token(user)
+    selector, validator = value.split('$')
+
+    assert auth.auth_remember_token('foobar') is None
+    assert auth.auth_remember_token('foo$bar') is None
+    assert auth.auth_remember_token(selector + '$' + validator[::-1]) is None
+    # A wrong validator deletes the token
+    assert auth.auth_remember_token(value) is None
+
+
+def test_expired_remember_token():
+    auth, [user] = get_auth(remember_tokens=True)
+    value = auth.issue_remember_token(user)
+    selector, _ = value.split('$')
+    token = auth.RememberToken.by_selector(selector)
+    token.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    auth.db.session.commit()
+
+    assert auth.auth_remember_token(value) is None
+
+
+def test_purge_remember_tokens():
+    auth, [user] = get_auth(remember_tokens=True)
+    for i in range(3):
+        auth.issue_remember_token(user)
+    value = auth.issue_remember_token(user)
+    past = datetime.utcnow() - timedelta(days=1)
+    auth.db.query(auth.RememberToken).update({'expires_at': past})
+    auth.db.session.commit()
+    auth.issue_remember_token(user)
+
+    assert auth.purge_remember_tokens() == 4
+    assert auth.db.query(auth.RememberToken).count() == 1
+    assert auth.auth_remember_token(value) is None
+
+
+def test_login_issues_remember_token():
+    auth, [user] = get_auth(remember_tokens=True)
+    session = {}
+    auth.login(user, remember=False, session=session)
+    assert '_remember_set' not in session
+    auth.login(user, session=session)
+    value = session['_remember_set']
+    assert auth.auth_remember_token(value) == user
+
+
+def test_restore_session_with_remember_cookie():
+    auth, [user] = get_auth(remember_tokens=True)
+    app = Flask('test')
+    app.secret_key = os.urandom(32)
+    app.testing = True
+
+    @app.route('/protected/')
+    @auth.protected()
+    def protected():
+        return u'Welcome'
+
+    authcode.setup_for_flask(auth, app)
+    client = app.test_client()
+
+    with client.session_transaction() as sess:
+        sess[auth.csrf_key] = 'token'
+    data = {'login': 'meh', 'password': 'foobar', '_csrf_token': 'token'}
+    resp = client.post(auth.url_sign_in, data=data)
+    cookie = resp.headers['Set-Cookie']
+    assert auth.remember_cookie in cookie
+    assert 'HttpOnly' in cookie
+    assert auth.db.query(auth.RememberToken).count() == 1
+
+    value = cookie.split(';')[0].split('=', 1)[1]
+
+    # A client with an expired session but with the remember cookie
+    client = app.test_client()
+    client.set_cookie('localhost', auth.remember_cookie, value)
+    resp = client.get('/protected/')
+    assert resp.data == b'Welcome'
+    # The token was rotated
+    assert auth.db.query(auth.RememberToken).count() == 1
+    assert auth.auth_remember_token(value) is None
+
+    client = app.test_client()
+    client.set_cookie('localhost', auth.remember_cookie, value)
+    resp = client.get('/protected/')
+    assert resp.status_code == 303
+
+
+def _get_cookie(resp, name):
+    for header in resp.headers.getlist('Set-Cookie'):
+        if header.startswith(name + '='):
+            return header.split(';')[0].split('=', 1)[1]
+    return None
+
+
+def test_remember_cookie_with_bottle():
+    auth, [user] = get_auth(remember_tokens=True, wsgi=wsgi.bottle)
+    store = authcode.SessionStore(auth)
+    auth.db.create_all()
+
+    app = bottle.Bottle()
+    app.catchall = False
+
+    @app.route('/protected/')
+    @auth.protected()
+    def protected():
+        return u'Welcome'
+
+    authcode.setup_for_bottle(auth, app, session_store=store)
+    client = Client(app, BaseResponse)
+
+    resp = client.get(auth.url_sign_in)
+    sid = resp.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+    data = {'login': 'meh', 'password': 'foobar'}
+    # Bottle only reads the CSRF token from the query or the headers
+    headers = {auth.csrf_header: store.open(sid)[auth.csrf_key]}
+    resp = client.post(auth.url_sign_in, data=data, headers=headers)
+    assert resp.status_code == 303
+    value = _get_cookie(resp, auth.remember_cookie)
+    assert value
+    session = store.open(_get_cookie(resp, store.cookie_name))
+    assert REMEMBER_SET_KEY not in session
+
+    # A client without a session but with the remember cookie
+    client = Client(app, BaseResponse)
+    client.set_cookie('localhost', auth.remember_cookie, value)
+    resp = client.get('/protected/')
+    assert resp.data == b'Welcome'
@@ -0,0 +1,146 @@
+# coding=utf-8
+from __future__ import print_function
+import os
+import threading
+import time
+
+from sqlalchemy_wrapper import SQLAlchemy
+import authcode
+from authcode.audit import AuditLog, MemorySink
+from authcode.revocation import RevocationList, FileBackend
+
+from helpers import SECRET_KEY
+
+
+def test_revocation_list():
+    rl = RevocationList(ttl=100, buckets=10)
+    assert not rl.is_revoked('foo')
+    assert not rl.is_revoked(None)
+    rl.revoke('foo', now=1000)
+    rl.revoke('bar', now=1055)
+    assert rl.is_revoked('foo', now=1001)
+    assert rl.is_revoked('bar', now=1001)
+    assert not rl.is_revoked('meh', now=1001)
+    assert len(rl) == 2
+
+
+def test_revocation_list_expires():
+    rl = RevocationList(ttl=100, buckets=10, sync_interval=0)
+    rl.revoke('foo', now=1000)
+    rl.revoke('bar', now=1055)
+    assert rl.is_revoked('foo', now=1105)
+    assert not rl.is_revoked('foo', now=1111)
+    assert rl.is_revoked('bar', now=1111)
+    assert not rl.is_revoked('bar', now=1200)
+    assert len(rl) == 0
+
+
+def test_file_backend(tmpdir):
+    path = str(tmpdir.join('revoked'))
+    rl1 = RevocationList(ttl=100, backend=FileBackend(path), sync_interval=0)
+    rl2 = RevocationList(ttl=100, backend=FileBackend(path), sync_interval=0)
+
+    assert not rl2.is_revoked('foo')
+    rl1.revoke('foo')
+    assert rl2.is_revoked('foo')
+    rl2.revoke('bar')
+    assert rl1.is_revoked('bar')
+    assert rl2.is_revoked('bar')
+
+    # Old entries are ignored
+    FileBackend(path).publish('meh', 10)
+    assert not rl1.is_revoked('meh')
+
+    FileBackend(path).compact(ttl=100)
+    with open(path) as f:
+        assert len(f.readlines()) == 2
+    rl3 = RevocationList(ttl=100, backend=FileBackend(path), sync_interval=0)
+    assert rl3.is_revoked('foo')
+    assert rl3.is_revoked('bar')
+    assert not rl3.is_revoked('meh')
+
+    rl1.revoke('lorem')
+    assert rl2.is_revoked('lorem')
+
+    os.remove(path)
+    assert rl1.is_revoked('foo')
+
+
+def test_file_backend_concurrent_fetch(tmpdir):
+    path = str(tmpdir.join('revoked'))
+    publisher = FileBackend(path)
+    backend = FileBackend(path)
+    fetched = []
+
+    def fetch():
+        for _ in range(50):
+            fetched.extend(ident for _, ident in backend.fetch())
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(200):
+        publisher.publish('id{0}'.format(i), 1000)
+    for thread in threads:
+        thread.join()
+    fetched.extend(ident for _, ident in backend.fetch())
+
+    assert sorted(fetched) == sorted('id{0}'.format(i) for i in range(200))
+
+
+def test_publish_during_compaction(tmpdir, monkeypatch):
+    path = str(tmpdir.join('revoked'))
+    backend = FileBackend(path)
+    now = time.time()
+    backend.publish('foo', now)
+    rename = os.rename
+    threads = []
+
+    def rename_after_publishing(src, dst):
+        thread = threading.Thread(target=backend.publish, args=('bar', now))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.1)
+        rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', rename_after_publishing)
+    backend.compact(ttl=100)
+    threads[0].join()
+
+    with open(path) as f:
+        idents = [line.split()[1] for line in f]
+    assert idents == ['foo', 'bar']
+
+
+def test_revoke_session():
+    db = SQLAlchemy('sqlite:///:memory:')
+    sink = MemorySink()
+    audit_log = AuditLog(sink)
+    auth = authcode.Auth(
+        SECRET_KEY, db=db, revocation_list=RevocationList(), audit_log=audit_log)
+    User = auth.User
+    db.create_all()
+    user = User(login=u'meh', password='foobar')
+    db.session.add(user)
+    db.session.commit()
+
+    session1 = {}
+    session2 = {}
+    auth.login(user, session=session1)
+    auth.login(user, session=session2)
+    sid1 = auth.get_session_id(session1)
+    assert sid1
+    assert sid1 != auth.get_session_id(session2)
+    assert auth.get_user(session=session1) == user
+
+    auth.revoke_session(sid1)
+    assert auth.get_user(session=session1) is None
+    assert session1.get(auth.session_key) is None
+    assert auth.get_user(session=session2) == user
+    audit_log.flush()
+    events = [e['event'] for e in sink.events]
+    assert 'session.revoked' in events
+    assert 'session.tampered' not in events
+
+    auth.login(user, session=session1)
+    assert auth.get_user(session=session1) == user
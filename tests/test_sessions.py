@@ -0,0 +1,216 @@
+# coding=utf-8
+from __future__ import print_function
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy_wrapper import SQLAlchemy
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+import authcode
+from authcode import wsgi
+import bottle
+
+from helpers import SECRET_KEY
+
+
+def _get_store(auth_settings=None, **kwargs):
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, **(auth_settings or {}))
+    store = authcode.SessionStore(auth, **kwargs)
+    db.create_all()
+    user = auth.User(login=u'meh', password='foobar')
+    db.session.add(user)
+    db.session.commit()
+    return auth, store, user
+
+
+def test_session_model():
+    auth, store, user = _get_store()
+    assert store.Session.__tablename__ == 'users_sessions'
+    assert store.Session.__table__.c.user_id.index
+    assert auth.session_store is store
+
+
+def test_open_and_save():
+    auth, store, user = _get_store()
+    session = store.open(None)
+    assert session.new
+    assert not session.modified
+
+    session['foo'] = 'bar'
+    assert session.modified
+    store.save(session)
+    assert not session.new
+
+    store.cache.clear()
+    session2 = store.open(session.sid)
+    assert session2.sid == session.sid
+    assert session2['foo'] == 'bar'
+    assert not session2.new
+
+    assert store.open('nope').new
+
+
+def test_empty_session_is_deleted():
+    auth, store, user = _get_store()
+    session = store.open(None)
+    session['foo'] = 'bar'
+    store.save(session)
+    session.clear()
+    store.save(session)
+    assert auth.db.query(store.Session).count() == 0
+    assert store.open(session.sid).new
+
+
+def test_new_sid_on_login():
+    auth, store, user = _get_store()
+    session = store.open(None)
+    session['foo'] = 'bar'
+    store.save(session)
+    anonymous_sid = session.sid
+
+    auth.login(user, session=session)
+    store.save(session)
+    assert session.sid != anonymous_sid
+    assert store.open(anonymous_sid).new
+    assert auth.get_user(session=store.open(session.sid)) == user
+
+
+def test_list_and_revoke_user_sessions():
+    auth, store, user = _get_store()
+    sids = []
+    for i in range(3):
+        session = store.open(None)
+        auth.login(user, session=session)
+        store.save(session)
+        sids.append(session.sid)
+    anonymous = store.open(None)
+    anonymous['foo'] = 'bar'
+    store.save(anonymous)
+
+    assert sorted(s.sid for s in store.list_for_user(user.id)) == sorted(sids)
+
+    store.revoke(sids[0])
+    assert len(store.list_for_user(user.id)) == 2
+    assert store.open(sids[0]).new
+
+    assert store.revoke_user(user.id, keep=sids[1]) == 1
+    assert [s.sid for s in store.list_for_user(user.id)] == [sids[1]]
+    assert store.open(sids[2]).new
+    assert not store.open(anonymous.sid).new
+
+
+def test_revoked_session_is_not_saved_again():
+    auth, store, user = _get_store()
+    session = store.open(None)
+    auth.login(user, session=session)
+    store.save(session)
+    old_sid = session.sid
+
+    assert store.revoke_user(user.id) == 1
+    session['foo'] = 'bar'
+    store.save(session)
+    assert session.sid != old_sid
+    assert not session
+    assert auth.db.query(store.Session).count() == 0
+    assert auth.get_user(session=session) is None
+
+
+def test_gc():
+    auth, store, user = _get_store()
+    for i in range(5):
+        session = store.open(None)
+        session['foo'] = i
+        store.save(session)
+    past = datetime.utcnow() - timedelta(seconds=1)
+    auth.db.query(store.Session).update({'expires_at': past})
+    auth.db.session.commit()
+    session = store.open(None)
+    session['foo'] = 'bar'
+    store.save(session)
+
+    assert store.gc(batch_size=2) == 5
+    assert auth.db.query(store.Session).count() == 1
+
+
+def test_setup_for_flask_with_session_store():
+    auth, store, user = _get_store()
+    app = Flask('test')
+    app.testing = True
+
+    @app.route('/protected/')
+    @auth.protected()
+    def protected():
+        return u'Welcome'
+
+    authcode.setup_for_flask(auth, app, session_store=store)
+    client = app.test_client()
+
+    resp = client.get(auth.url_sign_in)
+    assert store.cookie_name in resp.headers['Set-Cookie']
+    sid = resp.headers['Set-Cookie'].split(';')[0].split('=', 1)[1]
+    data = {
+        'login': 'meh', 'password': 'foobar',
+        '_csrf_token': store.open(sid)[auth.csrf_key],
+    }
+    client.post(auth.url_sign_in, data=data)
+    resp = client.get('/protected/')
+    assert resp.data == b'Welcome'
+
+    assert len(store.list_for_user(user.id)) == 1
+    store.revoke_user(user.id)
+    resp = client.get('/protected/')
+    assert resp.status_code == 303
+
+
+def _get_bottle_app(store, auth):
+    app = bottle.Bottle()
+    app.catchall = False
+
+    @app.route('/')
+    def index():
+        return u'Hello'
+
+    @app.route('/protected/')
+    @auth.protected()
+    def protected():
+        return u'Welcome'
+
+    authcode.setup_for_bottle(auth, app, session_store=store)
+    return app
+
+
+def _get_cookie(resp, name):
+    for header in resp.headers.getlist('Set-Cookie'):
+        if header.startswith(name + '='):
+            return header.split(';')[0].split('=', 1)[1]
+    return None
+
+
+def test_setup_for_bottle_with_session_store():
+    auth, store, user = _get_store(auth_settings={'wsgi': wsgi.bottle})
+    app = _get_bottle_app(store, auth)
+    client = Client(app, BaseResponse)
+
+    # An empty session is not an error
+    resp = client.get('/')
+    assert resp.status_code == 200
+
+    resp = client.get(auth.url_sign_in)
+    sid = _get_cookie(resp, store.cookie_name)
+    assert sid
+    data = {'login': 'meh', 'password': 'foobar'}
+    # Bottle only reads the CSRF token from the query or the headers
+    headers = {auth.csrf_header: store.open(sid)[auth.csrf_key]}
+    resp = client.post(auth.url_sign_in, data=data, headers=headers)
+    assert resp.status_code == 303
+    # The session ID is rotated on login, and sent with the redirect
+    new_sid = _get_cookie(resp, store.cookie_name)
+    assert new_sid and new_sid != sid
+
+    resp = client.get('/protected/')
+    assert resp.data == b'Welcome'
+
+    store.revoke_user(user.id)
+    resp = client.get('/protected/')
+    assert resp.status_code == 303
@@ -0,0 +1,166 @@
+# coding=utf-8
+from __future__ import print_function
+import os
+
+from authcode._compat import to_unicode
+from authcode.stuffing import (
+    ALLOW, FRICTION, REJECT, CountMinSketch, HyperLogLog, StuffingDetector)
+from flask import Flask
+from sqlalchemy_wrapper import SQLAlchemy
+import authcode
+
+from helpers import SECRET_KEY
+
+
+def test_hyperloglog():
+    hll = HyperLogLog(precision=10)
+    assert hll.count() == 0
+    for i in range(5000):
+        hll.add(u'user{0}'.format(i))
+        hll.add(u'user{0}'.format(i))
+    assert 4500 < hll.count() < 5500
+    assert len(hll.registers) == 1024
+
+
+def test_count_min_sketch():
+    cms = CountMinSketch(width=256, depth=4)
+    for i in range(1000):
+        cms.add(u'user{0}'.format(i % 100))
+    cms.add(u'target', 50)
+    assert cms.estimate(u'target') >= 50
+    assert cms.estimate(u'user1') >= 10
+    assert cms.estimate(u'target') < 100
+
+
+def test_detector_distinct_logins():
+    detector = StuffingDetector(friction_logins=5, reject_logins=20)
+    for i in range(4):
+        detector.record_failure('1.2.3.4', u'user{0}'.format(i))
+    assert detector.check('1.2.3.4', u'meh') == ALLOW
+
+    # The same login again and again doesn't count
+    for _ in range(10):
+        detector.record_failure('1.2.3.4', u'user0')
+    assert detector.estimate_logins('1.2.3.4') == 4
+
+    for i in range(4, 10):
+        detector.record_failure('1.2.3.4', u'user{0}'.format(i))
+    assert detector.check('1.2.3.4', u'meh') == FRICTION
+    for i in range(10, 40):
+        detector.record_failure('1.2.3.4', u'user{0}'.format(i))
+    assert detector.check('1.2.3.4', u'meh') == REJECT
+    assert detector.check('5.6.7.8', u'meh') == ALLOW
+
+
+def test_detector_account_failures():
+    detector = StuffingDetector(friction_failures=3, reject_failures=6)
+    for i in range(3):
+        detector.record_failure('10.0.0.{0}'.format(i), u'Meh')
+    assert detector.check('10.0.1.1', u'meh') == FRICTION
+    for i in range(3):
+        detector.record_failure('10.0.0.{0}'.format(i), u'meh')
+    assert detector.check(None, u'MEH') == REJECT
+    assert detector.check(None, u'other') == ALLOW
+
+
+def test_fixed_memory():
+    detector = StuffingDetector(max_sources=100)
+    memory = detector.memory_size()
+    for i in range(1000):
+        detector.record_failure('10.0.{0}.{1}'.format(i // 256, i % 256), u'user')
+    assert len(detector.sources) == 100
+    assert detector.memory_size() == memory
+
+
+def test_windows(monkeypatch):
+    import authcode.stuffing
+    now = [1000.0 * 60]
+    monkeypatch.setattr(authcode.stuffing, 'time', lambda: now[0])
+    detector = StuffingDetector(window=60, friction_failures=100)
+    for i in range(10):
+        detector.record_failure('1.2.3.4', u'user{0}'.format(i))
+    logins = detector.estimate_logins('1.2.3.4')
+    assert 8 <= logins <= 12
+    assert detector.estimate_failures(u'user1') == 1
+
+    # Half of the next window: the previous one weights half
+    now[0] += 90
+    assert abs(detector.estimate_logins('1.2.3.4') - logins / 2.0) <= 1
+    detector.record_failure('1.2.3.4', u'user1')
+    assert detector.estimate_failures(u'user1') == 2  # 1 + 0.5, rounded
+
+    # Two windows later everything is forgotten
+    now[0] += 120
+    assert detector.estimate_logins('1.2.3.4') == 0
+    assert detector.estimate_failures(u'user1') == 0
+
+
+def test_snapshot():
+    detector = StuffingDetector()
+    for i in range(10):
+        detector.record_failure('1.2.3.4', u'user{0}'.format(i))
+    detector.record_failure('5.6.7.8', u'user1')
+    detector.check('1.2.3.4', u'user1')
+    snapshot = detector.snapshot(top=1)
+    assert snapshot['failures'] == 11
+    assert snapshot['sources_tracked'] == 2
+    top, = snapshot['top_sources']
+    assert top['source'] == '1.2.3.4'
+    assert top['failures'] == 10
+    assert 8 <= top['logins'] <= 12
+    assert snapshot['verdicts'][FRICTION] == 1
+
+
+def _get_flask_app(**kwargs):
+    db = SQLAlchemy('sqlite:///:memory:')
+    auth = authcode.Auth(SECRET_KEY, db=db, **kwargs)
+    db.create_all()
+    user = auth.User(login=u'meh', password='foobar')
+    db.add(user)
+    db.commit()
+
+    app = Flask('test')
+    app.secret_key = os.urandom(32)
+    app.testing = True
+    authcode.setup_for_flask(auth, app)
+    auth.session = {}
+    return auth, app, user
+
+
+def test_sign_in_rejected():
+    detector = StuffingDetector(friction_logins=2, reject_logins=3)
+    auth, app, user = _get_flask_app(stuffing_detector=detector)
+    client = app.test_client()
+    csrf_token = auth.get_csrf_token()
+
+    for i in range(3):
+        r = client.post(auth.url_sign_in, data=dict(
+            login=u'user{0}'.format(i), password='foobar', _csrf_token=csrf_token))
+        assert u'<!-- ERROR -->' in to_unicode(r.data)
+    assert detector.estimate_logins('127.0.0.1') == 3
+
+    r = client.post(auth.url_sign_in, data=dict(
+        login=u'meh', password='foobar', _csrf_token=csrf_token))
+    assert u'<!-- ERROR TOO MANY ATTEMPTS -->' in to_unicode(r.data)
+
+
+def test_sign_in_friction():
+    detector = StuffingDetector(friction_logins=2, reject_logins=100)
+    auth, app, user = _get_flask_app(
+        stuffing_detector=detector,
+        stuffing_challenge=lambda request: request.form.get('captcha') == 'ok',
+    )
+    client = app.test_client()
+    csrf_token = auth.get_csrf_token()
+
+    for i in range(2):
+        client.post(auth.url_sign_in, data=dict(
+            login=u'user{0}'.format(i), password='foobar', _csrf_token=csrf_token))
+
+    r = client.post(auth.url_sign_in, data=dict(
+        login=u'meh', password='foobar', _csrf_token=csrf_token))
+    assert u'<!-- ERROR CHALLENGE -->' in to_unicode(r.data)
+
+    r = client.post(auth.url_sign_in, data=dict(
+        login=u'meh', password='foobar', captcha='ok', _csrf_token=csrf_token))
+    assert r.status_code == 303
@@ -0,0 +1,80 @@
+# coding=utf-8
+from __future__ import print_function
+
+from sqlalchemy_wrapper import SQLAlchemy
+import authcode
+import pytest
+
+from helpers import SECRET_KEY
+
+
+def _get_router():
+    router = authcode.TenantRouter(SECRET_KEY, db_factory=SQLAlchemy, roles=True)
+    router.add('acme', hosts=['acme.example.com', 'www.acme.com'],
+               database='sqlite:///:memory:')
+    router.add('Globex Corp', database='sqlite:///:memory:', path='globex')
+    router.add('initech', path='', hosts=['initech.com'],
+               database='sqlite:///:memory:', roles=False)
+    return router
+
+
+def test_lazy_tenants():
+    router = _get_router()
+    assert len(router) == 3
+    assert 'acme' in router
+    assert not router.is_built('acme')
+
+    auth = router.get('acme')
+    assert router.is_built('acme')
+    assert not router.is_built('globexcorp')
+    assert router.get('acme') is auth
+    assert auth.users_model_name == 'AcmeUser'
+    assert auth.url_sign_in == '/acme/sign-in/'
+    assert hasattr(auth, 'Role')
+    assert not hasattr(router.get('initech'), 'Role')
+
+
+def test_match():
+    router = _get_router()
+    acme = router.get('acme')
+    globex = router.get('globexcorp')
+
+    assert router.match(host='acme.example.com') is acme
+    assert router.match(host='WWW.ACME.COM:8080') is acme
+    assert router.match(path='/acme/sign-in/') is acme
+    assert router.match(path='/globex/sign-in/') is globex
+    assert router.match(path='/globexcorp/sign-in/') is None
+    assert router.match(host='example.com', path='/') is None
+    assert router.match(host='initech.com', path='/acme/') is router.get('initech')
+
+    environ = {'HTTP_HOST': 'localhost', 'PATH_INFO': '/globex/'}
+    assert router.match_environ(environ) is globex
+
+
+def test_shared_databases():
+    router = _get_router()
+    router.add('other', database='sqlite:///:memory:')
+    acme = router.get('acme')
+    other = router.get('other')
+    assert acme.db is other.db
+    assert len(router.databases) == 1
+
+    acme.db.create_all()
+    user = acme.User(login=u'meh', password='foobar')
+    acme.db.add(user)
+    acme.db.commit()
+    assert acme.User.by_login(u'meh') == user
+    assert other.User.by_login(u'meh') is None
+    assert acme.User.__tablename__ != other.User.__tablename__
+
+
+def test_readd_tenant():
+    router = _get_router()
+    router.add('acme', hosts=['acme.org'], database='sqlite:///:memory:')
+    assert router.match(host='acme.example.com') is None
+    assert router.match(host='acme.org') is router.get('Acme')
+    assert router.is_built('ACME')
+
+    with pytest.raises(ValueError):
+        router.add('acme', database='sqlite:///:memory:')
+    assert router.match(host='acme.org') is router.get('acme')
@@ -125,6 +125,54 @@ def test_login_right_credentials():
     assert auth.session_key in auth.session
 
 
+def test_login_view_rejects_api_keys():
+    auth, app, user = _get_flask_app(api_keys=True)
+    client = app.test_client()
+    _, value = auth.ApiKey.create(user, scopes=['read'])
+    auth.db.commit()
+
+    data = {
+        'api_key': value,
+        '_csrf_token': auth.get_csrf_token(),
+    }
+    r = client.post(auth.url_sign_in, data=data)
+    assert u'<!-- ERROR -->' in to_unicode(r.data)
+    assert auth.session_key not in auth.session
+    assert auth.authenticate({'api_key': value}) == user
+
+
+def test_login_view_rejects_access_tokens():
+    auth, app, user = _get_flask_app()
+    client = app.test_client()
+    tokens = auth.issue_bearer_tokens(user, scopes=['read:only'])
+
+    data = {
+        'access_token': tokens['access_token'],
+        '_csrf_token': auth.get_csrf_token(),
+    }
+    r = client.post(auth.url_sign_in, data=data)
+    assert u'<!-- ERROR -->' in to_unicode(r.data)
+    assert auth.session_key not in auth.session
+    assert auth.authenticate({'access_token': tokens['access_token']}) == user
+
+
+def test_login_view_rejects_authorization_headers():
+    import base64
+
+    auth, app, user = _get_flask_app()
+    client = app.test_client()
+    header = 'Basic ' + to_unicode(base64.b64encode(b'meh:foobar'))
+
+    data = {
+        'authorization': header,
+        '_csrf_token': auth.get_csrf_token(),
+    }
+    r = client.post(auth.url_sign_in, data=data)
+    assert u'<!-- ERROR -->' in to_unicode(r.data)
+    assert auth.session_key not in auth.session
+    assert auth.authenticate({'authorization': header}) == user
+
+
 def test_login_redirect_if_already_logged_in():
     auth, app, user = _get_flask_app()
     client = app.test_client()
@@ -376,6 +424,28 @@ def test_change_password_mismatch():
     assert u'<!-- ERROR MISMATCH -->' in data
 
 
+def test_change_password_breached(tmpdir):
+    from hashlib import sha1
+    from authcode.breach import convert
+
+    src = tmpdir.join('dump.txt')
+    src.write_text(to_unicode(sha1(b'lalalala').hexdigest()), encoding='utf8')
+    dst = str(tmpdir.join('breached.bin'))
+    convert(str(src), dst)
+
+    auth, app, user = _get_flask_app(breached_passwords=dst)
+    client = app.test_client()
+    auth.login(user)
+    csrf_token = auth.get_csrf_token()
+
+    r = client.post(auth.url_change_password, data=dict(
+        password='foobar', np1='lalalala', np2='lalalala', _csrf_token=csrf_token))
+    data = to_unicode(r.data)
+    print(data)
+    assert u'<!-- ERROR BREACHED -->' in data
+    assert user.has_password('foobar')
+
+
 def test_change_password_no_csrf():
     auth, app, user = _get_flask_app()
     client = app.test_client()
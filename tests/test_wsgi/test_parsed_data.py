@@ -0,0 +1,70 @@
+# coding=utf-8
+from __future__ import print_function, absolute_import
+import json
+
+from authcode import wsgi
+
+
+def _werkzeug_request(**kwargs):
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+    return Request(EnvironBuilder(method='POST', **kwargs).get_environ())
+
+
+def test_werkzeug_form_is_parsed_once():
+    request = _werkzeug_request(
+        query_string={'next': '/foo/'},
+        data={'login': u'meh', 'password': u'foobar', '_csrf_token': 'abc'},
+    )
+    get_json_calls = []
+    get_json = request.get_json
+
+    def counting_get_json(*args, **kwargs):
+        get_json_calls.append(1)
+        return get_json(*args, **kwargs)
+
+    request.get_json = counting_get_json
+
+    assert wsgi.werkzeug.get_from_params(request, '_csrf_token') == 'abc'
+    assert wsgi.werkzeug.get_from_params(request, 'password') == 'foobar'
+    assert wsgi.werkzeug.get_from_params(request, 'next') == '/foo/'
+    assert wsgi.werkzeug.get_from_params(request, 'nope') is None
+
+    post_data = wsgi.werkzeug.get_post_data(request)
+    assert post_data['login'] == 'meh'
+    assert 'next' not in post_data
+    assert len(get_json_calls) == 1
+
+
+def test_werkzeug_json():
+    data = {'login': u'meh', 'password': u'foobar', 'remember': False, 'n': 3}
+    request = _werkzeug_request(
+        data=json.dumps(data), content_type='application/json')
+    assert wsgi.werkzeug.get_from_params(request, 'login') == 'meh'
+    assert wsgi.werkzeug.get_from_params(request, 'n') == 3
+    assert wsgi.werkzeug.get_post_data(request) == data
+    assert wsgi.werkzeug.get_post_data(request) is wsgi.werkzeug.get_post_data(request)
+
+
+def test_werkzeug_invalid_json():
+    request = _werkzeug_request(data='[1, 2', content_type='application/json')
+    assert wsgi.werkzeug.get_from_params(request, 'login') is None
+    assert wsgi.werkzeug.get_post_data(request) == {}
+
+
+def test_bottle_is_parsed_once():
+    from bottle import BaseRequest
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(
+        method='POST',
+        query_string={'_csrf_token': 'abc'},
+        data={'login': u'meh', 'password': u'foobar'},
+    ).get_environ()
+    request = BaseRequest(environ)
+
+    assert wsgi.bottle.get_from_params(request, '_csrf_token') == 'abc'
+    assert wsgi.bottle.get_from_params(request, 'login') is None
+    post_data = wsgi.bottle.get_post_data(request)
+    assert post_data == {'login': 'meh', 'password': 'foobar'}
+    assert wsgi.bottle.get_post_data(request) is post_data